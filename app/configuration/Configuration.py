@@ -4,61 +4,114 @@ import logging
 import os
 import sys
 from dataclasses import dataclass
+from tydom.CredentialStore import CredentialStore
 from tydom.TydomClient import TydomClient
 
 logger = logging.getLogger(__name__)
 
 # Configuration constants
 LOG_LEVEL = 'LOG_LEVEL'
+LOG_FORMAT = 'LOG_FORMAT'
+LOG_DEVICE_INTERVAL = 'LOG_DEVICE_INTERVAL'
+LOG_PAYLOAD_SAMPLE_RATE = 'LOG_PAYLOAD_SAMPLE_RATE'
+DATA_DIR = 'DATA_DIR'
 MQTT_HOST = 'MQTT_HOST'
 MQTT_PASSWORD = 'MQTT_PASSWORD'
 MQTT_PORT = 'MQTT_PORT'
 MQTT_SSL = 'MQTT_SSL'
 MQTT_USER = 'MQTT_USER'
+MQTT_STATE_HEARTBEAT = 'MQTT_STATE_HEARTBEAT'
 TYDOM_ALARM_HOME_ZONE = 'TYDOM_ALARM_HOME_ZONE'
 TYDOM_ALARM_NIGHT_ZONE = 'TYDOM_ALARM_NIGHT_ZONE'
 TYDOM_ALARM_PIN = 'TYDOM_ALARM_PIN'
 TYDOM_IP = 'TYDOM_IP'
+TYDOM_PORT = 'TYDOM_PORT'
 TYDOM_MAC = 'TYDOM_MAC'
 TYDOM_PASSWORD = 'TYDOM_PASSWORD'
 DELTADORE_LOGIN = 'DELTADORE_LOGIN'
 DELTADORE_PASSWORD = 'DELTADORE_PASSWORD'
 THERMOSTAT_CUSTOM_PRESETS = 'THERMOSTAT_CUSTOM_PRESETS'
+TYDOM_QUEUE_SIZE = 'TYDOM_QUEUE_SIZE'
+TYDOM_PING_INTERVAL = 'TYDOM_PING_INTERVAL'
+TYDOM_REFRESH_INTERVAL = 'TYDOM_REFRESH_INTERVAL'
+TYDOM_QUEUE_POLICY = 'TYDOM_QUEUE_POLICY'
+TYDOM_REQUEST_RATE = 'TYDOM_REQUEST_RATE'
+TYDOM_TRIGGER_INTERVAL = 'TYDOM_TRIGGER_INTERVAL'
+METRICS_PORT = 'METRICS_PORT'
+TYDOM_RECORD_FILE = 'TYDOM_RECORD_FILE'
+METRICS_MQTT_INTERVAL = 'METRICS_MQTT_INTERVAL'
+STATE_SNAPSHOT_INTERVAL = 'STATE_SNAPSHOT_INTERVAL'
 
 
 @dataclass
 class Configuration:
     log_level = str
+    log_format = str
+    log_device_interval = int
+    log_payload_sample_rate = int
+    data_dir = str
     mqtt_host = str
     mqtt_password = str
     mqtt_port = int
     mqtt_ssl = bool
     mqtt_user = str
+    mqtt_state_heartbeat = int
     tydom_alarm_home_zone = int
     tydom_alarm_night_zone = int
     tydom_alarm_pin = str
     tydom_ip = str
+    tydom_port = int
     tydom_mac = str
     tydom_password = str
     thermostat_custom_presets = list
+    tydom_queue_size = int
+    tydom_ping_interval = int
+    tydom_refresh_interval = int
+    tydom_queue_policy = str
+    tydom_request_rate = float
+    tydom_trigger_interval = int
+    metrics_port = int
+    tydom_record_file = str
+    metrics_mqtt_interval = int
+    state_snapshot_interval = int
 
     def __init__(self):
         self.log_level = os.getenv(LOG_LEVEL, 'INFO').upper()
+        self.log_format = os.getenv(LOG_FORMAT, 'text').lower()
+        self.log_device_interval = int(os.getenv(LOG_DEVICE_INTERVAL, 60))
+        self.log_payload_sample_rate = int(
+            os.getenv(LOG_PAYLOAD_SAMPLE_RATE, 10))
+        self.data_dir = os.getenv(DATA_DIR, '/data')
         self.mqtt_host = os.getenv(MQTT_HOST, 'localhost')
         self.mqtt_password = os.getenv(MQTT_PASSWORD, None)
         self.mqtt_port = os.getenv(MQTT_PORT, 1883)
         self.mqtt_ssl = os.getenv(MQTT_SSL, False)
         self.mqtt_user = os.getenv(MQTT_USER, None)
+        self.mqtt_state_heartbeat = int(os.getenv(MQTT_STATE_HEARTBEAT, 0))
         self.tydom_alarm_home_zone = os.getenv(TYDOM_ALARM_HOME_ZONE, 1)
         self.tydom_alarm_night_zone = os.getenv(TYDOM_ALARM_NIGHT_ZONE, 2)
         self.tydom_alarm_pin = os.getenv(TYDOM_ALARM_PIN, None)
         self.tydom_ip = os.getenv(TYDOM_IP, 'mediation.tydom.com')
+        self.tydom_port = int(os.getenv(TYDOM_PORT, 443))
         self.tydom_mac = os.getenv(TYDOM_MAC, None)
         self.tydom_password = os.getenv(TYDOM_PASSWORD, None)
         self.deltadore_login = os.getenv(DELTADORE_LOGIN, None)
         self.deltadore_password = os.getenv(DELTADORE_PASSWORD, None)
+        # Delta Dore credentials cache, when the password is retrieved from
+        # the cloud
+        self.credential_store = None
         self.thermostat_custom_presets = os.getenv(
             THERMOSTAT_CUSTOM_PRESETS, None)
+        self.tydom_queue_size = int(os.getenv(TYDOM_QUEUE_SIZE, 256))
+        self.tydom_ping_interval = int(os.getenv(TYDOM_PING_INTERVAL, 10))
+        self.tydom_refresh_interval = int(os.getenv(TYDOM_REFRESH_INTERVAL, 42))
+        self.tydom_queue_policy = os.getenv(TYDOM_QUEUE_POLICY, 'block')
+        self.tydom_request_rate = float(os.getenv(TYDOM_REQUEST_RATE, 10))
+        self.tydom_trigger_interval = int(os.getenv(TYDOM_TRIGGER_INTERVAL, 10))
+        self.metrics_port = int(os.getenv(METRICS_PORT, 0))
+        self.tydom_record_file = os.getenv(TYDOM_RECORD_FILE, None)
+        self.metrics_mqtt_interval = int(os.getenv(METRICS_MQTT_INTERVAL, 0))
+        self.state_snapshot_interval = int(os.getenv(STATE_SNAPSHOT_INTERVAL, 60))
 
     @staticmethod
     def load():
@@ -81,12 +134,24 @@ class Configuration:
                     if LOG_LEVEL in data and data[LOG_LEVEL] != '':
                         self.log_level = data[LOG_LEVEL].upper()
 
+                    if LOG_FORMAT in data and data[LOG_FORMAT] != '':
+                        self.log_format = data[LOG_FORMAT].lower()
+
+                    if LOG_DEVICE_INTERVAL in data and data[LOG_DEVICE_INTERVAL] != '':
+                        self.log_device_interval = int(data[LOG_DEVICE_INTERVAL])
+
+                    if LOG_PAYLOAD_SAMPLE_RATE in data and data[LOG_PAYLOAD_SAMPLE_RATE] != '':
+                        self.log_payload_sample_rate = int(data[LOG_PAYLOAD_SAMPLE_RATE])
+
                     if TYDOM_MAC in data and data[TYDOM_MAC] != '':
                         self.tydom_mac = data[TYDOM_MAC]
 
                     if TYDOM_IP in data and data[TYDOM_IP] != '':
                         self.tydom_ip = data[TYDOM_IP]
 
+                    if TYDOM_PORT in data and data[TYDOM_PORT] != '':
+                        self.tydom_port = int(data[TYDOM_PORT])
+
                     if TYDOM_PASSWORD in data and data[TYDOM_PASSWORD] != '':
                         self.tydom_password = data[TYDOM_PASSWORD]
 
@@ -105,6 +170,36 @@ class Configuration:
                     if TYDOM_ALARM_NIGHT_ZONE in data and data[TYDOM_ALARM_NIGHT_ZONE] != '':
                         self.tydom_alarm_night_zone = data[TYDOM_ALARM_NIGHT_ZONE]
 
+                    if TYDOM_PING_INTERVAL in data and data[TYDOM_PING_INTERVAL] != '':
+                        self.tydom_ping_interval = int(data[TYDOM_PING_INTERVAL])
+
+                    if TYDOM_REFRESH_INTERVAL in data and data[TYDOM_REFRESH_INTERVAL] != '':
+                        self.tydom_refresh_interval = int(data[TYDOM_REFRESH_INTERVAL])
+
+                    if TYDOM_QUEUE_SIZE in data and data[TYDOM_QUEUE_SIZE] != '':
+                        self.tydom_queue_size = int(data[TYDOM_QUEUE_SIZE])
+
+                    if TYDOM_QUEUE_POLICY in data and data[TYDOM_QUEUE_POLICY] != '':
+                        self.tydom_queue_policy = data[TYDOM_QUEUE_POLICY]
+
+                    if TYDOM_REQUEST_RATE in data and data[TYDOM_REQUEST_RATE] != '':
+                        self.tydom_request_rate = float(data[TYDOM_REQUEST_RATE])
+
+                    if TYDOM_TRIGGER_INTERVAL in data and data[TYDOM_TRIGGER_INTERVAL] != '':
+                        self.tydom_trigger_interval = int(data[TYDOM_TRIGGER_INTERVAL])
+
+                    if TYDOM_RECORD_FILE in data and data[TYDOM_RECORD_FILE] != '':
+                        self.tydom_record_file = data[TYDOM_RECORD_FILE]
+
+                    if METRICS_PORT in data and data[METRICS_PORT] != '':
+                        self.metrics_port = int(data[METRICS_PORT])
+
+                    if METRICS_MQTT_INTERVAL in data and data[METRICS_MQTT_INTERVAL] != '':
+                        self.metrics_mqtt_interval = int(data[METRICS_MQTT_INTERVAL])
+
+                    if STATE_SNAPSHOT_INTERVAL in data and data[STATE_SNAPSHOT_INTERVAL] != '':
+                        self.state_snapshot_interval = int(data[STATE_SNAPSHOT_INTERVAL])
+
                     if MQTT_HOST in data and data[MQTT_HOST] != '':
                         self.mqtt_host = data[MQTT_HOST]
 
@@ -120,6 +215,9 @@ class Configuration:
                     if MQTT_SSL in data and data[MQTT_SSL] != '':
                         self.mqtt_ssl = data[MQTT_SSL]
 
+                    if MQTT_STATE_HEARTBEAT in data and data[MQTT_STATE_HEARTBEAT] != '':
+                        self.mqtt_state_heartbeat = int(data[MQTT_STATE_HEARTBEAT])
+
                 except Exception as e:
                     logger.error('Parsing error %s', e)
 
@@ -128,10 +226,18 @@ class Configuration:
 
     def override_configuration_with_deltadore(self):
         if self.deltadore_login is not None and self.deltadore_login != '' and self.deltadore_password is not None and self.deltadore_password != '':
+            # Kept to refresh the password in the background
+            self.credential_store = CredentialStore(
+                self.deltadore_login, self.deltadore_password, self.tydom_mac,
+                file_path=self.credentials_file_path)
             tydom_password = TydomClient.getTydomCredentials(
-                self.deltadore_login, self.deltadore_password, self.tydom_mac)
+                self.credential_store)
             self.tydom_password = tydom_password
 
+    @property
+    def credentials_file_path(self):
+        return os.path.join(self.data_dir, 'credentials.json')
+
     def validate(self):
         configuration_to_print = copy.copy(self)
 
@@ -144,6 +250,7 @@ class Configuration:
             configuration_to_print.deltadore_password)
         configuration_to_print.tydom_alarm_pin = Configuration.mask_value(
             configuration_to_print.tydom_alarm_pin)
+        configuration_to_print.credential_store = None
 
         logger.info('Validating configuration (%s',
                     configuration_to_print.to_json())
@@ -156,6 +263,19 @@ class Configuration:
             logger.error('Tydom password must be defined')
             sys.exit(1)
 
+        if self.tydom_queue_policy not in ('block', 'drop_oldest', 'coalesce'):
+            logger.error(
+                'Tydom queue policy must be one of block, drop_oldest, coalesce')
+            sys.exit(1)
+
+        if self.tydom_request_rate < 0:
+            logger.error('Tydom request rate must be positive (0 to disable)')
+            sys.exit(1)
+
+        if self.log_format not in ('text', 'json'):
+            logger.error('Log format must be one of text, json')
+            sys.exit(1)
+
         logger.info('The configuration is valid')
 
     def to_json(self):
@@ -0,0 +1,148 @@
+"""Logging helpers for the per-frame code paths.
+
+Device updates can arrive several times per second, so their logs are
+rate-limited per device, payload dumps are sampled and truncated, and
+nothing is formatted unless the record is actually emitted.
+"""
+import json
+import logging
+import time
+
+# Attributes of every LogRecord, anything else comes from `extra`
+RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {
+    'message', 'asctime'}
+
+TEXT_FORMAT = '%(asctime)s - %(name)-20s - %(levelname)-7s - %(message)s'
+
+LOG_FORMATS = ('text', 'json')
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the `extra` fields of the record."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level, log_format='text'):
+    for handler in logging.root.handlers[:]:
+        logging.root.removeHandler(handler)
+    handler = logging.StreamHandler()
+    if log_format == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    logging.root.addHandler(handler)
+    logging.root.setLevel(level)
+
+
+class Payload:
+    """Defers the conversion of a payload to text until it is logged, and
+    truncates it."""
+
+    __slots__ = ('payload', 'limit')
+
+    def __init__(self, payload, limit=256):
+        self.payload = payload
+        self.limit = limit
+
+    def __str__(self):
+        payload = self.payload
+        if isinstance(payload, (bytes, bytearray)):
+            text = bytes(payload[:self.limit + 1]).decode('utf-8', 'replace')
+            size = len(payload)
+        else:
+            text = str(payload)
+            size = len(text)
+        if size > self.limit:
+            return '{}... ({} bytes)'.format(text[:self.limit], size)
+        return text
+
+
+class DeviceLogger:
+    """Logs device events at most once per interval and per device.
+
+    Suppressed messages are counted and reported with the next emitted
+    message of the same device. Payload dumps are only emitted at DEBUG
+    level, one out of `sample_rate`.
+    """
+
+    def __init__(self, logger, interval=60, sample_rate=10, payload_limit=256):
+        self.logger = logger
+        self.interval = interval
+        self.sample_rate = max(1, sample_rate)
+        self.payload_limit = payload_limit
+        # device -> [last emit time, suppressed count]
+        self.devices = {}
+        self.dumps = 0
+
+    def configure(self, interval=None, sample_rate=None):
+        if interval is not None:
+            self.interval = interval
+        if sample_rate is not None:
+            self.sample_rate = max(1, sample_rate)
+
+    def log(self, level, device, msg, *args):
+        if not self.logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        state = self.devices.get(device)
+        if state is None:
+            state = self.devices[device] = [None, 0]
+        elif self.interval > 0 and now - state[0] < self.interval:
+            state[1] += 1
+            return
+        suppressed = state[1]
+        state[0] = now
+        state[1] = 0
+        if suppressed:
+            msg += ' (%d similar messages suppressed)'
+            args += (suppressed,)
+        self.logger.log(level, msg, *args, extra={'device': device})
+
+    def info(self, device, msg, *args):
+        self.log(logging.INFO, device, msg, *args)
+
+    def debug(self, device, msg, *args):
+        self.log(logging.DEBUG, device, msg, *args)
+
+    def forget(self, device):
+        self.devices.pop(device, None)
+
+    # Sampled and truncated dump of a payload at DEBUG level
+    def dump(self, msg, payload):
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        self.dumps += 1
+        if (self.dumps - 1) % self.sample_rate != 0:
+            return
+        self.logger.debug(msg, Payload(payload, self.payload_limit))
+
+    def payload(self, payload):
+        return Payload(payload, self.payload_limit)
+
+
+# Loggers of the hot paths, configured once from the configuration
+device_loggers = []
+
+
+def get_device_logger(logger):
+    device_logger = DeviceLogger(logger)
+    device_loggers.append(device_logger)
+    return device_logger
+
+
+def configure_device_loggers(interval=None, sample_rate=None):
+    for device_logger in device_loggers:
+        device_logger.configure(interval, sample_rate)
@@ -1,15 +1,23 @@
 #!/usr/bin/env python3
 import asyncio
 import logging.config
+import os
 import socket
-import sys
 import signal
 import websockets
 
 from configuration.Configuration import Configuration
+from logs.HotPathLogging import configure_device_loggers, setup_logging
+from metrics.MemoryUsage import MemoryUsage
+from metrics.Metrics import MetricsServer, publish_diagnostics
 from mqtt.MqttClient import MqttClient
+from tydom.DeviceRegistry import DeviceRegistry
 from tydom.TydomClient import TydomClient
+from tydom.FramePipeline import FramePipeline
+from tydom.FrameRecorder import FrameRecorder
 from tydom.MessageHandler import MessageHandler
+from tydom.ReconnectSupervisor import ReconnectSupervisor
+from tydom.StateSnapshot import StateSnapshot
 
 # Setup logger configuration
 logging.basicConfig(
@@ -26,11 +34,10 @@ configuration = Configuration.load()
 
 # Reconfigure logger after having loaded the configuration (because the
 # log level can have changed)
-for logger_handler in logging.root.handlers[:]:
-    logging.root.removeHandler(logger_handler)
-logging.basicConfig(
-    level=configuration.log_level,
-    format='%(asctime)s - %(name)-20s - %(levelname)-7s - %(message)s')
+setup_logging(configuration.log_level, configuration.log_format)
+configure_device_loggers(
+    interval=configuration.log_device_interval,
+    sample_rate=configuration.log_payload_sample_rate)
 
 # Warning levels only for the following chatty modules (if not debug)
 if configuration.log_level != 'DEBUG':
@@ -38,47 +45,80 @@ if configuration.log_level != 'DEBUG':
     logging.getLogger('websockets').setLevel(logging.WARNING)
 
 
+# Ask the Tydom for its configuration and states. Runs while the frames are
+# received, the configuration requests wait for their response
+async def start_tydom():
+    try:
+        if not tydom_client.setup_done:
+            await tydom_client.setup()
+        else:
+            # Setup already done by this process, the configuration is known
+            await tydom_client.resync()
+        memory_usage.log()
+    except Exception as e:
+        logger.warning('Unable to setup tydom client (%s)', e)
+
+
+# Connect to the broker, then publish the last known states (if any) while
+# the Tydom is not answering yet
+async def start_mqtt():
+    await mqtt_client.connect()
+    if mqtt_client.mqtt_client is not None:
+        await message_handler.restore_states()
+
+
 # Listen to tydom events.
 async def listen_tydom():
 
+    frame_pipeline.start()
     while True:
+        start_task = None
         try:
             await tydom_client.connect()
-            await tydom_client.setup()       
+            reconnect_supervisor.connected()
+            start_task = asyncio.create_task(start_tydom())
             mqtt_client.mqtt_client.publish(mqtt_client.status_topic,'running',qos=0,retain=False)
             while True:
-                try:
-                    incoming_bytes_str = await tydom_client.connection.recv()                    
-                    message_handler = MessageHandler(
-                        incoming_bytes=incoming_bytes_str,
-                        tydom_client=tydom_client,
-                        mqtt_client=mqtt_client,
-                    )                    
-                    await message_handler.incoming_triage()
-                except websockets.ConnectionClosed as e:
-                    logger.error("Websocket connection closed: %s", e)
-                    await tydom_client.disconnect()                    
-                    break
-                except Exception as e:
-                    logger.warning("Unable to handle message: %s", e)
-                    await tydom_client.disconnect()                    
-                    mqtt_client.mqtt_client.publish(mqtt_client.status_topic,'dead',qos=0,retain=False)
-
+                incoming_bytes_str = await tydom_client.connection.recv()
+                if frame_recorder is not None:
+                    frame_recorder.record(incoming_bytes_str)
+                await frame_pipeline.put(incoming_bytes_str)
+        except websockets.ConnectionClosed as e:
+            logger.error("Websocket connection closed: %s", e)
         except socket.gaierror as e:
-            logger.error("Socket error (%s)", e)            
-            sys.exit(1)
+            logger.error("Socket error (%s)", e)
         except ConnectionRefusedError as e:
-            logger.error("Connection refused (%s)", e)            
-            sys.exit(1)
+            logger.error("Connection refused (%s)", e)
+        except Exception as e:
+            logger.warning("Unable to handle message: %s", e)
+
+        if start_task is not None:
+            start_task.cancel()
+        await tydom_client.disconnect()
+        if mqtt_client.mqtt_client is not None:
+            mqtt_client.mqtt_client.publish(mqtt_client.status_topic,'dead',qos=0,retain=False)
+        reconnect_supervisor.disconnected()
+        await reconnect_supervisor.wait()
 
 
+# Devices and entities, kept for the whole life of the process (the parsed
+# configuration is also kept across restarts)
+registry = DeviceRegistry(
+    file_path=os.path.join(configuration.data_dir, 'registry.json'))
+
 # Create tydom client
 tydom_client = TydomClient(
     mac=configuration.tydom_mac,
     host=configuration.tydom_ip,
+    port=configuration.tydom_port,
     password=configuration.tydom_password,
     alarm_pin=configuration.tydom_alarm_pin,
-    thermostat_custom_presets=configuration.thermostat_custom_presets)
+    thermostat_custom_presets=configuration.thermostat_custom_presets,
+    refresh_interval=configuration.tydom_refresh_interval,
+    ping_interval=configuration.tydom_ping_interval,
+    request_rate=configuration.tydom_request_rate,
+    trigger_interval=configuration.tydom_trigger_interval,
+    registry=registry)
 
 # Create mqtt client
 mqtt_client = MqttClient(
@@ -90,8 +130,57 @@ mqtt_client = MqttClient(
     home_zone=configuration.tydom_alarm_home_zone,
     night_zone=configuration.tydom_alarm_night_zone,
     tydom=tydom_client,
+    state_heartbeat=configuration.mqtt_state_heartbeat * 60,
+    discovery_file=os.path.join(configuration.data_dir, 'discovery.json'),
+    registry=registry,
+)
+
+# Last known endpoint states, restored at boot (disabled when the interval
+# is 0)
+state_snapshot = None
+if configuration.state_snapshot_interval > 0:
+    state_snapshot = StateSnapshot(
+        file_path=os.path.join(configuration.data_dir, 'states.json'))
+
+# Create the message handler, which lives across websocket reconnections
+message_handler = MessageHandler(
+    tydom_client=tydom_client,
+    mqtt_client=mqtt_client,
+    registry=registry,
+    state_snapshot=state_snapshot,
+)
+
+# Entity counts and approximate size of the long-lived structures
+memory_usage = MemoryUsage(registry, mqtt_client, tydom_client)
+
+# Decouple websocket receive from parsing and MQTT publishing
+frame_pipeline = FramePipeline(
+    message_handler=message_handler,
+    maxsize=configuration.tydom_queue_size,
+    policy=configuration.tydom_queue_policy,
 )
 
+# Keep the Tydom password retrieved from Delta Dore up to date
+credential_store = configuration.credential_store
+if credential_store is not None:
+    def update_tydom_password(password):
+        logger.info('Tydom password changed, used at next connection')
+        tydom_client.password = password
+    credential_store.on_password_change = update_tydom_password
+
+# Backoff between Tydom reconnections
+reconnect_supervisor = ReconnectSupervisor()
+
+# Capture of the received frames, replayed with tools.replay_frames
+frame_recorder = None
+if configuration.tydom_record_file:
+    frame_recorder = FrameRecorder(configuration.tydom_record_file)
+
+# Prometheus endpoint (disabled when the port is 0)
+metrics_server = None
+if configuration.metrics_port > 0:
+    metrics_server = MetricsServer(port=configuration.metrics_port)
+
 
 async def shutdown(signal, loop):
     logging.info('Received exit signal %s', signal.name)
@@ -102,6 +191,12 @@ async def shutdown(signal, loop):
         await tydom_client.disconnect()
 
         mqtt_client.mqtt_client.publish(mqtt_client.status_topic,'dead',qos=0,retain=False)
+        mqtt_client.save_discovery()
+        registry.save()
+        if state_snapshot is not None:
+            state_snapshot.save()
+        if frame_recorder is not None:
+            frame_recorder.close()
         # Cancel async tasks
         tasks = [t for t in asyncio.all_tasks(
         ) if t is not asyncio.current_task()]
@@ -121,7 +216,17 @@ def main():
         loop.add_signal_handler(
             s, lambda s=s: asyncio.create_task(shutdown(s, loop)))
 
-    loop.create_task(mqtt_client.connect())
+    loop.create_task(start_mqtt())
+    if state_snapshot is not None:
+        loop.create_task(state_snapshot.save_periodically(
+            configuration.state_snapshot_interval))
+    if credential_store is not None:
+        loop.create_task(credential_store.refresh_loop())
+    if metrics_server is not None:
+        loop.create_task(metrics_server.start())
+    if configuration.metrics_mqtt_interval > 0:
+        loop.create_task(publish_diagnostics(
+            mqtt_client, configuration.metrics_mqtt_interval))
     loop.create_task(listen_tydom())
     loop.run_forever()
 
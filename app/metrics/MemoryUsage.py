@@ -0,0 +1,108 @@
+import logging
+import sys
+import time
+
+from .Metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+entities_count = metrics.gauge(
+    'tydom2mqtt_entities', 'Entities in the device registry, by kind',
+    ['kind'])
+memory_bytes = metrics.gauge(
+    'tydom2mqtt_memory_bytes',
+    'Approximate size of the long-lived structures of the bridge',
+    ['component'])
+
+
+def approximate_size(obj, seen=None):
+    """Size of an object and of everything it references (containers,
+    instance attributes and slots). Shared objects are counted once."""
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, type):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif not isinstance(obj, (str, bytes, int, float, bool)):
+            if hasattr(obj, '__dict__'):
+                stack.append(obj.__dict__)
+            for name in getattr(type(obj), '__slots__', ()):
+                if hasattr(obj, name):
+                    stack.append(getattr(obj, name))
+    return size
+
+
+class MemoryUsage:
+    """Entity counts and approximate bytes of the structures which grow
+    with the installation: device registry, MQTT state cache and discovery
+    configs, polled urls.
+
+    Walking the structures is costly, the sizes are computed at most every
+    size_interval seconds (not on every scrape)."""
+
+    def __init__(self, registry, mqtt_client, tydom_client, size_interval=60):
+        self.registry = registry
+        self.mqtt_client = mqtt_client
+        self.tydom_client = tydom_client
+        self.size_interval = size_interval
+        self.sizes = None
+        self.sizes_at = 0
+        metrics.add_collector(self.collect_metrics)
+
+    def get_entity_counts(self):
+        counts = {'device': len(self.registry.device_name)}
+        for entity in self.registry.device_object.values():
+            kind = type(entity).__name__.lower()
+            counts[kind] = counts.get(kind, 0) + 1
+        return counts
+
+    def get_sizes(self):
+        now = time.monotonic()
+        if self.sizes is None or now - self.sizes_at >= self.size_interval:
+            self.sizes = self.compute_sizes()
+            self.sizes_at = now
+        return self.sizes
+
+    def compute_sizes(self):
+        # Entities reference the MQTT client, which is measured on its own
+        seen = {id(self.mqtt_client)}
+        registry = self.registry
+        return {
+            'registry': approximate_size(
+                (registry.device_name, registry.device_type,
+                 registry.device_endpoint, registry.device_entities,
+                 registry.device_object), seen),
+            'state_cache': approximate_size(
+                self.mqtt_client.state_cache.payloads, seen),
+            'discovery': approximate_size(
+                (self.mqtt_client.discovery.entries,
+                 self.mqtt_client.discovery.payloads), seen),
+            'poll_urls': approximate_size(
+                self.tydom_client.poll_scheduler.next_polls, seen),
+        }
+
+    def collect_metrics(self):
+        for kind, count in self.get_entity_counts().items():
+            entities_count.set(count, kind)
+        for component, size in self.get_sizes().items():
+            memory_bytes.set(size, component)
+
+    def log(self):
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        logger.info(
+            'Memory usage: %s, %s',
+            ', '.join('{} {}'.format(count, kind) for kind, count
+                      in self.get_entity_counts().items()),
+            ', '.join('{} {:.1f} KiB'.format(component, size / 1024)
+                      for component, size in self.get_sizes().items()))
@@ -0,0 +1,233 @@
+import asyncio
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+diagnostics_topic = 'tydom2mqtt/diagnostics'
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names, values, extra=None):
+    pairs = ['{}="{}"'.format(name, escape(value))
+             for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def clear(self):
+        self.values.clear()
+
+    # Drop the values of a label value (removed device...), whatever the
+    # values of the other labels
+    def remove(self, label, value):
+        index = self.labels.index(label)
+        for label_values in [label_values for label_values in self.values
+                             if label_values[index] == value]:
+            del self.values[label_values]
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description),
+                 '# TYPE {} {}'.format(self.name, self.type)]
+        for label_values, value in self.values.items():
+            lines.append('{}{} {}'.format(
+                self.name, format_labels(self.labels, label_values), value))
+        return lines
+
+    def snapshot(self):
+        if not self.labels:
+            return self.values.get((), 0)
+        return {'/'.join(str(v) for v in label_values): value
+                for label_values, value in self.values.items()}
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    # Copy a total counted elsewhere
+    def set_total(self, value, *label_values):
+        self.values[label_values] = value
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, *label_values):
+        self.values[label_values] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        # [bucket counts..., count, sum]
+        data = self.values.get(label_values)
+        if data is None:
+            data = self.values[label_values] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                data[i] += 1
+        data[-2] += 1
+        data[-1] += value
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description),
+                 '# TYPE {} {}'.format(self.name, self.type)]
+        for label_values, data in self.values.items():
+            for i, bound in enumerate(self.buckets):
+                lines.append('{}_bucket{} {}'.format(
+                    self.name,
+                    format_labels(self.labels, label_values, 'le="{}"'.format(bound)),
+                    data[i]))
+            lines.append('{}_bucket{} {}'.format(
+                self.name,
+                format_labels(self.labels, label_values, 'le="+Inf"'),
+                data[-2]))
+            labels = format_labels(self.labels, label_values)
+            lines.append('{}_count{} {}'.format(self.name, labels, data[-2]))
+            lines.append('{}_sum{} {}'.format(self.name, labels, data[-1]))
+        return lines
+
+    def snapshot(self):
+        return {'/'.join(str(v) for v in label_values) or 'all': {
+            'count': data[-2],
+            'mean': data[-1] / data[-2] if data[-2] else 0}
+            for label_values, data in self.values.items()}
+
+
+class MetricsRegistry:
+    """Metrics of the bridge, exposed in the Prometheus text format.
+
+    Collectors are called before each export, to copy values owned by other
+    objects (queue depths, caches counters...) into gauges.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, description, labels=()):
+        return self.register(Counter(name, description, labels))
+
+    def gauge(self, name, description, labels=()):
+        return self.register(Gauge(name, description, labels))
+
+    def histogram(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, description, labels, buckets))
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def collect(self):
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning('Metrics collector error (%s)', e)
+
+    def render(self):
+        self.collect()
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        self.collect()
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+
+metrics = MetricsRegistry()
+
+
+class MetricsServer:
+    """Minimal HTTP server answering GET /metrics."""
+
+    def __init__(self, registry=metrics, host='0.0.0.0', port=9100):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(
+            self.handle, self.host, self.port)
+        logger.info('Metrics available on http://%s:%s/metrics',
+                    self.host, self.port)
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 5)
+            parts = request_line.split(b' ')
+            if len(parts) >= 2 and parts[0] == b'GET' and parts[1] == b'/metrics':
+                status = b'200 OK'
+                body = self.registry.render().encode('utf-8')
+            else:
+                status = b'404 Not Found'
+                body = b'Not found\n'
+            writer.write(
+                b'HTTP/1.1 ' + status +
+                b'\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8'
+                b'\r\nContent-Length: ' + str(len(body)).encode('ascii') +
+                b'\r\nConnection: close\r\n\r\n' + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+# Publish a summary of the metrics to the MQTT diagnostics topic
+async def publish_diagnostics(mqtt_client, interval, registry=metrics):
+    previous_frames = None
+    previous_time = None
+    while True:
+        await asyncio.sleep(interval)
+        if mqtt_client.mqtt_client is None:
+            continue
+        snapshot = registry.snapshot()
+        now = time.monotonic()
+        frames = snapshot.get('tydom2mqtt_frames_received_total', {})
+        total_frames = sum(frames.values()) if isinstance(frames, dict) else frames
+        if previous_frames is not None:
+            snapshot['frames_per_second'] = \
+                (total_frames - previous_frames) / (now - previous_time)
+        previous_frames = total_frames
+        previous_time = now
+        mqtt_client.mqtt_client.publish(
+            diagnostics_topic, json.dumps(snapshot), qos=0, retain=False)
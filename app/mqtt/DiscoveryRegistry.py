@@ -0,0 +1,80 @@
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class DiscoveryRegistry:
+    """Home Assistant discovery configs published by the bridge.
+
+    Keeps a hash of every config payload per topic, along with the Tydom
+    device owning it, so that unchanged configs are not published again.
+    Hashes are persisted to a JSON file to survive restarts.
+    """
+
+    def __init__(self, file_path=None):
+        self.file_path = file_path
+        # topic -> {'hash': ..., 'owner': ...}
+        self.entries = {}
+        # topic -> encoded payload, for configs published by this process
+        self.payloads = {}
+        self.dirty = False
+        self.load()
+
+    @staticmethod
+    def hash(encoded):
+        return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+    # Return True when the config has to be published
+    def check(self, topic, encoded, owner):
+        digest = self.hash(encoded)
+        self.payloads[topic] = encoded
+        entry = self.entries.get(topic)
+        if entry is not None and entry['hash'] == digest and \
+                entry['owner'] == owner:
+            return False
+        self.entries[topic] = {'hash': digest, 'owner': owner}
+        self.dirty = True
+        return True
+
+    # Forget the configs owned by devices which are not configured anymore
+    # and return their topics
+    def prune(self, live_owners):
+        topics = [topic for topic, entry in self.entries.items()
+                  if entry['owner'] not in live_owners]
+        for topic in topics:
+            del self.entries[topic]
+            self.payloads.pop(topic, None)
+        if topics:
+            self.dirty = True
+        return topics
+
+    def load(self):
+        if self.file_path is None:
+            return
+        try:
+            with open(self.file_path) as f:
+                self.entries = json.load(f)
+            logger.info('%d discovery configs loaded from %s',
+                        len(self.entries), self.file_path)
+        except FileNotFoundError:
+            logger.debug('No discovery registry file (%s)', self.file_path)
+        except Exception as e:
+            logger.warning(
+                'Unable to load discovery registry file %s (%s)', self.file_path, e)
+
+    def save(self):
+        if self.file_path is None or not self.dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+            tmp_file_path = self.file_path + '.tmp'
+            with open(tmp_file_path, 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_file_path, self.file_path)
+            self.dirty = False
+        except OSError as e:
+            logger.warning(
+                'Unable to save discovery registry file %s (%s)', self.file_path, e)
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import logging
 import socket
@@ -7,14 +8,43 @@ from datetime import datetime
 
 from gmqtt import Client as MQTTClient
 from gmqtt import Message as MQTTMessage
+from gmqtt import Subscription
 
-from sensors.Alarm import Alarm
+from metrics.Metrics import metrics
+from sensors.Alarm import alarm_command_topic, alarm_histo_topic
+from sensors.Cover import Cover, cover_command_topic, cover_set_position_topic
+from .DiscoveryRegistry import DiscoveryRegistry
+from .StateCache import StateCache
+from .TopicRouter import TopicRouter
 
 logger = logging.getLogger(__name__)
 
-tydom_topic = 'tydom2mqtt/#'
 tydom_status_topic = 'tydom2mqtt/state'
+update_topic = 'homeassistant/requests/tydom/update'
+kill_topic = 'homeassistant/requests/tydom/kill'
 refresh_topic = 'homeassistant/requests/tydom/refresh'
+scenarii_topic = 'homeassistant/requests/tydom/scenarii'
+orders_topic = 'homeassistant/requests/tydom/orders'
+# Formerly any tydom2mqtt/ topic containing 'update' or 'kill'
+legacy_update_topic = 'tydom2mqtt/update'
+legacy_kill_topic = 'tydom2mqtt/kill'
+
+mqtt_publishes = metrics.counter(
+    'tydom2mqtt_mqtt_publishes_total',
+    'MQTT messages published, by device', ['device'])
+mqtt_published_bytes = metrics.counter(
+    'tydom2mqtt_mqtt_published_bytes_total',
+    'Payload bytes published to MQTT, by device', ['device'])
+mqtt_states = metrics.counter(
+    'tydom2mqtt_mqtt_states_total',
+    'States sent or suppressed because unchanged', ['result'])
+mqtt_messages = metrics.counter(
+    'tydom2mqtt_mqtt_messages_total',
+    'MQTT messages received: routed to a command, ignored by it, or '
+    'dropped (no route)', ['result'])
+mqtt_discovery_configs = metrics.gauge(
+    'tydom2mqtt_mqtt_discovery_configs',
+    'Home Assistant discovery configs known by the bridge')
 
 
 class MqttClient:
@@ -29,18 +59,45 @@ class MqttClient:
             home_zone=1,
             night_zone=2,
             tydom=None,
-            tydom_alarm_pin=None):
+            tydom_alarm_pin=None,
+            state_heartbeat=0,
+            discovery_file=None,
+            registry=None):
         self.broker_host = broker_host
         self.port = port
         self.user = user if user is not None else ""
         self.password = password if password is not None else ""
         self.ssl = mqtt_ssl
         self.tydom = tydom
+        # Device registry shared with the MessageHandler
+        self.registry = registry
         self.tydom_alarm_pin = tydom_alarm_pin
         self.mqtt_client = None
         self.home_zone = home_zone
         self.night_zone = night_zone
         self.status_topic = tydom_status_topic
+        self.state_cache = StateCache(heartbeat=state_heartbeat)
+        self.discovery = DiscoveryRegistry(file_path=discovery_file)
+        self.discovery_save_handle = None
+        self.router = self.build_router()
+        metrics.add_collector(self.collect_metrics)
+
+    def collect_metrics(self):
+        mqtt_states.set_total(self.state_cache.sent, 'sent')
+        mqtt_states.set_total(self.state_cache.suppressed, 'suppressed')
+        mqtt_discovery_configs.set(len(self.discovery.entries))
+        mqtt_messages.set_total(self.router.routed, 'routed')
+        mqtt_messages.set_total(self.router.ignored, 'ignored')
+        mqtt_messages.set_total(self.router.dropped, 'dropped')
+
+    # Device of a topic, like homeassistant/sensor/{device}/... or
+    # tydom2mqtt/{type}/{device}/...
+    @staticmethod
+    def count_publish(topic, encoded):
+        parts = topic.split('/', 3)
+        device = parts[2] if len(parts) > 2 else topic
+        mqtt_publishes.inc(device)
+        mqtt_published_bytes.inc(device, amount=len(str(encoded).encode('utf-8')))
 
     async def connect(self):
 
@@ -65,74 +122,157 @@ class MqttClient:
         except Exception as e:
             logger.warning("MQTT connection error : %s", e)
 
+    # Publish a retained state, unless the same payload was already sent
+    def publish_state(self, topic, payload, qos=0, retain=True):
+        encoded = StateCache.encode(payload)
+        if not self.state_cache.check(topic, encoded):
+            logger.debug('State unchanged, not published (topic=%s)', topic)
+            return False
+        self.mqtt_client.publish(topic, encoded, qos=qos, retain=retain)
+        self.count_publish(topic, encoded)
+        return True
+
+    # Publish a Home Assistant discovery config, unless unchanged
+    def publish_config(self, topic, config, owner):
+        encoded = json.dumps(config)
+        if not self.discovery.check(topic, encoded, owner):
+            logger.debug('Discovery config unchanged, not published (topic=%s)', topic)
+            return False
+        self.mqtt_client.publish(topic, encoded, qos=0, retain=True)
+        self.count_publish(topic, encoded)
+        self.schedule_discovery_save()
+        return True
+
+    # Remove the discovery configs of devices not configured anymore
+    def prune_discovery(self, live_owners):
+        for topic in self.discovery.prune(live_owners):
+            logger.info('Removing discovery config (topic=%s)', topic)
+            self.mqtt_client.publish(topic, '', qos=0, retain=True)
+            self.state_cache.forget(topic)
+        self.schedule_discovery_save()
+
+    # Send again the configs published by this process (Home Assistant
+    # restarted, or the broker may have lost its retained messages)
+    def republish_discovery(self):
+        for topic, encoded in self.discovery.payloads.items():
+            self.mqtt_client.publish(topic, encoded, qos=0, retain=True)
+
+    def schedule_discovery_save(self, delay=5):
+        if self.discovery.dirty and self.discovery_save_handle is None:
+            self.discovery_save_handle = asyncio.get_running_loop().call_later(
+                delay, self.save_discovery)
+
+    def save_discovery(self):
+        self.discovery_save_handle = None
+        self.discovery.save()
+
+    # Command topics handled by the bridge, also its only subscriptions:
+    # the state topics it publishes are never received back
+    def build_router(self):
+        router = TopicRouter()
+        router.add('homeassistant/status', 'status', self.on_status)
+        router.add(update_topic, 'update', self.on_update)
+        router.add(legacy_update_topic, 'update', self.on_update)
+        router.add(kill_topic, 'kill', self.on_kill)
+        router.add(legacy_kill_topic, 'kill', self.on_kill)
+        router.add(refresh_topic, 'refresh', self.on_refresh)
+        router.add(scenarii_topic, 'scenarii', self.on_scenarii)
+        router.add(orders_topic, 'orders', self.on_orders)
+        router.add(cover_command_topic.format(id='+'),
+                   'set_positionCmd', self.on_set_position_cmd)
+        router.add(cover_set_position_topic.format(id='+'),
+                   'set_position', self.on_set_position)
+        router.add(alarm_command_topic.format(name='+'),
+                   'set_alarm_state', self.on_set_alarm_state)
+        router.add(alarm_histo_topic.format(name='+'),
+                   'get_alarm_histo', self.on_get_alarm_histo)
+        return router
+
+    # flags is the session present flag of the broker acknowledgement
     def on_connect(self, client, flags, rc, properties):
         try:
-            logger.debug("Subscribing to topics (%s)", tydom_topic)
-            client.subscribe('homeassistant/status', qos=0)
-            client.subscribe(tydom_topic, qos=0)
+            logger.debug("Subscribing to topics (%s)", self.router.patterns)
+            client.subscribe([Subscription(pattern, qos=0)
+                              for pattern in self.router.patterns])
         except Exception as e:
             logger.info("Mqtt connection error (%s)", e)
+        # Reconnection without session: the broker (restarted) may have
+        # lost the retained configs and states, they are all sent again
+        if self.mqtt_client is not None and not flags:
+            logger.info('Reconnected to mqtt broker, publishing configs and states again')
+            self.state_cache.clear()
+            self.republish_discovery()
+            self.tydom.devices_data_trigger.trigger_nowait()
 
     async def on_message(self, client, topic, payload, qos, properties):
-        if 'update' in str(topic):
-            value = payload.decode()
-            logger.info(
-                'update message received (topic=%s, message=%s)',
-                topic,
-                value)
-            await self.tydom.get_data()
-        elif 'kill' in str(topic):
-            value = payload.decode()
-            logger.info(
-                'kill message received (topic=%s, message=%s)',
-                topic,
-                value)
-            logger.info('Exiting')
-            sys.exit()
-        elif topic == "homeassistant/requests/tydom/refresh":
-            value = payload.decode()
-            logger.info(
-                'refresh message received (topic=%s, message=%s)',
-                topic,
-                value)
-            await self.tydom.post_refresh()
-        elif topic == "homeassistant/requests/tydom/scenarii":
-            value = payload.decode()
-            logger.info(
-                'scenarii message received (topic=%s, message=%s)',
-                topic,
-                value)
-            await self.tydom.get_scenarii()
-        elif topic == "homeassistant/status" and payload.decode() == 'online':
-            value = payload.decode()
-            logger.info(
-                'status message received (topic=%s, message=%s)',
-                topic,
-                value)
-            await self.tydom.get_devices_data()
-        elif topic == "/tydom/init":
-            value = payload.decode()
-            logger.info(
-                'init message received (topic=%s, message=%s)',
-                topic,
-                value)
-            await self.tydom.connect()
-        
-        elif ('set_alarm_state' in str(topic)) and not ('homeassistant' in str(topic)):
-            value = payload.decode()
-            logger.info(
-                'set_alarm_state message received (topic=%s, message=%s)',
-                topic,
-                value)
-            await Alarm.put_alarm_state(tydom_client=self.tydom, asked_state=value, home_zone=self.home_zone, night_zone=self.night_zone)
+        await self.router.dispatch(topic, payload)
 
-        elif ('get_alarm_histo' in str(topic)) and not ('homeassistant' in str(topic)):
-            value = payload.decode()
-            logger.info(
-                'get_alarm_histo message received (topic=%s, message=%s)',
-                topic,
-                value)
-            await Alarm.get_alarm_event(tydom_client=self.tydom, asked_state=value)
+    async def on_status(self, topic, value):
+        if value != 'online':
+            return False
+        self.republish_discovery()
+        await self.tydom.devices_data_trigger.trigger()
+
+    async def on_update(self, topic, value):
+        await self.tydom.update_trigger.trigger()
+
+    async def on_kill(self, topic, value):
+        logger.info('Exiting')
+        sys.exit()
+
+    async def on_refresh(self, topic, value):
+        await self.tydom.refresh_trigger.trigger()
+
+    async def on_scenarii(self, topic, value):
+        await self.tydom.get_scenarii()
+
+    # Orders given at once (scenes, group actions), a JSON list of
+    # {"id": "<device_id>_<endpoint_id>", "name": ..., "value": ...}
+    @staticmethod
+    def parse_orders(value):
+        orders = []
+        for order in json.loads(value):
+            device_id, endpoint_id = str(order['id']).split('_', 1)
+            orders.append(
+                (device_id, endpoint_id, order['name'], order['value']))
+        return orders
+
+    async def on_orders(self, topic, value):
+        try:
+            orders = self.parse_orders(value)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning('Invalid orders, ignored (%s)', e)
+            return False
+        statuses = await self.tydom.put_devices_data_batch(orders)
+        for (device_id, endpoint_id), status in statuses.items():
+            if status != 200:
+                logger.warning(
+                    'Orders not applied (device=%s, endpoint=%s, status=%s)',
+                    device_id, endpoint_id, status)
+
+    async def on_set_alarm_state(self, topic, value):
+        alarm = self.get_alarm()
+        if alarm is None:
+            return False
+        await alarm.put_alarm_state(tydom_client=self.tydom, asked_state=value, home_zone=self.home_zone, night_zone=self.night_zone)
+
+    async def on_set_position_cmd(self, topic, value):
+        await Cover.put_position_cmd(tydom_client=self.tydom, topic=topic, cmd=value)
+
+    async def on_set_position(self, topic, value):
+        await Cover.put_position(tydom_client=self.tydom, topic=topic, position=value)
+
+    async def on_get_alarm_histo(self, topic, value):
+        alarm = self.get_alarm()
+        if alarm is None:
+            return False
+        await alarm.get_alarm_event(tydom_client=self.tydom, asked_state=value)
+
+    def get_alarm(self):
+        alarm = self.registry.get_alarm() if self.registry is not None else None
+        if alarm is None:
+            logger.warning('No alarm received from tydom yet, command ignored')
+        return alarm
 
     @staticmethod
     def on_disconnect(cmd, packet):
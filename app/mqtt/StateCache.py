@@ -0,0 +1,44 @@
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StateCache:
+    """Last published payload per topic, used to skip identical publishes.
+
+    When heartbeat (seconds) is set, a payload is published again once it
+    has not been sent for that long, even if unchanged.
+    """
+
+    def __init__(self, heartbeat=0):
+        self.heartbeat = heartbeat
+        self.payloads = {}
+        self.sent = 0
+        self.suppressed = 0
+
+    @staticmethod
+    def encode(payload):
+        # Same encoding as gmqtt for dict / list payloads
+        if isinstance(payload, (dict, list, tuple)):
+            return json.dumps(payload, ensure_ascii=False)
+        return payload
+
+    # Return False when the encoded payload has already been sent
+    def check(self, topic, encoded):
+        now = time.monotonic()
+        last = self.payloads.get(topic)
+        if last is not None and last[0] == encoded and (
+                self.heartbeat <= 0 or now - last[1] < self.heartbeat):
+            self.suppressed += 1
+            return False
+        self.payloads[topic] = (encoded, now)
+        self.sent += 1
+        return True
+
+    def forget(self, topic):
+        self.payloads.pop(topic, None)
+
+    def clear(self):
+        self.payloads.clear()
@@ -0,0 +1,77 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TopicRouter:
+    """Dispatch MQTT messages to the handler of their topic pattern.
+
+    Patterns without wildcard are looked up in a dict, the others ('+' and
+    '#' levels) in a trie of topic levels. The patterns are also the
+    subscriptions of the client, so the bridge only receives the topics it
+    handles.
+
+    Handlers are coroutine functions (topic, value), returning False when
+    the message was ignored.
+    """
+
+    def __init__(self):
+        # pattern -> (name, handler)
+        self.exact = {}
+        # level -> child node, the route of a node is stored under None
+        self.trie = {}
+        self.patterns = []
+        self.routed = 0
+        self.ignored = 0
+        self.dropped = 0
+
+    def add(self, pattern, name, handler):
+        self.patterns.append(pattern)
+        if '+' not in pattern and '#' not in pattern:
+            self.exact[pattern] = (name, handler)
+            return
+        node = self.trie
+        for level in pattern.split('/'):
+            node = node.setdefault(level, {})
+        node[None] = (name, handler)
+
+    # Route of a topic: exact match first, then the most specific pattern
+    def match(self, topic):
+        route = self.exact.get(topic)
+        if route is not None or not self.trie:
+            return route
+        levels = topic.split('/')
+        stack = [(self.trie, 0)]
+        while stack:
+            node, depth = stack.pop()
+            multi = node.get('#', {}).get(None)
+            if depth == len(levels):
+                # 'a/#' also matches 'a'
+                route = node.get(None) or multi
+                if route is not None:
+                    return route
+                continue
+            # Pushed in reverse priority order: '#', '+', then the level
+            if multi is not None:
+                stack.append((node['#'], len(levels)))
+            if '+' in node:
+                stack.append((node['+'], depth + 1))
+            if levels[depth] in node:
+                stack.append((node[levels[depth]], depth + 1))
+        return None
+
+    async def dispatch(self, topic, payload):
+        route = self.match(topic)
+        if route is None:
+            self.dropped += 1
+            logger.debug('No route for topic, message dropped (topic=%s)', topic)
+            return False
+        name, handler = route
+        value = payload.decode() if isinstance(payload, bytes) else payload
+        logger.info('%s message received (topic=%s, message=%s)',
+                    name, topic, value)
+        if await handler(topic, value) is False:
+            self.ignored += 1
+            return False
+        self.routed += 1
+        return True
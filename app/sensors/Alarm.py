@@ -1,4 +1,3 @@
-import json
 import logging
 from .Sensor import Sensor
 
@@ -7,14 +6,19 @@ alarm_topic = "tydom2mqtt/alarm_control_panel/#"
 alarm_config_topic = "homeassistant/alarm_control_panel/{id}/config"
 alarm_state_topic = "tydom2mqtt/alarm_control_panel/{name}/alarm_state"
 alarm_command_topic = "tydom2mqtt/alarm_control_panel/{name}/set_alarm_state"
+alarm_histo_topic = "tydom2mqtt/alarm_control_panel/{name}/get_alarm_histo"
 alarm_attributes_topic = "tydom2mqtt/alarm_control_panel/{name}/state"
 
 
 class Alarm:
-    instances = []
+    __slots__ = ('state_topic', 'device', 'config', 'config_alarm_topic',
+                 'device_id', 'device_type', 'endpoint_id', 'id', 'name',
+                 'attributes', 'mqtt', 'alarm_pin', 'elements',
+                 'current_state')
+
     def __init__(self, alarm_pin=None,tydom_attributes_payload=None, mqtt=None):
-        self.__class__.instances.append(self)
         self.state_topic = None
+        self.current_state = None
         self.device = None
         self.config = None
         self.config_alarm_topic = None
@@ -55,8 +59,8 @@ class Alarm:
         self.config['json_attributes_topic'] = alarm_attributes_topic.format(name=self.name)
 
         if self.mqtt is not None:
-            self.mqtt.mqtt_client.publish(
-                self.config_alarm_topic, json.dumps(self.config), qos=0, retain=True)  # Alarm Config
+            self.mqtt.publish_config(
+                self.config_alarm_topic, self.config, owner=self.id)  # Alarm Config
 
     async def update(self, current_state, tydom_attributes_payload=None):    
         self.current_state = current_state
@@ -64,34 +68,52 @@ class Alarm:
             self.attributes = tydom_attributes_payload['attributes']
         self.state_topic = alarm_state_topic.format(name=self.name, state=self.current_state)
         if self.mqtt is not None:
-            self.mqtt.mqtt_client.publish(
-                self.state_topic,self.current_state,qos=0,retain=True)  # Alarm State
-            self.mqtt.mqtt_client.publish(
-                self.config['json_attributes_topic'],self.attributes,qos=0,retain=True)
+            state_published = self.mqtt.publish_state(
+                self.state_topic, self.current_state)  # Alarm State
+            attributes_published = self.mqtt.publish_state(
+                self.config['json_attributes_topic'], self.attributes)
+            if not state_published and not attributes_published:
+                return
         logger.info(
             "Alarm created / updated : %s %s %s",
             self.name,
             self.id,
             self.current_state)
 
+    def get_state_topics(self):
+        return [alarm_state_topic.format(name=self.name),
+                alarm_attributes_topic.format(name=self.name)]
+
+    # Payload of the sensors of the alarm attributes
+    def get_payload(self):
+        return {
+            'device_id': self.device_id,
+            'endpoint_id': self.endpoint_id,
+            'id': self.id,
+            'name': self.name,
+            'device_type': self.device_type,
+            'attributes': self.attributes,
+        }
+
     async def update_sensors(self):
+        payload = self.get_payload()
         for i, j in self.attributes.items():
             if not i == 'device_type' and not i == 'id' and not i == 'device_id' and not i == 'endpoint_id':
                 if i in self.elements:
-                    await self.elements[i].update(vars(self))
+                    await self.elements[i].update(payload)
                 else:
                     self.elements[i] = Sensor(
                         elem_name=i,
-                        tydom_attributes_payload=vars(self),
+                        tydom_attributes_payload=payload,
                         mqtt=self.mqtt)
                     await self.elements[i].setup()
                     await self.elements[i].update(None)
 
-    @staticmethod
-    async def put_alarm_state(tydom_client, home_zone, night_zone, asked_state=None):
+    async def put_alarm_state(self, tydom_client, home_zone, night_zone, asked_state=None):
         value = None
         zone_id = None
-        
+        zone_cmd = 'zoneCmd'
+
         if asked_state == 'ARM_AWAY':
             value = 'ON'
             zone_id = None
@@ -103,13 +125,13 @@ class Alarm:
             zone_id = night_zone
         elif asked_state == 'DISARM':
             value = 'OFF'
-            if  Alarm.instances[0].attributes['part1State'] == 'ON':
+            if self.attributes.get('part1State') == 'ON':
                 zone_id = '1'
-            elif  Alarm.instances[0].attributes['part2State'] == 'ON':
+            elif self.attributes.get('part2State') == 'ON':
                 zone_id = '2'
-            elif  Alarm.instances[0].attributes['part3State'] == 'ON':
+            elif self.attributes.get('part3State') == 'ON':
                 zone_id = '3'
-            elif  Alarm.instances[0].attributes['part4State'] == 'ON':
+            elif self.attributes.get('part4State') == 'ON':
                 zone_id = '4'
             else:
                 zone_id = None
@@ -119,12 +141,11 @@ class Alarm:
         elif asked_state == 'ACK':
             value = 'ACK'
             zone_id = None
-        if 'part1State' in Alarm.instances[0].attributes:
+        if 'part1State' in self.attributes:
             zone_cmd = 'partCmd'
 
-        await tydom_client.put_alarm_cdata(device_id=Alarm.instances[0].device_id, alarm_id=Alarm.instances[0].endpoint_id, value=value, zone_cmd=zone_cmd, zone_id=zone_id)
+        await tydom_client.put_alarm_cdata(device_id=self.device_id, alarm_id=self.endpoint_id, value=value, zone_cmd=zone_cmd, zone_id=zone_id)
 
-    @staticmethod
-    async def get_alarm_event(tydom_client, asked_state=None):
+    async def get_alarm_event(self, tydom_client, asked_state=None):
         value = asked_state
-        await tydom_client.put_alarm_cdata(device_id=Alarm.instances[0].device_id, alarm_id=Alarm.instances[0].endpoint_id, value=value)
+        await tydom_client.put_alarm_cdata(device_id=self.device_id, alarm_id=self.endpoint_id, value=value)
@@ -0,0 +1,106 @@
+import logging
+
+from logs.HotPathLogging import get_device_logger
+
+logger = logging.getLogger(__name__)
+device_logger = get_device_logger(logger)
+cover_topic = "tydom2mqtt/cover/#"
+cover_config_topic = "homeassistant/cover/{id}/config"
+cover_command_topic = "tydom2mqtt/cover/{id}/set_positionCmd"
+cover_set_position_topic = "tydom2mqtt/cover/{id}/set_position"
+cover_position_topic = "tydom2mqtt/cover/{id}/current_position"
+cover_attributes_topic = "tydom2mqtt/cover/{id}/state"
+
+
+class Cover:
+    __slots__ = ('device', 'config', 'config_cover_topic', 'current_position',
+                 'device_id', 'device_type', 'endpoint_id', 'id', 'name',
+                 'attributes', 'mqtt')
+
+    def __init__(self, tydom_attributes_payload, mqtt=None):
+        self.device = None
+        self.config = None
+        self.config_cover_topic = None
+        self.current_position = None
+        self.device_id = tydom_attributes_payload['device_id']
+        self.device_type = tydom_attributes_payload['device_type']
+        self.endpoint_id = tydom_attributes_payload['endpoint_id']
+        self.id = tydom_attributes_payload['id']
+        self.name = tydom_attributes_payload['name']
+        self.attributes = tydom_attributes_payload['attributes']
+        self.mqtt = mqtt
+
+    async def setup(self):
+        self.device = {
+            'manufacturer': 'Delta Dore',
+            'model': 'Volet',
+            'name': self.name,
+            'identifiers': self.id
+        }
+        self.config = {
+            'name': None,  # set an MQTT entity's name to None to mark it as the main feature of a device
+            'unique_id': self.id,
+            'availability_topic': self.mqtt.status_topic,
+            'payload_available': 'running',
+            'payload_not_available': 'dead',
+            'device': self.device,
+            'device_class': 'shutter',
+            'command_topic': cover_command_topic.format(id=self.id),
+            'payload_open': 'UP',
+            'payload_close': 'DOWN',
+            'payload_stop': 'STOP',
+            'set_position_topic': cover_set_position_topic.format(id=self.id),
+            'position_topic': cover_position_topic.format(id=self.id),
+            'position_open': 100,
+            'position_closed': 0,
+            'json_attributes_topic': cover_attributes_topic.format(id=self.id),
+        }
+        self.config_cover_topic = cover_config_topic.format(id=self.id)
+
+        if self.mqtt is not None:
+            self.mqtt.publish_config(
+                self.config_cover_topic, self.config, owner=self.id)  # Cover Config
+
+    def get_state_topics(self):
+        return [cover_position_topic.format(id=self.id),
+                cover_attributes_topic.format(id=self.id)]
+
+    async def update(self, tydom_attributes_payload=None):
+        if tydom_attributes_payload is not None:
+            self.attributes.update(tydom_attributes_payload['attributes'])
+        if 'position' in self.attributes:
+            self.current_position = self.attributes['position']
+
+        if self.mqtt is not None:
+            published = False
+            if self.current_position is not None:
+                published = self.mqtt.publish_state(
+                    self.config['position_topic'], str(self.current_position))
+            published = self.mqtt.publish_state(
+                self.config['json_attributes_topic'], self.attributes) or published
+            if not published:
+                return
+        device_logger.info(
+            self.id,
+            "Cover created / updated : %s %s %s",
+            self.name,
+            self.id,
+            self.current_position)
+
+    # Entity id is '<device id>_<endpoint id>'
+    @staticmethod
+    def get_ids_from_topic(topic):
+        device_id, endpoint_id = str(topic).split('/')[2].split('_', 1)
+        return device_id, endpoint_id
+
+    @staticmethod
+    async def put_position(tydom_client, topic, position):
+        device_id, endpoint_id = Cover.get_ids_from_topic(topic)
+        await tydom_client.put_devices_data_coalesced(
+            device_id, endpoint_id, 'position', str(position))
+
+    @staticmethod
+    async def put_position_cmd(tydom_client, topic, cmd):
+        device_id, endpoint_id = Cover.get_ids_from_topic(topic)
+        await tydom_client.put_devices_data_coalesced(
+            device_id, endpoint_id, 'positionCmd', cmd)
@@ -0,0 +1,120 @@
+"""Tydom device families supported by the bridge.
+
+Each family declares the Tydom usages (last_usage in /configs/file) it
+covers, the data keywords published to Home Assistant, the Home Assistant
+component and the device class of each keyword. Adding a family only
+means adding an entry to DEVICE_KINDS.
+
+Event keywords (detections...) and non restorable families (the alarm)
+are not restored from the state snapshot at boot: a stale value would
+raise a false alert.
+"""
+
+
+class DeviceKind:
+    __slots__ = ('kind', 'usages', 'keywords', 'component', 'device_type',
+                 'device_classes', 'default_device_class', 'name',
+                 'event_keywords', 'restorable')
+
+    def __init__(self, kind, usages=(), keywords=(), component='sensor',
+                 device_type=None, device_classes=None,
+                 default_device_class='', name=None, event_keywords=(),
+                 restorable=True):
+        self.kind = kind
+        self.usages = frozenset(usages)
+        self.keywords = frozenset(keywords)
+        self.event_keywords = frozenset(event_keywords)
+        self.restorable = restorable
+        self.component = component
+        # Type used in the state topics (tydom2mqtt/{device_type}/...)
+        self.device_type = device_type if device_type is not None else kind
+        self.device_classes = device_classes if device_classes is not None else {}
+        self.default_device_class = default_device_class
+        # Fixed name, instead of the one set in the Tydom app
+        self.name = name
+
+    def get_device_class(self, keyword):
+        return self.device_classes.get(keyword, self.default_device_class)
+
+
+DEVICE_KINDS = (
+    DeviceKind(
+        'window',
+        usages=['window', 'windowFrench', 'windowSliding',
+                'klineWindowFrench', 'klineWindowSliding'],
+        keywords=['autoProtect', 'intrusionDetect', 'battDefect',
+                  'motionDetect'],
+        event_keywords=['intrusionDetect', 'motionDetect'],
+        component='binary_sensor',
+        device_classes={
+            'intrusionDetect': 'window',
+            'motionDetect': 'motion',
+            'battDefect': 'battery',
+            'autoProtect': 'tamper',
+        }),
+    DeviceKind(
+        'door',
+        usages=['belmDoor', 'klineDoor'],
+        keywords=['autoProtect', 'intrusionDetect', 'battDefect'],
+        event_keywords=['intrusionDetect'],
+        component='binary_sensor',
+        device_classes={
+            'intrusionDetect': 'door',
+            'battDefect': 'battery',
+            'autoProtect': 'tamper',
+        }),
+    DeviceKind(
+        'alarm',
+        usages=['alarm'],
+        keywords=[
+            'alarmMode', 'alarmState', 'alarmSOS',
+            'part1State', 'part2State', 'part3State', 'part4State',
+            'zone1State', 'zone2State', 'zone3State', 'zone4State',
+            'zone5State', 'zone6State', 'zone7State', 'zone8State',
+            'gsmLevel', 'inactiveProduct', 'liveCheckRunning',
+            'networkDefect', 'unitAutoProtect', 'unitBatteryDefect',
+            'unackedEvent', 'alarmTechnical', 'systAutoProtect',
+            'systBatteryDefect', 'systSupervisionDefect', 'systOpenIssue',
+            'systTechnicalDefect', 'videoLinkDefect', 'outTemperature',
+            'kernelUpToDate', 'irv1State', 'irv2State', 'irv3State',
+            'irv4State', 'simDefect', 'remoteSurveyDefect',
+            'systSectorDefect',
+        ],
+        component='alarm_control_panel',
+        device_type='alarm_control_panel',
+        restorable=False,
+        default_device_class='safety',
+        name='Tyxal Alarm'),
+    DeviceKind(
+        'cover',
+        usages=['shutter', 'klineShutter', 'awning'],
+        keywords=['position', 'onFavPos', 'thermicDefect', 'obstacleDefect',
+                  'intrusion', 'battDefect'],
+        event_keywords=['intrusion'],
+        component='cover'),
+    # Tywatt, detected from /devices/cmeta and polled
+    DeviceKind('conso', name='Tywatt'),
+    DeviceKind('unknown'),
+)
+
+# Lookup tables, built once
+kinds = {device_kind.kind: device_kind for device_kind in DEVICE_KINDS}
+usage_kinds = {usage: device_kind
+               for device_kind in DEVICE_KINDS
+               for usage in device_kind.usages}
+device_type_kinds = {device_kind.device_type: device_kind
+                     for device_kind in DEVICE_KINDS}
+
+UNKNOWN = kinds['unknown']
+
+
+def get_kind(kind):
+    return kinds.get(kind, UNKNOWN)
+
+
+def get_kind_from_usage(last_usage):
+    return usage_kinds.get(last_usage, UNKNOWN)
+
+
+def get_kind_from_device_type(device_type):
+    return device_type_kinds.get(device_type, UNKNOWN)
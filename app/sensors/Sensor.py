@@ -1,7 +1,11 @@
-import json
 import logging
 
+from logs.HotPathLogging import get_device_logger
+
+from .DeviceTypes import get_kind_from_device_type
+
 logger = logging.getLogger(__name__)
+device_logger = get_device_logger(logger)
 sensor_topic = "tydom2mqtt/sensor/#"
 sensor_config_topic = "homeassistant/sensor/{parent}/{elem}/config"
 sensor_json_attributes_topic = "tydom2mqtt/{type}/{name}/state"
@@ -12,29 +16,14 @@ binary_sensor_json_attributes_topic = "tydom2mqtt/{type}/{name}/state"
 
 
 
-deviceDoorClasses = {
-    'intrusionDetect': 'door',
-    'battDefect': 'battery',
-    'autoProtect': 'tamper'
-}
-
-deviceWindowClasses = {
-    'intrusionDetect': 'window',
-    'motionDetect': 'motion',
-    'battDefect': 'battery',
-    'autoProtect': 'tamper'
-}
-
-deviceAlarmClasses = {
-    'alarmMode': 'window',
-    'alarmState': 'motion',
-    'battDefect': 'battery',
-    'autoProtect': 'tamper'
-}
-
 deviceSmokeKeywords = ['techSmokeDefect']
 
 class Sensor:
+    __slots__ = ('config', 'config_sensor_topic', 'device', 'device_type',
+                 'elem_name', 'elem_value', 'attributes', 'parent_device_id',
+                 'id', 'name', 'parent_name', 'device_class', 'state_class',
+                 'unit_of_measurement', 'value_template', 'mqtt', 'binary',
+                 'json_attributes_topic', 'config_topic')
 
     def __init__(self, elem_name, tydom_attributes_payload, mqtt=None):
         self.config = None
@@ -52,16 +41,9 @@ class Sensor:
         self.name = elem_name
         self.parent_name = str(tydom_attributes_payload['name'])
 
-        match self.device_type:
-            case 'door':
-                self.device_class = deviceDoorClasses[self.name]
-            case 'window':
-                self.device_class = deviceWindowClasses[self.name]
-            case 'alarm_control_panel':
-                self.device_class = 'safety' #deviceAlarmClasses[self.name]
-            case _:
-                self.device_class = ''
-        
+        self.device_class = get_kind_from_device_type(
+            self.device_type).get_device_class(self.name)
+
         if 'state_class' in tydom_attributes_payload.keys():
             self.state_class = tydom_attributes_payload['state_class']
 
@@ -163,9 +145,13 @@ class Sensor:
         self.config['value_template'] = self.value_template
 
         if self.mqtt is not None:
-            self.mqtt.mqtt_client.publish(
-                self.config_topic.lower(), json.dumps(
-                    self.config), qos=0, retain=True)  # sensor Config
+            self.mqtt.publish_config(
+                self.config_topic.lower(), self.config,
+                owner=self.parent_device_id)  # sensor Config
+
+    # Topics of the published states, forgotten when the entity is removed
+    def get_state_topics(self):
+        return [self.json_attributes_topic]
 
     async def update(self,tydom_attributes_payload):
 
@@ -180,19 +166,18 @@ class Sensor:
             if tydom_attributes_payload is not None:
                 self.attributes.update(tydom_attributes_payload['attributes'])
 
-            if self.mqtt is not None:
-                self.mqtt.mqtt_client.publish(
-                    self.json_attributes_topic,
-                    self.attributes,
-                    qos=0,
-                    retain=True)
+            if self.mqtt is not None and not self.mqtt.publish_state(
+                    self.json_attributes_topic, self.attributes):
+                return
             if not self.binary:
-                logger.info(
+                device_logger.info(
+                    self.id,
                     "Sensor created / updated : %s %s",
                     self.name,
                     self.elem_value)
             else:
-                logger.info(
+                device_logger.info(
+                    self.id,
                     "Binary sensor created / updated : %s %s",
                     self.name,
                     self.elem_value)
@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+import pytest
+
+from tydom.CommandScheduler import (
+    LANE_ALARM, LANE_POLL, LANE_USER, CommandQueueFull, CommandScheduler)
+
+
+def test_lanes_sent_by_priority():
+    sent = []
+
+    async def send(data):
+        sent.append(data)
+
+    async def submit_all():
+        scheduler = CommandScheduler(send, rate=0)
+        # Queued before the sender task runs
+        await asyncio.gather(
+            scheduler.submit(b'poll 1', LANE_POLL),
+            scheduler.submit(b'user 1', LANE_USER),
+            scheduler.submit(b'poll 2', LANE_POLL),
+            scheduler.submit(b'alarm', LANE_ALARM),
+            scheduler.submit(b'user 2', LANE_USER))
+        await scheduler.stop()
+        return scheduler
+
+    scheduler = asyncio.run(submit_all())
+    assert sent == [b'alarm', b'user 1', b'user 2', b'poll 1', b'poll 2']
+    assert scheduler.sent == {LANE_ALARM: 1, LANE_USER: 2, LANE_POLL: 2}
+
+
+def test_alarm_overtakes_polls_waiting_for_a_token():
+    sent = []
+
+    async def send(data):
+        sent.append((data, time.monotonic()))
+
+    async def submit_all():
+        scheduler = CommandScheduler(send, rate=20, burst=1)
+        polls = [asyncio.create_task(scheduler.submit(
+            'poll {}'.format(i).encode(), LANE_POLL)) for i in range(3)]
+        # First poll sent with the burst token, the others wait for tokens
+        while not sent:
+            await asyncio.sleep(0.001)
+        await scheduler.submit(b'alarm', LANE_ALARM)
+        await scheduler.submit(b'user', LANE_USER)
+        await asyncio.gather(*polls)
+        await scheduler.stop()
+
+    asyncio.run(submit_all())
+    assert [data for data, sent_at in sent] == \
+        [b'poll 0', b'alarm', b'user', b'poll 1', b'poll 2']
+    # One request every 1 / rate seconds once the burst is spent
+    intervals = [b[1] - a[1] for a, b in zip(sent, sent[1:])]
+    assert min(intervals) >= 0.04
+
+
+def test_full_lane_refuses_requests():
+    async def send(data):
+        pass
+
+    async def submit_all():
+        scheduler = CommandScheduler(send, rate=0, max_queued=2)
+        polls = [asyncio.create_task(scheduler.submit(b'poll', LANE_POLL))
+                 for i in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(CommandQueueFull):
+            await scheduler.submit(b'poll', LANE_POLL)
+        # Other lanes are not affected
+        await scheduler.submit(b'user', LANE_USER)
+        await asyncio.gather(*polls)
+        await scheduler.stop()
+        return scheduler
+
+    assert asyncio.run(submit_all()).dropped[LANE_POLL] == 1
+
+
+def test_send_error_fails_its_request_only():
+    async def send(data):
+        if data == b'bad':
+            raise ConnectionError('closed')
+
+    async def submit_all():
+        scheduler = CommandScheduler(send, rate=0)
+        results = await asyncio.gather(
+            scheduler.submit(b'bad', LANE_USER),
+            scheduler.submit(b'good', LANE_USER),
+            return_exceptions=True)
+        await scheduler.stop()
+        return results
+
+    bad, good = asyncio.run(submit_all())
+    assert isinstance(bad, ConnectionError)
+    assert good is None
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from tydom.CredentialStore import CredentialError, CredentialStore
+
+MAC = '001A25000000'
+
+
+class DeltaDoreStub(BaseHTTPRequestHandler):
+    """Delta Dore cloud: OpenID configuration, token and sites endpoints"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        stub = self.server.stub
+        stub['requests'].append(('GET', self.path.split('?', 1)[0]))
+        if stub['down']:
+            return self.send_json({}, status=503)
+        if self.path.startswith('/auth'):
+            return self.send_json({
+                'token_endpoint': 'http://127.0.0.1:{}/token'.format(
+                    self.server.server_port)})
+        if self.path == '/sites?gateway_mac=' + MAC:
+            if self.headers.get('Authorization') != 'Bearer ' + stub['access_token']:
+                return self.send_json({}, status=401)
+            if stub['broken']:
+                return self.send_json({'sites': [{'gateway': {'mac': MAC}}]})
+            return self.send_json({'sites': [
+                {'gateway': {'mac': MAC, 'password': stub['gateway_password']}}]})
+        self.send_json({}, status=404)
+
+    def do_POST(self):
+        stub = self.server.stub
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        grant_type = 'refresh_token' if b'refresh_token' in body else 'password'
+        stub['requests'].append(('POST', grant_type))
+        if stub['down']:
+            return self.send_json({}, status=503)
+        stub['access_token'] = 'access-{}'.format(len(stub['requests']))
+        self.send_json({
+            'access_token': stub['access_token'],
+            'refresh_token': 'refresh',
+            'expires_in': 3600})
+
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), DeltaDoreStub)
+    server.stub = {'requests': [], 'down': False, 'broken': False,
+                   'access_token': None, 'gateway_password': 'secret-1'}
+    thread = threading.Thread(
+        target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def new_store(server, tmp_path, **kwargs):
+    base_url = 'http://127.0.0.1:{}'.format(server.server_port)
+    return CredentialStore(
+        'login', 'password', MAC,
+        file_path=str(tmp_path / 'credentials.json'),
+        auth_url=base_url + '/auth',
+        sites_url=base_url + '/sites?gateway_mac=',
+        timeout=2,
+        **kwargs)
+
+
+def test_fetch_and_cache(stub, tmp_path):
+    store = new_store(stub, tmp_path)
+    assert store.get_password() == 'secret-1'
+    assert ('POST', 'password') in stub.stub['requests']
+
+    # A restart uses the cache without any request
+    stub.stub['requests'].clear()
+    assert new_store(stub, tmp_path).get_password() == 'secret-1'
+    assert stub.stub['requests'] == []
+
+
+def test_refresh_with_refresh_token(stub, tmp_path):
+    store = new_store(stub, tmp_path)
+    store.get_password()
+    stub.stub['gateway_password'] = 'secret-2'
+    stub.stub['requests'].clear()
+
+    assert store.refresh() == 'secret-2'
+    assert ('POST', 'refresh_token') in stub.stub['requests']
+    assert ('POST', 'password') not in stub.stub['requests']
+    assert new_store(stub, tmp_path).get_cached_password() == 'secret-2'
+
+
+def test_expired_cache_used_at_startup(stub, tmp_path):
+    new_store(stub, tmp_path, password_ttl=-1).get_password()
+    stub.stub['requests'].clear()
+    stub.stub['down'] = True
+
+    # Expired, the cloud is down: the stale password is used, no request
+    store = new_store(stub, tmp_path)
+    assert store.get_cached_password() is None
+    assert store.get_password() == 'secret-1'
+    assert stub.stub['requests'] == []
+
+
+def test_fetch_fails_without_cache(stub, tmp_path):
+    stub.stub['down'] = True
+    with pytest.raises(CredentialError):
+        new_store(stub, tmp_path).get_password()
+
+
+def test_refresh_loop_renews_expired_password(stub, tmp_path):
+    new_store(stub, tmp_path, password_ttl=-1).get_password()
+    stub.stub['gateway_password'] = 'secret-2'
+    store = new_store(stub, tmp_path)
+    store.get_password()
+
+    async def refresh_once():
+        task = asyncio.create_task(store.refresh_loop())
+        deadline = time.monotonic() + 5
+        while store.get_cached_password() is None and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(refresh_once())
+    assert store.get_cached_password() == 'secret-2'
+
+
+def test_refresh_loop_keeps_stale_password_when_down(stub, tmp_path):
+    new_store(stub, tmp_path, password_ttl=-1).get_password()
+    stub.stub['down'] = True
+    stub.stub['requests'].clear()
+    store = new_store(stub, tmp_path)
+
+    async def refresh_once():
+        task = asyncio.create_task(store.refresh_loop(retry_delay=60))
+        deadline = time.monotonic() + 5
+        # Refresh token, then full login attempts
+        while len(stub.stub['requests']) < 2 and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(refresh_once())
+    assert len(stub.stub['requests']) == 2
+    assert store.get_cached_password(allow_stale=True) == 'secret-1'
+
+
+def test_refresh_loop_survives_unexpected_errors(stub, tmp_path):
+    new_store(stub, tmp_path, password_ttl=-1).get_password()
+    stub.stub['gateway_password'] = 'secret-2'
+    stub.stub['broken'] = True
+    stub.stub['requests'].clear()
+    store = new_store(stub, tmp_path)
+    changes = []
+
+    async def refresh_until_fixed():
+        loop_thread = threading.get_ident()
+        store.on_password_change = lambda password: changes.append(
+            (password, threading.get_ident() == loop_thread))
+        task = asyncio.create_task(store.refresh_loop(retry_delay=0.05))
+        deadline = time.monotonic() + 5
+        # A gateway without password (KeyError) does not stop the loop
+        while len(stub.stub['requests']) < 2 and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        assert not task.done()
+        stub.stub['broken'] = False
+        while not changes and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(refresh_until_fixed())
+    # Called back once, on the event loop thread
+    assert changes == [('secret-2', True)]
+    assert store.get_cached_password() == 'secret-2'
@@ -0,0 +1,116 @@
+import json
+
+import pytest
+
+from tydom.FrameParser import (
+    MSG_ACK, MSG_CDATA, MSG_CONFIG, MSG_DATA, MSG_HTML, MSG_PONG, FrameError,
+    FrameParser)
+
+DATA = [{'id': 1600000010, 'endpoints': [{'id': 1600000010, 'error': 0, 'data': [
+    {'name': 'position', 'validity': 'upToDate', 'value': 50}]}]}]
+BODY = json.dumps(DATA).encode()
+
+
+def response(headers, body=b''):
+    return b'HTTP/1.1 200 OK\r\n' + b''.join(
+        name + b': ' + value + b'\r\n' for name, value in headers) + \
+        b'\r\n' + body
+
+
+def test_content_length_body():
+    frame = FrameParser().parse(response(
+        [(b'Uri-Origin', b'/devices/data'), (b'Transac-Id', b'12'),
+         (b'Content-Length', str(len(BODY)).encode())],
+        BODY + b'\r\n\r\n'))
+    assert frame.status == 200
+    assert frame.is_response
+    assert frame.transac_id == '12'
+    assert frame.body == BODY
+    assert frame.data == DATA
+    assert frame.msg_type == MSG_DATA
+
+
+def test_chunked_body():
+    body = b''.join([
+        b'%x\r\n' % 10, BODY[:10], b'\r\n',
+        # Blank lines between chunks are tolerated
+        b'\r\n',
+        b'%x;ext=1\r\n' % (len(BODY) - 10), BODY[10:], b'\r\n',
+        b'0\r\n\r\n'])
+    frame = FrameParser().parse(response(
+        [(b'Uri-Origin', b'/devices/data'),
+         (b'Transfer-Encoding', b'chunked')], body))
+    assert frame.body == BODY
+    assert frame.data == DATA
+
+
+def test_invalid_chunk_size():
+    with pytest.raises(FrameError):
+        FrameParser().parse(response(
+            [(b'Transfer-Encoding', b'chunked')], b'zz\r\n{}\r\n0\r\n\r\n'))
+
+
+def test_invalid_content_length():
+    with pytest.raises(FrameError):
+        FrameParser().parse(response([(b'Content-Length', b'ten')], b'{}'))
+
+
+def test_command_prefix():
+    frame_bytes = response(
+        [(b'Uri-Origin', b'/ping'), (b'Content-Length', b'0')])
+    parser = FrameParser(cmd_prefix='\x02')
+    # Remote connections prefix the frames, local ones do not
+    assert parser.parse(b'\x02' + frame_bytes).msg_type == MSG_PONG
+    assert parser.parse(frame_bytes).msg_type == MSG_PONG
+
+
+def test_headers_without_blank_line():
+    frame = FrameParser().parse(
+        b'HTTP/1.1 200 OK\r\nUri-Origin: /ping\r\nTransac-Id: 3')
+    assert frame.headers == {'uri-origin': '/ping', 'transac-id': '3'}
+    assert frame.body == b''
+    assert frame.msg_type == MSG_PONG
+
+
+def test_invalid_start_line():
+    with pytest.raises(FrameError):
+        FrameParser().parse(b'HTTP/1.1 OK\r\n\r\n')
+    with pytest.raises(FrameError):
+        FrameParser().parse(b'no start line')
+
+
+def test_msg_type_from_uri_origin():
+    parser = FrameParser()
+    cdata = parser.parse(response(
+        [(b'Uri-Origin', b'/devices/1/endpoints/1/cdata?name=energyIndex'),
+         (b'Content-Length', b'2')], b'{}'))
+    assert cdata.msg_type == MSG_CDATA
+    data = parser.parse(response(
+        [(b'Uri-Origin', b'/devices/1/endpoints/1/data'),
+         (b'Content-Length', b'2')], b'{}'))
+    assert data.msg_type == MSG_DATA
+
+
+def test_msg_type_from_request_uri():
+    parser = FrameParser()
+    frame = parser.parse(
+        b'PUT /devices/data HTTP/1.1\r\nContent-Length: ' +
+        str(len(BODY)).encode() + b'\r\n\r\n' + BODY)
+    assert frame.method == 'PUT'
+    assert frame.uri == '/devices/data'
+    assert not frame.is_response
+    assert frame.msg_type == MSG_DATA
+    cdata = parser.parse(
+        b'PUT /devices/1/endpoints/1/cdata HTTP/1.1\r\n\r\n{}')
+    assert cdata.msg_type == MSG_CDATA
+
+
+def test_msg_type_without_origin():
+    parser = FrameParser()
+    # Empty response: acknowledgement of an order
+    assert parser.parse(response([])).msg_type == MSG_ACK
+    assert parser.parse(response([], b'<html></html>')).msg_type == MSG_HTML
+    config = {'endpoints': [{'id_endpoint': 1, 'id_catalog': 'x'}]}
+    assert parser.parse(
+        response([], json.dumps(config).encode())).msg_type == MSG_CONFIG
+    assert parser.parse(response([], BODY)).msg_type == MSG_DATA
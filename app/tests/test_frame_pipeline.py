@@ -0,0 +1,115 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from tydom.FrameParser import MSG_DATA, TydomFrame
+from tydom.FramePipeline import (
+    POLICY_COALESCE, POLICY_DROP_OLDEST, FramePipeline, FrameQueue,
+    get_coalesce_key, merge_data_frames)
+
+
+def data_frame(device_id, endpoint_id, **values):
+    return TydomFrame(
+        method='PUT', uri='/devices/data', msg_type=MSG_DATA,
+        data=[{'id': device_id, 'endpoints': [{'id': endpoint_id, 'data': [
+            {'name': name, 'value': value} for name, value in values.items()]}]}])
+
+
+def drain(queue):
+    items = []
+    while not queue.empty():
+        items.append(queue.get_nowait())
+    return items
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        FrameQueue(2, policy='drop_newest')
+
+
+def test_drop_oldest_keeps_undroppable_items():
+    async def fill():
+        queue = FrameQueue(3, policy=POLICY_DROP_OLDEST)
+        await queue.put('config', droppable=False)
+        for item in ('data 1', 'data 2', 'data 3', 'data 4'):
+            await queue.put(item)
+        return queue
+
+    queue = asyncio.run(fill())
+    assert queue.dropped == 2
+    assert drain(queue) == ['config', 'data 3', 'data 4']
+
+
+def test_coalesce_merges_into_the_queued_frame():
+    async def fill():
+        queue = FrameQueue(2, policy=POLICY_COALESCE, merge=merge_data_frames)
+        for frame in (data_frame(10, 1, position=10, onFavPos=False),
+                      data_frame(20, 2, position=0),
+                      data_frame(10, 1, position=20),
+                      data_frame(10, 1, position=30)):
+            await queue.put(frame, key=get_coalesce_key(frame))
+        return queue
+
+    queue = asyncio.run(fill())
+    assert queue.coalesced == 2
+    first, second = drain(queue)
+    # Position of the first frame, latest values, older names kept
+    assert first.data[0]['id'] == 10
+    assert {elem['name']: elem['value']
+            for elem in first.data[0]['endpoints'][0]['data']} == \
+        {'position': 30, 'onFavPos': False}
+    assert second.data[0]['id'] == 20
+
+
+def test_coalesce_waits_for_a_slot_without_key():
+    async def fill():
+        queue = FrameQueue(1, policy=POLICY_COALESCE, merge=merge_data_frames)
+        await queue.put('dump')
+        put = asyncio.create_task(queue.put('other dump'))
+        await asyncio.sleep(0.01)
+        assert not put.done()
+        assert await queue.get() == 'dump'
+        await put
+        return queue
+
+    queue = asyncio.run(fill())
+    assert drain(queue) == ['other dump']
+
+
+def test_only_single_endpoint_frames_are_coalesced():
+    frame = data_frame(10, 1, position=10)
+    assert get_coalesce_key(frame) == ('/devices/data', 10, 1)
+    dump = TydomFrame(uri='/devices/data', msg_type=MSG_DATA, data=[
+        {'id': 10, 'endpoints': [{'id': 1, 'data': []}]},
+        {'id': 20, 'endpoints': [{'id': 2, 'data': []}]}])
+    assert get_coalesce_key(dump) is None
+
+
+def test_alarm_endpoints_go_through_their_own_lane():
+    types = {'1_10': 'alarm', '2_20': 'shutter'}
+    handled = []
+
+    class Handler:
+        registry = SimpleNamespace(get_type=types.get)
+
+        def parse_frame(self, frame):
+            return frame
+
+        async def parse_response(self, frame):
+            handled.append(frame)
+
+    async def run():
+        pipeline = FramePipeline(Handler(), maxsize=10)
+        await pipeline.put(TydomFrame(uri='/devices/data', msg_type=MSG_DATA, data=[
+            {'id': 20, 'endpoints': [{'id': 2, 'data': []}]},
+            {'id': 10, 'endpoints': [{'id': 1, 'data': []}]}]))
+        pipeline.start()
+        while len(handled) < 2:
+            await asyncio.sleep(0.001)
+        await pipeline.stop()
+
+    asyncio.run(run())
+    alarm, others = handled
+    assert [device['id'] for device in alarm.data] == [10]
+    assert [device['id'] for device in others.data] == [20]
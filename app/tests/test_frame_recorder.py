@@ -0,0 +1,29 @@
+import json
+
+from tydom.FrameParser import MSG_DATA, FrameParser
+from tydom.FrameRecorder import FrameRecorder, load_recording
+
+DATA = [{'id': 1612171197, 'endpoints': [{'id': 1612171197, 'error': 0, 'data': [
+    {'name': 'level', 'validity': 'upToDate', 'value': 16},
+    {'name': 'label', 'validity': 'upToDate', 'value': '1234'}]}]}]
+
+
+def build_frame(body):
+    return (b'\x02PUT /devices/data HTTP/1.1\r\n'
+            b'Server: Tydom-001A25F1E2D3\r\n'
+            b'Content-Type: application/json\r\n'
+            b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body)
+
+
+def test_masked_recording_still_parses(tmp_path):
+    file_path = str(tmp_path / 'frames.jsonl')
+    recorder = FrameRecorder(file_path)
+    recorder.record(build_frame(json.dumps(DATA).encode()))
+    recorder.close()
+
+    [(elapsed, frame)] = load_recording(file_path)
+    assert b'001A25F1E2D3' not in frame
+    assert b'001A25000000' in frame
+    parsed = FrameParser(cmd_prefix='\x02').parse(frame)
+    assert parsed.msg_type == MSG_DATA
+    assert parsed.data == DATA
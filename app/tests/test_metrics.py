@@ -0,0 +1,74 @@
+import asyncio
+from types import SimpleNamespace
+
+from metrics.MemoryUsage import MemoryUsage
+from metrics.Metrics import Gauge
+from mqtt.MqttClient import MqttClient
+from tydom.DeviceRegistry import DeviceRegistry
+from tydom.MessageHandler import MessageHandler, endpoint_last_seen
+from tydom.TydomClient import TydomClient
+
+
+class FakeGmqtt:
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        pass
+
+
+def config(*endpoints):
+    return {'endpoints': [
+        {'id_endpoint': endpoint_id, 'id_device': device_id, 'name': name,
+         'last_usage': 'shutter', 'id_catalog': 'x'}
+        for device_id, endpoint_id, name in endpoints]}
+
+
+def devices_data(device_id, endpoint_id):
+    return [{'id': device_id, 'endpoints': [{'id': endpoint_id, 'error': 0, 'data': [
+        {'name': 'position', 'validity': 'upToDate', 'value': 50}]}]}]
+
+
+def test_remove_label_value():
+    gauge = Gauge('test_gauge', 'Test', ['endpoint', 'name'])
+    gauge.set(1, '1_10', 'Old name')
+    gauge.set(2, '1_10', 'New name')
+    gauge.set(3, '2_20', 'Other')
+
+    gauge.remove('endpoint', '1_10')
+    assert gauge.values == {('2_20', 'Other'): 3}
+
+
+def test_removed_device_drops_its_last_seen_values():
+    tydom_client = TydomClient(mac='001A25000000', password='password')
+    mqtt_client = MqttClient(tydom=tydom_client)
+    mqtt_client.mqtt_client = FakeGmqtt()
+    handler = MessageHandler(tydom_client, mqtt_client, registry=DeviceRegistry())
+
+    async def scenario():
+        await handler.parse_config_data(config((10, 1, 'Shutter'), (20, 2, 'Other')))
+        await handler.parse_devices_data(devices_data(10, 1))
+        await handler.parse_devices_data(devices_data(20, 2))
+        assert ('1_10', 'Shutter') in endpoint_last_seen.values
+        await handler.parse_config_data(config((20, 2, 'Other')))
+
+    asyncio.run(scenario())
+    labels = set(endpoint_last_seen.values)
+    assert not any(endpoint == '1_10' for endpoint, name in labels)
+    assert ('2_20', 'Other') in labels
+
+
+def test_memory_sizes_computed_at_most_every_interval():
+    registry = DeviceRegistry()
+    mqtt_client = SimpleNamespace(
+        state_cache=SimpleNamespace(payloads={'topic': 'payload'}),
+        discovery=SimpleNamespace(entries={}, payloads={}))
+    tydom_client = SimpleNamespace(
+        poll_scheduler=SimpleNamespace(next_polls={}))
+    memory_usage = MemoryUsage(registry, mqtt_client, tydom_client,
+                               size_interval=3600)
+
+    sizes = memory_usage.get_sizes()
+    mqtt_client.state_cache.payloads['other'] = 'x' * 10000
+    assert memory_usage.get_sizes() is sizes
+
+    memory_usage.sizes_at -= 3600
+    assert memory_usage.get_sizes()['state_cache'] > sizes['state_cache'] + 10000
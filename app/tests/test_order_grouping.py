@@ -0,0 +1,73 @@
+import asyncio
+
+from mqtt.MqttClient import MqttClient, orders_topic
+from tydom.OrderGrouping import group_orders
+from tydom.TydomClient import TydomClient
+
+
+def test_group_orders_per_endpoint():
+    groups = group_orders([
+        (10, 1, 'position', '0'),
+        (20, 2, 'position', '0'),
+        ('10', '1', 'onFavPos', 'false'),
+        (10, 1, 'position', '10'),
+    ])
+    # Endpoints in the order of their first order, latest value wins
+    assert list(groups) == [('10', '1'), ('20', '2')]
+    assert list(groups[('10', '1')].items()) == [
+        ('onFavPos', 'false'), ('position', '10')]
+    assert groups[('20', '2')] == {'position': '0'}
+
+
+def test_batch_keeps_other_statuses_when_a_request_fails():
+    tydom = TydomClient(mac='001A25000000', password='password')
+    sent = []
+
+    async def put_endpoint_data(device_id, endpoint_id, entries):
+        sent.append((device_id, endpoint_id, entries))
+        if device_id == '20':
+            raise asyncio.TimeoutError()
+        return 200
+
+    tydom.put_endpoint_data = put_endpoint_data
+    statuses = asyncio.run(tydom.put_devices_data_batch([
+        (10, 1, 'position', '0'), (20, 2, 'position', '0'),
+        (30, 3, 'position', '0'), (10, 1, 'onFavPos', 'false')]))
+
+    assert len(sent) == 3
+    assert statuses[('10', '1')] == 200
+    assert isinstance(statuses[('20', '2')], asyncio.TimeoutError)
+    assert statuses[('30', '3')] == 200
+
+
+class FakeTydom:
+
+    def __init__(self):
+        self.batches = []
+
+    async def put_devices_data_batch(self, orders):
+        self.batches.append(orders)
+        return {(device_id, endpoint_id): 200
+                for device_id, endpoint_id, name, value in orders}
+
+
+def test_orders_topic_sends_one_batch():
+    tydom = FakeTydom()
+    mqtt_client = MqttClient(tydom=tydom)
+    payload = (b'[{"id": "10_1", "name": "position", "value": "0"},'
+               b' {"id": "20_2", "name": "position", "value": 0}]')
+
+    assert asyncio.run(mqtt_client.router.dispatch(orders_topic, payload))
+    assert tydom.batches == [
+        [('10', '1', 'position', '0'), ('20', '2', 'position', 0)]]
+
+
+def test_invalid_orders_are_ignored():
+    tydom = FakeTydom()
+    mqtt_client = MqttClient(tydom=tydom)
+
+    for payload in (b'not json', b'{"id": "10_1"}', b'[{"id": "10"}]',
+                    b'[{"id": "10", "name": "position", "value": "0"}]'):
+        assert not asyncio.run(
+            mqtt_client.router.dispatch(orders_topic, payload))
+    assert tydom.batches == []
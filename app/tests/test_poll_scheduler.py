@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+from tydom.CommandScheduler import LANE_POLL
+from tydom.PollScheduler import DEFAULT_POLL_INTERVAL, PollScheduler
+
+ENERGY_URL = '/devices/10/endpoints/1/cdata?name=energyInstant'
+
+
+class FakeTydomClient:
+
+    def __init__(self):
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def request(self, method, url, lane=None):
+        assert lane == LANE_POLL
+        self.requests.append((method, url))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+
+
+def test_interval_by_cdata_name():
+    scheduler = PollScheduler(None, intervals={'energyInstant': 10})
+    assert scheduler.get_interval(ENERGY_URL) == 10
+    assert scheduler.get_interval(
+        '/devices/10/endpoints/1/cdata?name=other') == DEFAULT_POLL_INTERVAL
+    assert scheduler.get_interval('/devices/10/endpoints/1/data') == \
+        DEFAULT_POLL_INTERVAL
+
+
+def test_urls_deduplicated_and_removed_per_endpoint():
+    scheduler = PollScheduler(None)
+    assert scheduler.add(ENERGY_URL)
+    assert not scheduler.add(ENERGY_URL)
+    scheduler.add('/devices/10/endpoints/1/cdata?name=energyIndex')
+    scheduler.add('/devices/10/endpoints/12/cdata?name=energyIndex')
+
+    scheduler.remove_endpoint(10, 1)
+    assert scheduler.urls == ['/devices/10/endpoints/12/cdata?name=energyIndex']
+    scheduler.clear()
+    assert scheduler.urls == []
+
+
+def test_polls_limited_in_flight_and_rescheduled():
+    tydom_client = FakeTydomClient()
+
+    async def poll_all():
+        scheduler = PollScheduler(tydom_client, max_in_flight=2)
+        for endpoint_id in range(5):
+            scheduler.add(
+                '/devices/10/endpoints/{}/cdata?name=energyInstant'.format(endpoint_id))
+        scheduler.start()
+        scheduler.poll_all()
+        while scheduler.polls < 5 or scheduler.in_flight:
+            await asyncio.sleep(0.005)
+        await scheduler.stop()
+        return [next_poll - time.monotonic()
+                for next_poll in scheduler.next_polls.values()]
+
+    next_polls = asyncio.run(poll_all())
+    assert tydom_client.max_in_flight == 2
+    # Each url polled once, next poll in 10 seconds (+/- 10% jitter)
+    assert len(tydom_client.requests) == 5
+    assert len(set(tydom_client.requests)) == 5
+    assert all(8.5 < next_poll <= 11 for next_poll in next_polls)
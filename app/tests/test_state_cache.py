@@ -0,0 +1,38 @@
+from mqtt.StateCache import StateCache
+
+
+def test_identical_payloads_suppressed():
+    cache = StateCache()
+    assert cache.check('tydom2mqtt/cover/10_1/current_position', '50')
+    assert not cache.check('tydom2mqtt/cover/10_1/current_position', '50')
+    assert cache.check('tydom2mqtt/cover/10_1/current_position', '60')
+    # Per topic
+    assert cache.check('tydom2mqtt/cover/20_2/current_position', '60')
+    assert (cache.sent, cache.suppressed) == (3, 1)
+
+
+def test_heartbeat_publishes_unchanged_payload_again():
+    cache = StateCache(heartbeat=60)
+    topic = 'tydom2mqtt/cover/10_1/current_position'
+    assert cache.check(topic, '50')
+    assert not cache.check(topic, '50')
+    encoded, sent_at = cache.payloads[topic]
+    cache.payloads[topic] = (encoded, sent_at - 60)
+    assert cache.check(topic, '50')
+
+
+def test_forget_and_clear():
+    cache = StateCache()
+    cache.check('a', '1')
+    cache.check('b', '1')
+    cache.forget('a')
+    assert cache.check('a', '1')
+    assert not cache.check('b', '1')
+    cache.clear()
+    assert cache.check('b', '1')
+
+
+def test_encode_like_gmqtt():
+    assert StateCache.encode({'position': 'é'}) == '{"position": "é"}'
+    assert StateCache.encode([1, 2]) == '[1, 2]'
+    assert StateCache.encode('ON') == 'ON'
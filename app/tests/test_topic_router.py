@@ -0,0 +1,61 @@
+import asyncio
+
+from mqtt.TopicRouter import TopicRouter
+
+
+def new_router(*patterns):
+    router = TopicRouter()
+    received = []
+    for pattern in patterns:
+        async def handler(topic, value, pattern=pattern):
+            received.append((pattern, topic, value))
+            return False if value == 'ignore' else None
+        router.add(pattern, pattern, handler)
+    return router, received
+
+
+def matched(router, topic):
+    route = router.match(topic)
+    return route[0] if route is not None else None
+
+
+def test_exact_topics_are_not_in_the_trie():
+    router, received = new_router('a/b', 'a/+')
+    assert router.exact.keys() == {'a/b'}
+    assert router.patterns == ['a/b', 'a/+']
+    # The exact pattern wins over a wildcard matching the same topic
+    assert matched(router, 'a/b') == 'a/b'
+    assert matched(router, 'a/c') == 'a/+'
+
+
+def test_single_level_wildcard():
+    router, received = new_router('tydom2mqtt/cover/+/set_position')
+    assert matched(router, 'tydom2mqtt/cover/10_1/set_position') == \
+        'tydom2mqtt/cover/+/set_position'
+    assert matched(router, 'tydom2mqtt/cover/10_1/set_positionCmd') is None
+    assert matched(router, 'tydom2mqtt/cover/10_1/a/set_position') is None
+    assert matched(router, 'tydom2mqtt/cover/set_position') is None
+
+
+def test_most_specific_wildcard_wins():
+    router, received = new_router('a/#', 'a/+/c', 'a/b/c')
+    assert matched(router, 'a/b/c') == 'a/b/c'
+    assert matched(router, 'a/x/c') == 'a/+/c'
+    assert matched(router, 'a/x/d') == 'a/#'
+    # 'a/#' also matches its parent level
+    assert matched(router, 'a') == 'a/#'
+    assert matched(router, 'b/x') is None
+
+
+def test_dispatch_counts():
+    router, received = new_router('a/b', 'a/+')
+
+    async def dispatch_all():
+        return [await router.dispatch('a/b', b'on'),
+                await router.dispatch('a/c', 'ignore'),
+                await router.dispatch('b', b'on')]
+
+    assert asyncio.run(dispatch_all()) == [True, False, False]
+    # Payloads are decoded before the handlers
+    assert received == [('a/b', 'a/b', 'on'), ('a/+', 'a/c', 'ignore')]
+    assert (router.routed, router.ignored, router.dropped) == (1, 1, 1)
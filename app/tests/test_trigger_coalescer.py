@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+import pytest
+
+from tydom.TriggerCoalescer import TriggerCoalescer
+
+
+def test_triggers_merged_into_the_pending_run():
+    runs = []
+
+    async def action():
+        runs.append(time.monotonic())
+        await asyncio.sleep(0.01)
+        return len(runs)
+
+    async def trigger_all():
+        coalescer = TriggerCoalescer('update', action, min_interval=0)
+        # Two waves: triggers received during the first run share the second
+        first = asyncio.gather(*[coalescer.trigger() for i in range(3)])
+        await asyncio.sleep(0.001)
+        second = asyncio.gather(*[coalescer.trigger() for i in range(3)])
+        return await first, await second, coalescer
+
+    first, second, coalescer = asyncio.run(trigger_all())
+    assert first == [1, 1, 1]
+    assert second == [2, 2, 2]
+    assert (coalescer.requested, coalescer.absorbed, coalescer.runs) == (6, 4, 2)
+
+
+def test_runs_spaced_by_min_interval():
+    runs = []
+
+    async def action():
+        runs.append(time.monotonic())
+
+    async def trigger_twice():
+        coalescer = TriggerCoalescer('refresh', action, min_interval=0.05)
+        await coalescer.trigger()
+        await coalescer.trigger()
+
+    asyncio.run(trigger_twice())
+    assert len(runs) == 2
+    assert runs[1] - runs[0] >= 0.05
+
+
+def test_failure_reported_to_the_waiting_callers():
+    async def action():
+        raise ConnectionError('closed')
+
+    async def trigger():
+        coalescer = TriggerCoalescer('update', action, min_interval=0)
+        # Not waited for: the failure must not be left unretrieved
+        coalescer.trigger_nowait()
+        with pytest.raises(ConnectionError):
+            await coalescer.trigger()
+        return coalescer
+
+    assert asyncio.run(trigger()).runs == 1
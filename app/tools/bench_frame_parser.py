@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Compare the frame parser with the former string sniffing triage.
+
+Usage (from the app directory):
+    python -m tools.bench_frame_parser [--endpoints 150] [--iterations 200]
+"""
+import argparse
+import json
+import time
+from http.client import HTTPResponse
+from io import BytesIO
+
+from tydom.FrameParser import FrameParser
+
+CMD_PREFIX = '\x02'
+
+
+def build_devices_data(nb_endpoints):
+    devices = []
+    for i in range(nb_endpoints):
+        devices.append({
+            'id': 1600000000 + i,
+            'endpoints': [{
+                'id': 1600000000 + i,
+                'error': 0,
+                'data': [
+                    {'name': 'intrusionDetect', 'validity': 'upToDate', 'value': False},
+                    {'name': 'battDefect', 'validity': 'upToDate', 'value': False},
+                    {'name': 'autoProtect', 'validity': 'upToDate', 'value': False},
+                    {'name': 'position', 'validity': 'upToDate', 'value': 100},
+                ]}]})
+    return json.dumps(devices).encode('utf-8')
+
+
+def chunked(body, chunk_size=1024):
+    out = b''
+    for i in range(0, len(body), chunk_size):
+        chunk = body[i:i + chunk_size]
+        out += b'%x\r\n' % len(chunk) + chunk + b'\r\n'
+    return out + b'0\r\n\r\n'
+
+
+def build_response_frame(uri_origin, body):
+    return (CMD_PREFIX.encode('ascii') +
+            b'HTTP/1.1 200 OK\r\nServer: Tydom-001A25000000\r\n'
+            b'Uri-Origin: ' + uri_origin.encode('ascii') + b'\r\n'
+            b'Content-Type: application/json\r\nTransfer-Encoding: chunked\r\n'
+            b'Transac-Id: 0\r\n\r\n' + chunked(body))
+
+
+def build_put_frame(uri, body):
+    return (CMD_PREFIX.encode('ascii') +
+            b'PUT ' + uri.encode('ascii') + b' HTTP/1.1\r\n'
+            b'Server: Tydom-001A25000000\r\nContent-Type: application/json\r\n'
+            b'Transfer-Encoding: chunked\r\n\r\n' + chunked(body, 1 << 20))
+
+
+# Former MessageHandler path, kept here as the reference
+class BytesIOSocket:
+    def __init__(self, content):
+        self.handle = BytesIO(content)
+
+    def makefile(self, mode):
+        return self.handle
+
+
+def legacy_parse_put_response(bytes_str, start=6):
+    resp = bytes_str[len(CMD_PREFIX):].decode("utf-8")
+    fields = resp.split("\r\n")
+    fields = fields[start:]
+    end_parsing = False
+    i = 0
+    output = str()
+    while not end_parsing:
+        field = fields[i]
+        if len(field) == 0 or field == '0':
+            end_parsing = True
+        else:
+            output += field
+            i = i + 2
+    parsed = json.loads(output)
+    return json.dumps(parsed)
+
+
+def legacy_parse_response(data):
+    first = str(data[:40])
+    msg_type = None
+    if "id_catalog" in data:
+        msg_type = 'msg_config'
+    elif "cmetadata" in data:
+        msg_type = 'msg_cmetadata'
+    elif "cdata" in data:
+        msg_type = 'msg_cdata'
+    elif "id" in first:
+        msg_type = 'msg_data'
+    return msg_type, json.loads(data)
+
+
+def legacy_triage(bytes_str):
+    first = str(bytes_str[:40])
+    if "PUT /devices/data" in first:
+        try:
+            incoming = legacy_parse_put_response(bytes_str)
+        except BaseException:
+            incoming = legacy_parse_put_response(bytes_str, 7)
+    else:
+        sock = BytesIOSocket(bytes_str[len(CMD_PREFIX):])
+        response = HTTPResponse(sock)
+        response.begin()
+        incoming = response.read().decode("utf-8")
+    return legacy_parse_response(incoming)
+
+
+def bench(name, function, frame, iterations):
+    function(frame)  # warm up
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function(frame)
+    elapsed = time.perf_counter() - start
+    per_frame = elapsed / iterations * 1e6
+    print('{:<40} {:>10.1f} us/frame {:>10.0f} frames/s'.format(
+        name, per_frame, iterations / elapsed))
+    return per_frame
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--endpoints', type=int, default=150)
+    arg_parser.add_argument('--iterations', type=int, default=200)
+    args = arg_parser.parse_args()
+
+    parser = FrameParser(cmd_prefix=CMD_PREFIX)
+    body = build_devices_data(args.endpoints)
+    single = build_devices_data(1)
+    frames = [
+        ('GET /devices/data ({} endpoints)'.format(args.endpoints),
+         build_response_frame('/devices/data', body)),
+        ('PUT /devices/data (1 endpoint)',
+         build_put_frame('/devices/data', single)),
+    ]
+
+    for label, frame in frames:
+        assert parser.parse(frame).data == legacy_triage(frame)[1]
+        print(label)
+        legacy = bench('  legacy triage', legacy_triage, frame, args.iterations)
+        current = bench('  FrameParser.parse', parser.parse, frame, args.iterations)
+        print('  speedup x{:.2f}'.format(legacy / current))
+
+
+if __name__ == '__main__':
+    main()
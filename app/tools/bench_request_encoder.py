@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Compare the request encoder with the former string concatenation.
+
+Usage (from the app directory):
+    python -m tools.bench_request_encoder [--iterations 20000] [--repeat 25]
+"""
+import argparse
+import json
+import time
+
+from tydom.RequestEncoder import RequestEncoder
+
+CMD_PREFIX = '\x02'
+
+
+# Former TydomClient.send_message / put_devices_data, kept as reference
+def legacy_send_message(method, msg, transac_id, body=None):
+    if body is None:
+        str_request = (
+            CMD_PREFIX + method + " " + msg +
+            " HTTP/1.1\r\nContent-Length: 0\r\nContent-Type: application/json; charset=UTF-8\r\nTransac-Id: " +
+            transac_id + "\r\n\r\n")
+    else:
+        body = json.dumps(body)
+        str_request = (
+            CMD_PREFIX + method + " " + msg +
+            " HTTP/1.1\r\nContent-Length: " + str(len(body)) +
+            "\r\nContent-Type: application/json; charset=UTF-8\r\nTransac-Id: " +
+            transac_id + "\r\n\r\n" + body + "\r\n\r\n")
+    return bytes(str_request, "ascii")
+
+
+def legacy_put_devices_data(device_id, endpoint_id, name, value, transac_id):
+    body = '[{"name":"' + name + '","value":"' + value + '"}]'
+    str_request = (
+        CMD_PREFIX +
+        f"PUT /devices/{device_id}/endpoints/{endpoint_id}/data HTTP/1.1\r\nContent-Length: " +
+        str(len(body)) +
+        "\r\nContent-Type: application/json; charset=UTF-8\r\nTransac-Id: " +
+        transac_id + "\r\n\r\n" + body + "\r\n\r\n")
+    return bytes(str_request, "ascii")
+
+
+def run(function, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        function(i)
+    return (time.perf_counter() - start) / iterations * 1e9
+
+
+# Runs alternate between the two versions, the best run of each is kept
+# (the least disturbed by the other processes)
+def bench(functions, iterations, repeat):
+    costs = [float('inf')] * len(functions)
+    for function in functions:
+        function(0)  # warm up
+    for _ in range(repeat):
+        for index, function in enumerate(functions):
+            costs[index] = min(costs[index], run(function, iterations))
+    return costs
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--iterations', type=int, default=20000)
+    arg_parser.add_argument('--repeat', type=int, default=25)
+    args = arg_parser.parse_args()
+
+    encoder = RequestEncoder(cmd_prefix=CMD_PREFIX)
+    # Orders spread over a few endpoints, transaction ids are strings
+    # (TydomClient.next_transac_id)
+    endpoints = [(1600000010 + n, 1600000010 + n) for n in range(16)]
+    positions = [str(position) for position in range(101)]
+    commands = [
+        ('GET /devices/data',
+         lambda i: legacy_send_message('GET', '/devices/data', str(i)),
+         lambda i: encoder.encode('GET', '/devices/data', str(i))),
+        ('PUT /devices/.../data',
+         lambda i: legacy_put_devices_data(
+             *endpoints[i % 16], 'position', positions[i % 101], str(i)),
+         lambda i: encoder.encode(
+             'PUT', encoder.get_endpoint_data_url(*endpoints[i % 16]), str(i),
+             encoder.encode_entry('position', positions[i % 101]))),
+        ('PUT /areas/.../data',
+         lambda i: legacy_send_message(
+             'PUT', '/areas/1/data', str(i), [{'name': 'mode', 'value': 'ON'}]),
+         lambda i: encoder.encode(
+             'PUT', '/areas/1/data', str(i),
+             encoder.encode_entries({'mode': 'ON'}))),
+    ]
+
+    assert legacy_send_message('GET', '/devices/data', '7') == \
+        encoder.encode('GET', '/devices/data', 7)
+    url = encoder.get_endpoint_data_url(1600000010, 1600000010)
+    assert legacy_put_devices_data(
+        1600000010, 1600000010, 'position', '50', '7') == \
+        encoder.encode('PUT', url, 7, encoder.encode_entry('position', '50'))
+    # Content-Length counts bytes, not characters
+    request = encoder.encode(
+        'PUT', url, 1, encoder.encode_entries({'label': 'Entrée "1"'}))
+    head, body = request.split(b'\r\n\r\n', 1)
+    assert int(head.split(b'Content-Length: ')[1].split(b'\r\n')[0]) == \
+        len(body) - len(b'\r\n\r\n')
+    assert json.loads(body[:-4])[0]['value'] == 'Entrée "1"'
+
+    for label, legacy, current in commands:
+        print(label)
+        legacy_cost, current_cost = bench(
+            (legacy, current), args.iterations, args.repeat)
+        print('  {:<28} {:>8.0f} ns/command'.format(
+            'legacy string building', legacy_cost))
+        print('  {:<28} {:>8.0f} ns/command'.format(
+            'RequestEncoder.encode', current_cost))
+        print('  speedup x{:.2f}'.format(legacy_cost / current_cost))
+
+
+if __name__ == '__main__':
+    main()
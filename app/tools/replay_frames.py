@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""Replay recorded Tydom frames through the message handler.
+
+Frames recorded with TYDOM_RECORD_FILE are parsed and handled by the real
+MessageHandler, publishing to a fake MQTT client. Reports frames/s, per
+frame latency, memory allocations and MQTT publishes. The publishes can be
+saved and compared against a previous run, to check that an optimisation
+does not change what is sent to Home Assistant.
+
+Usage (from the app directory):
+    python -m tools.replay_frames recording.jsonl [--loops 10]
+    python -m tools.replay_frames recording.jsonl --save-publishes out.json
+    python -m tools.replay_frames recording.jsonl --compare out.json
+    python -m tools.replay_frames --synthetic 150
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+import tracemalloc
+
+from mqtt.MqttClient import MqttClient
+from tools.bench_frame_parser import build_put_frame, build_response_frame
+from tydom.FrameRecorder import load_recording
+from tydom.MessageHandler import MessageHandler
+from tydom.TydomClient import TydomClient
+
+
+class FakeConnection:
+    """Websocket connection swallowing the requests of the handler."""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, message):
+        self.sent += 1
+
+    async def close(self):
+        pass
+
+
+class FakeMqtt:
+    """gmqtt client recording the publishes."""
+
+    def __init__(self):
+        self.publishes = []
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.publishes.append((topic, payload))
+
+    def subscribe(self, *args, **kwargs):
+        pass
+
+
+def build_synthetic_recording(nb_endpoints):
+    configuration = {'endpoints': [
+        {'id_endpoint': i, 'id_device': i, 'name': 'Window {}'.format(i),
+         'last_usage': 'window', 'id_catalog': 'x'}
+        for i in range(nb_endpoints)]}
+    frames = [build_response_frame(
+        '/configs/file', json.dumps(configuration).encode('utf-8'))]
+    for step in range(10):
+        for i in range(nb_endpoints):
+            frames.append(build_put_frame('/devices/data', json.dumps([{
+                'id': i,
+                'endpoints': [{'id': i, 'error': 0, 'data': [
+                    {'name': 'intrusionDetect', 'validity': 'upToDate',
+                     'value': (step + i) % 3 == 0},
+                    {'name': 'battDefect', 'validity': 'upToDate',
+                     'value': False},
+                ]}]}]).encode('utf-8')))
+    return [(0, frame) for frame in frames]
+
+
+def create_handler():
+    tydom_client = TydomClient(mac='001A25000000', password='replay')
+    tydom_client.connection = FakeConnection()
+    mqtt_client = MqttClient(tydom=tydom_client)
+    mqtt_client.mqtt_client = FakeMqtt()
+    return MessageHandler(tydom_client=tydom_client, mqtt_client=mqtt_client)
+
+
+async def replay(frames, trace=False):
+    handler = create_handler()
+    latencies = []
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    for _, frame in frames:
+        frame_start = time.perf_counter()
+        await handler.incoming_triage(frame)
+        latencies.append(time.perf_counter() - frame_start)
+    elapsed = time.perf_counter() - start
+    memory = None
+    if trace:
+        snapshot = tracemalloc.take_snapshot()
+        memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        memory += (sum(stat.count for stat in snapshot.statistics('filename')),)
+    return handler, elapsed, latencies, memory
+
+
+def percentile(values, ratio):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('recording', nargs='?')
+    arg_parser.add_argument('--synthetic', type=int, default=0,
+                            help='replay generated frames for N endpoints')
+    arg_parser.add_argument('--loops', type=int, default=5)
+    arg_parser.add_argument('--save-publishes')
+    arg_parser.add_argument('--compare')
+    args = arg_parser.parse_args()
+
+    if args.recording:
+        frames = load_recording(args.recording)
+    elif args.synthetic:
+        frames = build_synthetic_recording(args.synthetic)
+    else:
+        arg_parser.error('a recording or --synthetic is required')
+    logging.basicConfig(level=logging.ERROR)
+
+    # Fresh handler per loop, so that every loop publishes the same
+    latencies = []
+    elapsed = 0
+    for _ in range(args.loops):
+        handler, loop_elapsed, loop_latencies, _ = asyncio.run(replay(frames))
+        elapsed += loop_elapsed
+        latencies.extend(loop_latencies)
+    # Separate run, tracemalloc slows everything down
+    _, _, _, (current, peak, blocks) = asyncio.run(replay(frames, trace=True))
+
+    mqtt_client = handler.mqtt_client
+    publishes = mqtt_client.mqtt_client.publishes
+    published_bytes = sum(len(str(payload)) for _, payload in publishes)
+    print('{} frames x {} loops'.format(len(frames), args.loops))
+    print('  {:>10.0f} frames/s'.format(len(latencies) / elapsed))
+    print('  {:>10.1f} us p50 / frame'.format(percentile(latencies, 0.5) * 1e6))
+    print('  {:>10.1f} us p99 / frame'.format(percentile(latencies, 0.99) * 1e6))
+    print('  {:>10.1f} KiB retained, {:.1f} KiB peak, {} blocks'.format(
+        current / 1024, peak / 1024, blocks))
+    print('  {:>10} publishes ({} bytes), {} states suppressed'.format(
+        len(publishes), published_bytes, mqtt_client.state_cache.suppressed))
+
+    publishes = [[topic, str(payload)] for topic, payload in publishes]
+    if args.save_publishes:
+        with open(args.save_publishes, 'w', encoding='utf-8') as f:
+            json.dump(publishes, f, indent=1, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            expected = json.load(f)
+        if expected != publishes:
+            for index, (old, new) in enumerate(zip(expected, publishes)):
+                if old != new:
+                    print('First difference at publish {}:\n  expected {}\n  got      {}'.format(
+                        index, old, new))
+                    break
+            else:
+                print('Expected {} publishes, got {}'.format(
+                    len(expected), len(publishes)))
+            sys.exit(1)
+        print('Publishes identical to {}'.format(args.compare))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+"""Local Tydom gateway simulator, for load and soak tests of the bridge.
+
+Speaks the Tydom protocol over a digest authenticated websocket: /info,
+/configs/file, /devices/meta, /devices/cmeta, /devices/data, /areas/data,
+/refresh/all, /ping, Tywatt cdata and device orders. Device changes are
+pushed as chunked PUT /devices/data frames at the requested rate, and the
+connection can be dropped periodically.
+
+Usage (from the app directory, websockets >= 13):
+    python -m tools.tydom_simulator --devices 150 --rate 20 --port 8443 \\
+        [--disconnect-every 300] [--disconnect-mode abort]
+then start the bridge with TYDOM_IP=127.0.0.1 TYDOM_PORT=8443
+TYDOM_MAC=001A25000000 TYDOM_PASSWORD=simulator.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import secrets
+import ssl
+import subprocess
+import tempfile
+import time
+from http import HTTPStatus
+
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+
+from tools.bench_frame_parser import chunked
+from tydom.FrameParser import FrameParser
+
+logger = logging.getLogger('tydom_simulator')
+
+REALM = 'protected area'
+
+
+class SimulatedDevice:
+    __slots__ = ('device_id', 'endpoint_id', 'name', 'usage', 'data')
+
+    def __init__(self, device_id, name, usage, data):
+        self.device_id = device_id
+        self.endpoint_id = device_id
+        self.name = name
+        self.usage = usage
+        self.data = data
+
+    def endpoint_data(self, names=None):
+        return {
+            'id': self.device_id,
+            'endpoints': [{
+                'id': self.endpoint_id,
+                'error': 0,
+                'data': [{'name': name, 'validity': 'upToDate', 'value': value}
+                         for name, value in self.data.items()
+                         if names is None or name in names],
+            }],
+        }
+
+
+def build_devices(nb_devices, tywatt=True, alarm=True):
+    devices = []
+    if alarm:
+        devices.append(SimulatedDevice(1600000000, 'Alarme', 'alarm', {
+            'alarmMode': 'OFF', 'alarmState': 'OFF', 'alarmSOS': False,
+            'part1State': 'OFF', 'part2State': 'OFF', 'gsmLevel': 80,
+            'networkDefect': False, 'unitBatteryDefect': False,
+            'outTemperature': 18.5}))
+    if tywatt:
+        devices.append(SimulatedDevice(1600000001, 'Tywatt', 'conso', {}))
+    i = 0
+    while len(devices) < nb_devices:
+        device_id = 1600000010 + i
+        kind = i % 3
+        if kind == 0:
+            devices.append(SimulatedDevice(
+                device_id, 'Fenetre {}'.format(i), 'window', {
+                    'intrusionDetect': False, 'battDefect': False,
+                    'autoProtect': False}))
+        elif kind == 1:
+            devices.append(SimulatedDevice(
+                device_id, 'Porte {}'.format(i), 'belmDoor', {
+                    'intrusionDetect': False, 'battDefect': False,
+                    'autoProtect': False}))
+        else:
+            devices.append(SimulatedDevice(
+                device_id, 'Volet {}'.format(i), 'shutter', {
+                    'position': 100, 'onFavPos': False,
+                    'thermicDefect': False, 'obstacleDefect': False,
+                    'intrusion': False, 'battDefect': False}))
+        i += 1
+    return devices
+
+
+# Random change of one value of a device, names of the changed values
+def mutate(device):
+    data = device.data
+    if device.usage == 'shutter':
+        data['position'] = random.choice((0, 25, 50, 75, 100))
+        return ['position']
+    if device.usage == 'alarm':
+        data['gsmLevel'] = random.randint(50, 100)
+        data['outTemperature'] = round(random.uniform(5, 25), 1)
+        return ['gsmLevel', 'outTemperature']
+    data['intrusionDetect'] = not data['intrusionDetect']
+    return ['intrusionDetect']
+
+
+class TydomSimulator:
+    def __init__(self, mac, password, devices, rate=1.0, batch=1,
+                 latency=0.0, disconnect_every=0, disconnect_mode='close',
+                 cmd_prefix=''):
+        self.mac = mac
+        self.password = password
+        self.devices = devices
+        self.devices_by_id = {device.device_id: device for device in devices}
+        self.rate = rate
+        self.batch = batch
+        self.latency = latency
+        self.disconnect_every = disconnect_every
+        self.disconnect_mode = disconnect_mode
+        self.cmd_prefix = cmd_prefix.encode('ascii')
+        self.parser = FrameParser(cmd_prefix=cmd_prefix)
+        self.nonces = set()
+        # Statistics
+        self.connections = 0
+        self.requests = 0
+        self.pushed = 0
+        self.sent_bytes = 0
+
+    # Digest authentication of the websocket upgrade
+    def process_request(self, connection, request):
+        authorization = request.headers.get('Authorization')
+        if authorization is not None and self.check_digest(
+                authorization, request.path):
+            return None
+        nonce = secrets.token_hex(16)
+        self.nonces.add(nonce)
+        response = connection.respond(HTTPStatus.UNAUTHORIZED, 'Unauthorized\n')
+        response.headers['WWW-Authenticate'] = (
+            'Digest realm="{}", qop="auth", nonce="{}", opaque="{}"'.format(
+                REALM, nonce, secrets.token_hex(8)))
+        return response
+
+    def check_digest(self, authorization, path):
+        if not authorization.startswith('Digest '):
+            return False
+        fields = {}
+        for part in authorization[7:].split(','):
+            if '=' in part:
+                name, value = part.split('=', 1)
+                fields[name.strip()] = value.strip().strip('"')
+        if fields.get('nonce') not in self.nonces or fields.get('uri') != path:
+            return False
+
+        def md5(text):
+            return hashlib.md5(text.encode('utf-8')).hexdigest()
+        ha1 = md5('{}:{}:{}'.format(self.mac, REALM, self.password))
+        ha2 = md5('GET:{}'.format(path))
+        expected = md5(':'.join((
+            ha1, fields['nonce'], fields.get('nc', ''),
+            fields.get('cnonce', ''), fields.get('qop', ''), ha2)))
+        if expected != fields.get('response'):
+            logger.warning('Invalid digest for %s', fields.get('username'))
+            return False
+        self.nonces.discard(fields['nonce'])
+        return True
+
+    async def handler(self, connection):
+        self.connections += 1
+        logger.info('Bridge connected (%d)', self.connections)
+        tasks = [asyncio.create_task(self.push_updates(connection))]
+        if self.disconnect_every > 0:
+            tasks.append(asyncio.create_task(self.disconnect_later(connection)))
+        try:
+            async for message in connection:
+                if isinstance(message, str):
+                    message = message.encode('utf-8')
+                await self.handle_request(connection, message)
+        except ConnectionClosed:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            logger.info('Bridge disconnected')
+
+    async def disconnect_later(self, connection):
+        await asyncio.sleep(self.disconnect_every)
+        logger.info('Injecting disconnect (%s)', self.disconnect_mode)
+        if self.disconnect_mode == 'abort':
+            connection.transport.abort()
+        else:
+            await connection.close()
+
+    async def send(self, connection, frame):
+        self.sent_bytes += len(frame)
+        await connection.send(frame)
+
+    def response(self, uri, transac_id, body=None, status='200 OK'):
+        head = ('HTTP/1.1 {}\r\nServer: Tydom-{}\r\nUri-Origin: {}\r\n'
+                'Content-Type: application/json\r\n'.format(status, self.mac, uri))
+        if transac_id is not None:
+            head += 'Transac-Id: {}\r\n'.format(transac_id)
+        if body is None:
+            return self.cmd_prefix + (head + 'Content-Length: 0\r\n\r\n').encode('ascii')
+        return (self.cmd_prefix +
+                (head + 'Transfer-Encoding: chunked\r\n\r\n').encode('ascii') +
+                chunked(json.dumps(body).encode('utf-8')))
+
+    def push_frame(self, devices_data):
+        return (self.cmd_prefix +
+                'PUT /devices/data HTTP/1.1\r\nServer: Tydom-{}\r\n'
+                'Content-Type: application/json\r\n'
+                'Transfer-Encoding: chunked\r\n\r\n'.format(self.mac).encode('ascii') +
+                chunked(json.dumps(devices_data).encode('utf-8')))
+
+    async def handle_request(self, connection, message):
+        self.requests += 1
+        request = self.parser.parse(message)
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        path = request.uri.split('?', 1)[0]
+        parts = path.strip('/').split('/')
+        transac_id = request.transac_id
+        body = None
+        pushed = None
+
+        if path == '/info':
+            body = {'productName': 'TYDOM 2.0', 'mac': self.mac,
+                    'mainVersionSW': '03.12.23', 'config': 'prod'}
+        elif path == '/configs/file':
+            body = self.configs_file()
+        elif path == '/devices/meta':
+            body = self.devices_meta()
+        elif path == '/devices/cmeta':
+            body = self.devices_cmeta()
+        elif path == '/devices/data':
+            body = [device.endpoint_data() for device in self.devices
+                    if device.data]
+        elif path == '/areas/data':
+            body = []
+        elif path in ('/refresh/all', '/ping'):
+            pass
+        elif len(parts) == 5 and parts[0] == 'devices' and parts[2] == 'endpoints':
+            device = self.devices_by_id.get(int(parts[1]))
+            if device is None:
+                await self.send(connection, self.response(
+                    request.uri, transac_id, status='404 Not Found'))
+                return
+            if parts[4] == 'cdata' and request.method == 'GET':
+                body = self.cdata(device, request.uri)
+            elif parts[4] == 'cdata':
+                pushed = self.alarm_command(device, request.data)
+            elif request.method == 'PUT':
+                pushed = self.device_order(device, request.data)
+            else:
+                body = device.endpoint_data()
+        else:
+            await self.send(connection, self.response(
+                request.uri, transac_id, status='404 Not Found'))
+            return
+
+        await self.send(connection, self.response(request.uri, transac_id, body))
+        if pushed is not None:
+            await self.send(connection, self.push_frame(
+                [device.endpoint_data(pushed)]))
+
+    def configs_file(self):
+        return {'endpoints': [{
+            'id_endpoint': device.endpoint_id,
+            'id_device': device.device_id,
+            'name': device.name,
+            'first_usage': device.usage,
+            'last_usage': device.usage,
+            'id_catalog': 'SIMULATOR',
+            'picto': 'picto_{}'.format(device.usage),
+        } for device in self.devices]}
+
+    def devices_meta(self):
+        return [{
+            'id': device.device_id,
+            'endpoints': [{'id': device.endpoint_id, 'error': 0, 'metadata': [
+                {'name': name, 'type': type(value).__name__, 'permission': 'r'}
+                for name, value in device.data.items()]}],
+        } for device in self.devices]
+
+    def devices_cmeta(self):
+        cmeta = []
+        for device in self.devices:
+            if device.usage != 'conso':
+                continue
+            cmeta.append({'id': device.device_id, 'endpoints': [{
+                'id': device.endpoint_id, 'error': 0, 'cmetadata': [
+                    {'name': 'energyIndex', 'permission': 'r', 'parameters': [
+                        {'name': 'dest', 'type': 'string',
+                         'enum_values': ['ELEC', 'GAS']}]},
+                    {'name': 'energyInstant', 'permission': 'r', 'parameters': [
+                        {'name': 'unit', 'type': 'string',
+                         'enum_values': ['ELEC_A', 'ELEC_W']}]},
+                    {'name': 'energyDistrib', 'permission': 'r', 'parameters': [
+                        {'name': 'src', 'type': 'string',
+                         'enum_values': ['ELEC', 'HEATING']}]},
+                ]}]})
+        return cmeta
+
+    def cdata(self, device, uri):
+        query = dict(part.split('=', 1) for part in uri.split('?', 1)[-1].split('&')
+                     if '=' in part)
+        return [{'id': device.device_id, 'endpoints': [{
+            'id': device.endpoint_id, 'error': 0, 'cdata': [{
+                'name': query.get('name'),
+                'parameters': {key: value for key, value in query.items()
+                               if key != 'name'},
+                'values': {'measure': round(random.uniform(0, 5000), 1),
+                           'timestamp': int(time.time())},
+            }]}]}]
+
+    @staticmethod
+    def device_order(device, orders):
+        changed = []
+        for order in orders or []:
+            name, value = order.get('name'), order.get('value')
+            if name == 'positionCmd':
+                name, value = 'position', {'UP': 100, 'DOWN': 0}.get(
+                    value, device.data.get('position'))
+            elif name == 'position':
+                value = int(value)
+            if name in device.data:
+                device.data[name] = value
+                changed.append(name)
+        return changed or None
+
+    @staticmethod
+    def alarm_command(device, order):
+        if not isinstance(order, dict) or 'alarmMode' not in device.data:
+            return None
+        device.data['alarmMode'] = 'OFF' if order.get('value') == 'OFF' else (
+            'ZONE' if order.get('zones') else 'ON')
+        return ['alarmMode']
+
+    async def push_updates(self, connection):
+        if self.rate <= 0:
+            return
+        candidates = [device for device in self.devices if device.data]
+        interval = self.batch / self.rate
+        next_push = time.monotonic()
+        while True:
+            next_push += interval
+            await asyncio.sleep(max(0, next_push - time.monotonic()))
+            devices_data = []
+            for device in random.sample(candidates, min(self.batch, len(candidates))):
+                devices_data.append(device.endpoint_data(mutate(device)))
+            await self.send(connection, self.push_frame(devices_data))
+            self.pushed += 1
+
+    async def report(self, interval=10):
+        previous = (0, 0)
+        while True:
+            await asyncio.sleep(interval)
+            logger.info(
+                'connections=%d requests=%d (+%d) pushed=%d (+%d) sent=%.1f KiB',
+                self.connections, self.requests, self.requests - previous[0],
+                self.pushed, self.pushed - previous[1], self.sent_bytes / 1024)
+            previous = (self.requests, self.pushed)
+
+
+def create_ssl_context(certfile=None, keyfile=None):
+    if certfile is None:
+        # Throwaway self-signed certificate, the bridge does not verify it
+        directory = tempfile.mkdtemp(prefix='tydom_simulator_')
+        certfile = os.path.join(directory, 'cert.pem')
+        keyfile = os.path.join(directory, 'key.pem')
+        subprocess.run(
+            ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+             '-keyout', keyfile, '-out', certfile, '-days', '1',
+             '-subj', '/CN=tydom-simulator'],
+            check=True, capture_output=True)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile, keyfile)
+    return context
+
+
+async def run(args):
+    simulator = TydomSimulator(
+        mac=args.mac,
+        password=args.password,
+        devices=build_devices(args.devices, tywatt=not args.no_tywatt,
+                              alarm=not args.no_alarm),
+        rate=args.rate,
+        batch=args.batch,
+        latency=args.latency / 1000,
+        disconnect_every=args.disconnect_every,
+        disconnect_mode=args.disconnect_mode,
+        cmd_prefix='\x02' if args.remote_prefix else '')
+    async with serve(
+            simulator.handler, args.host, args.port,
+            ssl=create_ssl_context(args.certfile, args.keyfile),
+            process_request=simulator.process_request,
+            max_size=None):
+        logger.info('Simulating %d devices on wss://%s:%d (%.1f updates/s)',
+                    len(simulator.devices), args.host, args.port, args.rate)
+        await simulator.report()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--port', type=int, default=8443)
+    arg_parser.add_argument('--mac', default='001A25000000')
+    arg_parser.add_argument('--password', default='simulator')
+    arg_parser.add_argument('--devices', type=int, default=20)
+    arg_parser.add_argument('--rate', type=float, default=1.0,
+                            help='pushed frames per second')
+    arg_parser.add_argument('--batch', type=int, default=1,
+                            help='devices per pushed frame')
+    arg_parser.add_argument('--latency', type=float, default=0,
+                            help='response delay (ms)')
+    arg_parser.add_argument('--disconnect-every', type=float, default=0,
+                            help='seconds before dropping each connection')
+    arg_parser.add_argument('--disconnect-mode', choices=('close', 'abort'),
+                            default='close')
+    arg_parser.add_argument('--remote-prefix', action='store_true',
+                            help='prefix frames like the mediation server')
+    arg_parser.add_argument('--no-tywatt', action='store_true')
+    arg_parser.add_argument('--no-alarm', action='store_true')
+    arg_parser.add_argument('--certfile')
+    arg_parser.add_argument('--keyfile')
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(message)s')
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
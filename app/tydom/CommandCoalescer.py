@@ -0,0 +1,57 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CommandCoalescer:
+    """Only send the latest command submitted per key within a short window.
+
+    The first command for a key opens the window; commands submitted for
+    the same key before it closes replace the pending one. Every caller
+    gets the result of the command finally sent.
+    """
+
+    def __init__(self, delay=0.3):
+        self.delay = delay
+        # key -> [send coroutine function, value, futures]
+        self.pending = {}
+        # Flush tasks, referenced until done
+        self.tasks = set()
+        self.submitted = 0
+        self.sent = 0
+
+    @property
+    def coalesced(self):
+        return self.submitted - self.sent - len(self.pending)
+
+    async def submit(self, key, value, send):
+        self.submitted += 1
+        future = asyncio.get_running_loop().create_future()
+        entry = self.pending.get(key)
+        if entry is None:
+            self.pending[key] = [send, value, [future]]
+            task = asyncio.create_task(self.flush(key))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        else:
+            logger.debug('Command coalesced (key=%s, value=%s)', key, value)
+            entry[0] = send
+            entry[1] = value
+            entry[2].append(future)
+        return await future
+
+    async def flush(self, key):
+        await asyncio.sleep(self.delay)
+        send, value, futures = self.pending.pop(key)
+        self.sent += 1
+        try:
+            result = await send(value)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future in futures:
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from metrics.Metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes of the requests sent to the Tydom, highest first
+LANE_ALARM = 'alarm'
+LANE_USER = 'user'
+LANE_POLL = 'poll'
+LANES = (LANE_ALARM, LANE_USER, LANE_POLL)
+
+command_wait_seconds = metrics.histogram(
+    'tydom2mqtt_tydom_command_wait_seconds',
+    'Time spent by requests in the outgoing queue, by lane', ['lane'],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+commands_queued = metrics.gauge(
+    'tydom2mqtt_tydom_commands_queued',
+    'Requests waiting in the outgoing queue, by lane', ['lane'])
+commands_sent = metrics.counter(
+    'tydom2mqtt_tydom_commands_sent_total',
+    'Requests sent to the Tydom, by lane', ['lane'])
+commands_dropped = metrics.counter(
+    'tydom2mqtt_tydom_commands_dropped_total',
+    'Requests refused by a full lane, by lane', ['lane'])
+
+
+class CommandQueueFull(Exception):
+    pass
+
+
+class CommandScheduler:
+    """Single sender of the requests to the Tydom.
+
+    Requests are queued in priority lanes (alarm, then user actions, then
+    polls and refreshes) and sent one at a time, the highest non-empty lane
+    first: a burst of polls never delays an alarm order by more than the
+    request being sent.
+
+    At most rate requests per second are sent (0 to disable), with bursts
+    of up to burst requests. Each lane holds at most max_queued requests,
+    further submissions raise CommandQueueFull.
+    """
+
+    def __init__(self, send, rate=10, burst=10, max_queued=100):
+        # Coroutine function (bytes)
+        self.send = send
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_queued = max_queued
+        # lane -> deque of (data, future, queued at)
+        self.lanes = {lane: deque() for lane in LANES}
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.sent = dict.fromkeys(LANES, 0)
+        self.dropped = dict.fromkeys(LANES, 0)
+        metrics.add_collector(self.collect_metrics)
+
+    def collect_metrics(self):
+        for lane, queue in self.lanes.items():
+            commands_queued.set(len(queue), lane)
+            commands_sent.set_total(self.sent[lane], lane)
+            commands_dropped.set_total(self.dropped[lane], lane)
+
+    # Queue a request and wait until it has been sent
+    async def submit(self, data, lane):
+        queue = self.lanes[lane]
+        if 0 < self.max_queued <= len(queue):
+            self.dropped[lane] += 1
+            raise CommandQueueFull(
+                'Too many requests queued in the {} lane'.format(lane))
+        future = asyncio.get_running_loop().create_future()
+        queue.append((data, future, time.monotonic()))
+        self.wakeup.set()
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        await future
+
+    # Fail the queued requests (connection closed)
+    def clear(self, exception):
+        for queue in self.lanes.values():
+            while queue:
+                data, future, queued_at = queue.popleft()
+                if not future.done():
+                    future.set_exception(exception)
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def next_request(self):
+        for lane in LANES:
+            queue = self.lanes[lane]
+            while queue:
+                data, future, queued_at = queue.popleft()
+                if not future.done():
+                    return lane, data, future, queued_at
+        return None
+
+    # Wait for a token of the rate limit
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            if not any(self.lanes.values()):
+                await self.wakeup.wait()
+                continue
+            # The lane is chosen once the rate limit allows a request, so
+            # that an alarm order queued meanwhile goes first
+            await self.acquire()
+            request = self.next_request()
+            if request is None:
+                continue
+            lane, data, future, queued_at = request
+            command_wait_seconds.observe(time.monotonic() - queued_at, lane)
+            self.sent[lane] += 1
+            try:
+                await self.send(data)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            if not future.done():
+                future.set_result(None)
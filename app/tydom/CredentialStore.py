@@ -0,0 +1,210 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+import requests
+from urllib3 import encode_multipart_formdata
+
+from .const import *
+
+logger = logging.getLogger(__name__)
+
+
+class CredentialError(Exception):
+    pass
+
+
+class CredentialStore:
+    """Tydom gateway password retrieved from the Delta Dore cloud.
+
+    The password and the OAuth tokens are cached in a JSON file with their
+    expiry, so that a restart does not wait on the cloud (even when the
+    cached password expired). The cache is refreshed in the background with
+    the refresh token before it expires.
+    Cloud urls can be overridden (local stub server...).
+    """
+
+    def __init__(
+            self,
+            login,
+            password,
+            mac,
+            file_path=None,
+            auth_url=DELTADORE_AUTH_URL,
+            sites_url=DELTADORE_API_SITES,
+            password_ttl=7 * 24 * 3600,
+            timeout=10):
+        self.login = login
+        self.password = password
+        self.mac = mac
+        self.file_path = file_path
+        self.auth_url = auth_url
+        self.sites_url = sites_url
+        self.password_ttl = password_ttl
+        self.timeout = timeout
+        self.token_endpoint = None
+        self.cache = {}
+        self.on_password_change = None
+        self.load()
+
+    def load(self):
+        if self.file_path is None:
+            return
+        try:
+            with open(self.file_path) as f:
+                cache = json.load(f)
+            if cache.get('login') == self.login and cache.get('mac') == self.mac:
+                self.cache = cache
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(
+                'Unable to load credentials file %s (%s)', self.file_path, e)
+
+    def save(self):
+        if self.file_path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+            tmp_file_path = self.file_path + '.tmp'
+            fd = os.open(tmp_file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.cache, f)
+            os.replace(tmp_file_path, self.file_path)
+        except OSError as e:
+            logger.warning(
+                'Unable to save credentials file %s (%s)', self.file_path, e)
+
+    # Cached gateway password, None if missing or expired (unless stale
+    # passwords are accepted)
+    def get_cached_password(self, allow_stale=False):
+        password = self.cache.get('gateway_password')
+        if password is None:
+            return None
+        if not allow_stale and self.cache.get('password_expires_at', 0) <= time.time():
+            return None
+        return password
+
+    # Gateway password at startup: the cached one, even expired (renewed in
+    # the background by refresh_loop), from the cloud when nothing is cached
+    def get_password(self):
+        password = self.get_cached_password(allow_stale=True)
+        if password is None:
+            return self.fetch()
+        if self.get_cached_password() is None:
+            logger.info('Tydom password loaded from cache (expired, renewed '
+                        'in the background)')
+        else:
+            logger.info('Tydom password loaded from cache')
+        return password
+
+    # Log in with the Delta Dore account and retrieve the gateway password
+    def fetch(self):
+        self.store_tokens(self.request_token({
+            "username": f"{self.login}",
+            "password": f"{self.password}",
+            "grant_type": DELTADORE_AUTH_GRANT_TYPE,
+            "client_id": DELTADORE_AUTH_CLIENTID,
+            "scope": DELTADORE_AUTH_SCOPE,
+        }))
+        return self.fetch_gateway_password()
+
+    # Renew the tokens with the refresh token, then the gateway password.
+    # Fallback on a full login when the refresh token is not valid anymore
+    def refresh(self):
+        refresh_token = self.cache.get('refresh_token')
+        if refresh_token is None:
+            return self.fetch()
+        try:
+            self.store_tokens(self.request_token({
+                "grant_type": "refresh_token",
+                "refresh_token": refresh_token,
+                "client_id": DELTADORE_AUTH_CLIENTID,
+                "scope": DELTADORE_AUTH_SCOPE,
+            }))
+        except CredentialError as e:
+            logger.info('Unable to refresh Delta Dore token (%s), logging in', e)
+            return self.fetch()
+        return self.fetch_gateway_password()
+
+    def get_token_endpoint(self):
+        if self.token_endpoint is None:
+            self.token_endpoint = self.get_json(
+                'GET', self.auth_url)["token_endpoint"]
+        return self.token_endpoint
+
+    def request_token(self, fields):
+        body, ct_header = encode_multipart_formdata(fields)
+        return self.get_json(
+            'POST',
+            self.get_token_endpoint(),
+            headers={"Content-Type": ct_header},
+            data=body)
+
+    def store_tokens(self, json_response):
+        if "access_token" not in json_response:
+            raise CredentialError('No access token in Delta Dore response')
+        self.cache['access_token'] = json_response["access_token"]
+        if "refresh_token" in json_response:
+            self.cache['refresh_token'] = json_response["refresh_token"]
+        self.cache['token_expires_at'] = time.time() + int(
+            json_response.get("expires_in", 3600))
+
+    def fetch_gateway_password(self):
+        json_response = self.get_json(
+            'GET',
+            self.sites_url + self.mac,
+            headers={"Authorization": f"Bearer {self.cache['access_token']}"})
+        if (
+            "sites" not in json_response
+            or len(json_response["sites"]) == 0
+            or "gateway" not in json_response["sites"][0]
+        ):
+            raise CredentialError(
+                'No Tydom gateway found for {}'.format(self.mac))
+        password = json_response["sites"][0]["gateway"]["password"]
+        self.cache['login'] = self.login
+        self.cache['mac'] = self.mac
+        self.cache['gateway_password'] = password
+        self.cache['password_expires_at'] = time.time() + self.password_ttl
+        self.save()
+        logger.info('Tydom password retrieved from Delta Dore')
+        return password
+
+    def get_json(self, method, url, **kwargs):
+        try:
+            response = requests.request(
+                method, url, timeout=self.timeout, **kwargs)
+            try:
+                response.raise_for_status()
+                return response.json()
+            finally:
+                response.close()
+        except (requests.RequestException, ValueError) as e:
+            raise CredentialError(
+                'Delta Dore request failed ({} {}: {})'.format(
+                    method, url.split('?', 1)[0], e))
+
+    # Refresh the cached credentials one hour before the password expires
+    # (right away when it already expired). The requests run in a thread,
+    # on_password_change is called back on the event loop. Any error is
+    # retried later, the task never stops on its own
+    async def refresh_loop(self, retry_delay=600):
+        while True:
+            expires_at = self.cache.get('password_expires_at', 0)
+            await asyncio.sleep(max(0, expires_at - 3600 - time.time()))
+            previous_password = self.cache.get('gateway_password')
+            try:
+                password = await asyncio.to_thread(self.refresh)
+            except CredentialError as e:
+                logger.warning('Unable to refresh Tydom password (%s)', e)
+                await asyncio.sleep(retry_delay)
+                continue
+            except Exception:
+                logger.exception('Unexpected error refreshing Tydom password')
+                await asyncio.sleep(retry_delay)
+                continue
+            if password != previous_password and self.on_password_change is not None:
+                self.on_password_change(password)
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import logging
+import os
+
+from sensors.Alarm import Alarm
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceRegistry:
+    """Devices known by the bridge, keyed by '<endpoint id>_<device id>'.
+
+    Owned by the MessageHandler and kept across websocket reconnections.
+    Entities are created on the first data of their device, updated
+    afterwards, and removed when their device disappears from (or changes
+    in) /configs/file, so the registry never outgrows the installation.
+
+    The parsed configuration, the polled urls and the fingerprints of the
+    payloads they come from are persisted to a JSON snapshot: the bridge
+    starts warm and only parses again a configuration which changed.
+    """
+
+    def __init__(self, file_path=None):
+        self.file_path = file_path
+        self.device_name = {}
+        self.device_type = {}
+        self.device_endpoint = {}
+        # Sensor / Cover / Alarm instances, keyed by entity unique id
+        self.device_object = {}
+        # Entity unique ids of each device
+        self.device_entities = {}
+        # Last configuration applied from /configs/file
+        self.configuration = None
+        # Urls polled for the devices metadata (Tywatt...)
+        self.poll_urls = []
+        # Fingerprints of the last /configs/file and /devices/cmeta parsed,
+        # and of the configuration the metadata was requested for
+        self.config_fingerprint = None
+        self.cmeta_fingerprint = None
+        self.cmeta_config_fingerprint = None
+        self.dirty = False
+        self.created = 0
+        self.removed = 0
+        self.load()
+
+    @staticmethod
+    def fingerprint(payload):
+        return hashlib.sha1(payload).hexdigest()
+
+    def register(self, unique_id, name, device_type, endpoint_id):
+        if self.device_name.get(unique_id) != name or \
+                self.device_type.get(unique_id) != device_type:
+            self.dirty = True
+        self.device_name[unique_id] = name
+        self.device_type[unique_id] = device_type
+        self.device_endpoint[unique_id] = endpoint_id
+
+    # Apply a /configs/file configuration. Return None when unchanged,
+    # otherwise the removed entities per device
+    def update_configuration(self, names, types, endpoints):
+        configuration = (names, types, endpoints)
+        if configuration == self.configuration:
+            return None
+        old_names, old_types, _ = self.configuration or ({}, {}, {})
+        removed = {}
+        for unique_id in list(self.device_name):
+            if unique_id not in names:
+                removed[unique_id] = self.remove_device(unique_id)
+            elif unique_id in old_names and (
+                    names[unique_id] != old_names[unique_id] or
+                    types[unique_id] != old_types[unique_id]):
+                # Renamed or new usage: entities are created again
+                removed[unique_id] = self.remove_entities(unique_id)
+        self.configuration = configuration
+        # The names and types registered from /devices/cmeta (Tywatt) are
+        # overwritten below: the next metadata is parsed again
+        self.cmeta_fingerprint = None
+        self.dirty = True
+        self.device_name.update(names)
+        self.device_type.update(types)
+        self.device_endpoint.update(endpoints)
+        if removed:
+            logger.info('%d devices removed or changed in configuration',
+                        len(removed))
+        return removed
+
+    def remove_device(self, unique_id):
+        self.device_name.pop(unique_id, None)
+        self.device_type.pop(unique_id, None)
+        self.device_endpoint.pop(unique_id, None)
+        endpoint_id, device_id = unique_id.split('_', 1)
+        prefix = '/devices/{}/endpoints/{}/'.format(device_id, endpoint_id)
+        self.poll_urls = [
+            url for url in self.poll_urls if not url.startswith(prefix)]
+        return self.remove_entities(unique_id)
+
+    def remove_entities(self, unique_id):
+        entities = []
+        for entity_id in self.device_entities.pop(unique_id, ()):
+            entity = self.device_object.pop(entity_id, None)
+            if entity is not None:
+                entities.append(entity)
+        self.removed += len(entities)
+        return entities
+
+    def get_entity(self, entity_id):
+        return self.device_object.get(entity_id)
+
+    def add_entity(self, unique_id, entity_id, entity):
+        self.device_object[entity_id] = entity
+        self.device_entities.setdefault(unique_id, set()).add(entity_id)
+        self.created += 1
+        return entity
+
+    # The Tyxal alarm (there is one per installation)
+    def get_alarm(self):
+        for entity in self.device_object.values():
+            if isinstance(entity, Alarm):
+                return entity
+        return None
+
+    def get_type(self, unique_id):
+        return self.device_type.get(unique_id)
+
+    def get_name(self, unique_id):
+        return self.device_name.get(unique_id)
+
+    def set_poll_urls(self, urls):
+        if urls != self.poll_urls:
+            self.poll_urls = urls
+            self.dirty = True
+
+    def load(self):
+        if self.file_path is None:
+            return
+        try:
+            with open(self.file_path) as f:
+                snapshot = json.load(f)
+            configuration = snapshot['configuration']
+            self.configuration = (configuration['names'],
+                                  configuration['types'],
+                                  configuration['endpoints'])
+            self.device_name.update(snapshot['devices']['names'])
+            self.device_type.update(snapshot['devices']['types'])
+            self.device_endpoint.update(snapshot['devices']['endpoints'])
+            self.poll_urls = snapshot['poll_urls']
+            self.config_fingerprint = snapshot['config_fingerprint']
+            self.cmeta_fingerprint = snapshot['cmeta_fingerprint']
+            self.cmeta_config_fingerprint = snapshot['cmeta_config_fingerprint']
+            logger.info('%d devices loaded from %s',
+                        len(self.device_name), self.file_path)
+        except FileNotFoundError:
+            logger.debug('No device registry file (%s)', self.file_path)
+        except Exception as e:
+            logger.warning(
+                'Unable to load device registry file %s (%s)', self.file_path, e)
+            self.device_name.clear()
+            self.device_type.clear()
+            self.device_endpoint.clear()
+            self.configuration = None
+            self.poll_urls = []
+            self.config_fingerprint = None
+            self.cmeta_fingerprint = None
+            self.cmeta_config_fingerprint = None
+
+    def save(self):
+        if self.file_path is None or not self.dirty or \
+                self.configuration is None:
+            return
+        names, types, endpoints = self.configuration
+        snapshot = {
+            'configuration': {
+                'names': names, 'types': types, 'endpoints': endpoints},
+            'devices': {
+                'names': self.device_name,
+                'types': self.device_type,
+                'endpoints': self.device_endpoint},
+            'poll_urls': self.poll_urls,
+            'config_fingerprint': self.config_fingerprint,
+            'cmeta_fingerprint': self.cmeta_fingerprint,
+            'cmeta_config_fingerprint': self.cmeta_config_fingerprint,
+        }
+        try:
+            os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+            tmp_file_path = self.file_path + '.tmp'
+            with open(tmp_file_path, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_file_path, self.file_path)
+            self.dirty = False
+        except OSError as e:
+            logger.warning(
+                'Unable to save device registry file %s (%s)', self.file_path, e)
@@ -0,0 +1,245 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Message types, resolved from the Uri-Origin header (responses) or the
+# request uri (frames pushed by the Tydom box)
+MSG_CONFIG = 'msg_config'
+MSG_CMETADATA = 'msg_cmetadata'
+MSG_METADATA = 'msg_metadata'
+MSG_DATA = 'msg_data'
+MSG_CDATA = 'msg_cdata'
+MSG_INFO = 'msg_info'
+MSG_HTML = 'msg_html'
+MSG_REFRESH = 'msg_refresh'
+MSG_PONG = 'msg_pong'
+MSG_SCENARII = 'msg_scenarii'
+MSG_MOMENTS = 'msg_moments'
+MSG_ACK = 'msg_ack'
+MSG_UNKNOWN = 'msg_unknown'
+
+# Exact origins
+origin_types = {
+    '/configs/file': MSG_CONFIG,
+    '/devices/cmeta': MSG_CMETADATA,
+    '/devices/meta': MSG_METADATA,
+    '/devices/data': MSG_DATA,
+    '/areas/data': MSG_DATA,
+    '/info': MSG_INFO,
+    '/refresh/all': MSG_REFRESH,
+    '/ping': MSG_PONG,
+    '/scenarios/file': MSG_SCENARII,
+    '/moments/file': MSG_MOMENTS,
+}
+
+CRLF = b'\r\n'
+HTTP_VERSION = b'HTTP/1.1'
+
+
+class FrameError(Exception):
+    pass
+
+
+class TydomFrame:
+    """One HTTP message carried by a Tydom websocket frame.
+
+    Either a response to one of our requests (status is set) or a request
+    pushed by the Tydom box (method and uri are set). The body is decoded
+    from JSON once, in data.
+    """
+
+    __slots__ = ('method', 'uri', 'status', 'headers', 'body', 'data',
+                 'msg_type')
+
+    def __init__(self, method=None, uri=None, status=None, headers=None,
+                 body=b'', data=None, msg_type=MSG_UNKNOWN):
+        self.method = method
+        self.uri = uri
+        self.status = status
+        self.headers = headers if headers is not None else {}
+        self.body = body
+        self.data = data
+        self.msg_type = msg_type
+
+    @property
+    def is_response(self):
+        return self.status is not None
+
+    @property
+    def uri_origin(self):
+        return self.headers.get('uri-origin')
+
+    @property
+    def origin(self):
+        # Where the payload comes from, whatever the frame direction
+        uri_origin = self.headers.get('uri-origin')
+        return uri_origin if uri_origin is not None else self.uri
+
+    @property
+    def transac_id(self):
+        return self.headers.get('transac-id')
+
+    def __repr__(self):
+        return '<TydomFrame {} {} ({} bytes)>'.format(
+            self.msg_type, self.origin, len(self.body))
+
+
+class FrameParser:
+    """Single pass parser for the HTTP over websocket frames sent by Tydom.
+
+    The start line, headers and (possibly chunked) body are read once with
+    offsets into the incoming bytes, and the body is JSON decoded once.
+    """
+
+    def __init__(self, cmd_prefix=''):
+        self.cmd_prefix = cmd_prefix.encode('ascii')
+
+    def parse(self, incoming_bytes):
+        data = bytes(incoming_bytes) if not isinstance(
+            incoming_bytes, bytes) else incoming_bytes
+
+        pos = 0
+        if self.cmd_prefix and data.startswith(self.cmd_prefix):
+            pos = len(self.cmd_prefix)
+
+        # Start line
+        eol = data.find(CRLF, pos)
+        if eol < 0:
+            raise FrameError('No start line in frame')
+        frame = TydomFrame()
+        self.parse_start_line(frame, data[pos:eol])
+        pos = eol + 2
+
+        # Headers
+        headers = frame.headers
+        while True:
+            eol = data.find(CRLF, pos)
+            if eol < 0:
+                eol = len(data)
+            if eol == pos:
+                pos += 2
+                break
+            colon = data.find(b':', pos, eol)
+            if colon > 0:
+                headers[data[pos:colon].decode('ascii').strip().lower()] = \
+                    data[colon + 1:eol].decode('utf-8').strip()
+            pos = eol + 2
+            if pos >= len(data):
+                break
+
+        # Body
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            frame.body = self.read_chunked_body(data, pos)
+        elif 'content-length' in headers:
+            try:
+                length = int(headers['content-length'])
+            except ValueError:
+                raise FrameError('Invalid Content-Length header ({})'.format(
+                    headers['content-length']))
+            frame.body = data[pos:pos + length]
+        else:
+            frame.body = data[pos:].strip()
+
+        self.decode_body(frame)
+        frame.msg_type = self.get_msg_type(frame)
+        return frame
+
+    @staticmethod
+    def parse_start_line(frame, line):
+        if line.startswith(HTTP_VERSION):
+            # HTTP/1.1 200 OK
+            parts = line.split(b' ', 2)
+            try:
+                frame.status = int(parts[1])
+            except (IndexError, ValueError):
+                raise FrameError('Invalid status line ({})'.format(line))
+        else:
+            # PUT /devices/data HTTP/1.1
+            parts = line.split(b' ', 2)
+            if len(parts) < 2:
+                raise FrameError('Invalid request line ({})'.format(line))
+            frame.method = parts[0].decode('ascii')
+            frame.uri = parts[1].decode('utf-8')
+
+    @staticmethod
+    def read_chunked_body(data, pos):
+        chunks = []
+        end = len(data)
+        while pos < end:
+            eol = data.find(CRLF, pos)
+            if eol < 0:
+                eol = end
+            size_field = data[pos:eol].split(b';', 1)[0].strip()
+            if not size_field:
+                # Tolerate blank lines between chunks
+                pos = eol + 2
+                continue
+            try:
+                size = int(size_field, 16)
+            except ValueError:
+                raise FrameError(
+                    'Invalid chunk size ({})'.format(size_field))
+            if size == 0:
+                break
+            pos = eol + 2
+            chunks.append(data[pos:pos + size])
+            pos += size + 2
+        if len(chunks) == 1:
+            return chunks[0]
+        return b''.join(chunks)
+
+    @staticmethod
+    def decode_body(frame):
+        body = frame.body
+        if not body:
+            return
+        first = body[:1]
+        if first == b'{' or first == b'[':
+            frame.data = json.loads(body)
+
+    @staticmethod
+    def get_msg_type(frame):
+        origin = frame.origin
+        if origin is not None:
+            path = origin.split('?', 1)[0]
+            msg_type = origin_types.get(path)
+            if msg_type is not None:
+                return msg_type
+            if path.endswith('/cdata'):
+                return MSG_CDATA
+            if path.endswith('/data'):
+                return MSG_DATA
+
+        body = frame.body
+        if not body:
+            return MSG_ACK if frame.is_response else MSG_UNKNOWN
+        if frame.data is None:
+            if body[:1] == b'<':
+                return MSG_HTML
+            return MSG_UNKNOWN
+
+        # No usable origin: fall back on the payload structure
+        return FrameParser.get_msg_type_from_data(frame.data)
+
+    @staticmethod
+    def get_msg_type_from_data(data):
+        if isinstance(data, dict):
+            if 'endpoints' in data and data['endpoints'] and \
+                    'id_catalog' in data['endpoints'][0]:
+                return MSG_CONFIG
+            if 'productName' in data:
+                return MSG_INFO
+            if 'id' in data:
+                return MSG_DATA
+        elif isinstance(data, list) and data and isinstance(data[0], dict):
+            first = data[0]
+            endpoints = first.get('endpoints')
+            if endpoints:
+                if 'cmetadata' in endpoints[0]:
+                    return MSG_CMETADATA
+                if 'cdata' in endpoints[0]:
+                    return MSG_CDATA
+            if 'id' in first:
+                return MSG_DATA
+        return MSG_UNKNOWN
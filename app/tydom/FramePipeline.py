@@ -0,0 +1,285 @@
+import asyncio
+import logging
+from collections import deque
+
+from logs.HotPathLogging import Payload
+from metrics.Metrics import metrics
+from .FrameParser import MSG_DATA, TydomFrame
+
+logger = logging.getLogger(__name__)
+
+queue_depth = metrics.gauge(
+    'tydom2mqtt_queue_depth', 'Frames waiting in the pipeline queues',
+    ['queue'])
+queue_dropped = metrics.counter(
+    'tydom2mqtt_queue_dropped_total', 'Frames dropped by a full queue',
+    ['queue'])
+queue_coalesced = metrics.counter(
+    'tydom2mqtt_queue_coalesced_total',
+    'Frames merged into a queued frame of the same endpoint', ['queue'])
+
+# Overflow policies of the publish queue
+POLICY_BLOCK = 'block'
+POLICY_DROP_OLDEST = 'drop_oldest'
+POLICY_COALESCE = 'coalesce'
+POLICIES = (POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_COALESCE)
+
+
+class FrameQueue:
+    """Bounded FIFO queue with an overflow policy.
+
+    - block: put() waits for a free slot
+    - drop_oldest: the oldest droppable item is discarded to make room
+    - coalesce: an item whose key is already queued is merged into the
+      queued one (keeping its position), otherwise put() waits
+
+    Items which are not droppable (configuration frames...) are never
+    discarded, put() waits for them instead.
+    """
+
+    def __init__(self, maxsize, policy=POLICY_BLOCK, merge=None):
+        if policy not in POLICIES:
+            raise ValueError('Unknown queue policy ({})'.format(policy))
+        self.maxsize = maxsize
+        self.policy = policy
+        self.merge = merge
+        self.entries = deque()
+        self.keys = {}
+        self.condition = asyncio.Condition()
+        self.dropped = 0
+        self.coalesced = 0
+
+    def qsize(self):
+        return len(self.entries)
+
+    def empty(self):
+        return len(self.entries) == 0
+
+    def full(self):
+        return 0 < self.maxsize <= len(self.entries)
+
+    async def put(self, item, key=None, droppable=True):
+        async with self.condition:
+            if self.policy == POLICY_COALESCE and key is not None:
+                entry = self.keys.get(key)
+                if entry is not None:
+                    entry[1] = self.merge(entry[1], item)
+                    self.coalesced += 1
+                    return
+
+            if self.full() and self.policy == POLICY_DROP_OLDEST:
+                self.drop_oldest()
+
+            while self.full():
+                await self.condition.wait()
+
+            entry = [key, item, droppable]
+            self.entries.append(entry)
+            if key is not None and self.policy == POLICY_COALESCE:
+                self.keys[key] = entry
+            self.condition.notify_all()
+
+    def drop_oldest(self):
+        for entry in self.entries:
+            if entry[2]:
+                self.entries.remove(entry)
+                self.forget(entry)
+                self.dropped += 1
+                logger.debug('Queue full, frame dropped (%s)', entry[1])
+                return
+
+    def forget(self, entry):
+        if entry[0] is not None and self.keys.get(entry[0]) is entry:
+            del self.keys[entry[0]]
+
+    def get_nowait(self):
+        entry = self.entries.popleft()
+        self.forget(entry)
+        return entry[1]
+
+    async def get(self):
+        async with self.condition:
+            while not self.entries:
+                await self.condition.wait()
+            item = self.get_nowait()
+            self.condition.notify_all()
+            return item
+
+
+class FramePipeline:
+    """Receive -> parse -> publish pipeline between Tydom and MQTT.
+
+    The receive task only pushes raw frames to a bounded queue, so slow
+    MQTT publishes never stall the websocket. The alarm endpoints of the
+    data frames go through a priority lane (split out of the full
+    /devices/data dumps) so that bursts of data never delay them.
+    """
+
+    def __init__(self, message_handler, maxsize=256, policy=POLICY_BLOCK):
+        self.message_handler = message_handler
+        self.raw_queue = FrameQueue(maxsize)
+        self.alarm_queue = FrameQueue(0)
+        self.publish_queue = FrameQueue(
+            maxsize, policy=policy, merge=merge_data_frames)
+        self.frame_ready = asyncio.Event()
+        self.tasks = []
+        metrics.add_collector(self.collect_metrics)
+
+    def collect_metrics(self):
+        for name, queue in (('raw', self.raw_queue),
+                            ('alarm', self.alarm_queue),
+                            ('publish', self.publish_queue)):
+            queue_depth.set(queue.qsize(), name)
+            queue_dropped.set_total(queue.dropped, name)
+            queue_coalesced.set_total(queue.coalesced, name)
+
+    def start(self):
+        if not self.tasks:
+            self.tasks = [
+                asyncio.create_task(self.parse_stage()),
+                asyncio.create_task(self.publish_stage()),
+            ]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    # Receive stage entry point: called for every websocket frame
+    async def put(self, incoming_bytes):
+        await self.raw_queue.put(incoming_bytes, droppable=False)
+
+    async def parse_stage(self):
+        while True:
+            incoming_bytes = await self.raw_queue.get()
+            try:
+                frame = self.message_handler.parse_frame(incoming_bytes)
+            except Exception as e:
+                logger.error(
+                    'Technical error when parsing tydom message (error=%s), (message=%s)',
+                    e,
+                    Payload(incoming_bytes))
+                continue
+
+            if frame.msg_type == MSG_DATA:
+                alarm_frame, frame = self.split_alarm_frame(frame)
+                if alarm_frame is not None:
+                    await self.alarm_queue.put(alarm_frame, droppable=False)
+                if frame is not None:
+                    await self.publish_queue.put(
+                        frame, key=get_coalesce_key(frame))
+            else:
+                await self.publish_queue.put(frame, droppable=False)
+            self.frame_ready.set()
+
+    async def publish_stage(self):
+        while True:
+            if self.alarm_queue.empty() and self.publish_queue.empty():
+                self.frame_ready.clear()
+                await self.frame_ready.wait()
+                continue
+            if not self.alarm_queue.empty():
+                frame = await self.alarm_queue.get()
+            else:
+                frame = await self.publish_queue.get()
+            try:
+                await self.message_handler.parse_response(frame)
+            except Exception as e:
+                logger.error('Error when publishing tydom message (%s)', e)
+                logger.exception(e)
+
+    def is_alarm_endpoint(self, device_id, endpoint_id):
+        return self.message_handler.registry.get_type(
+            str(endpoint_id) + '_' + str(device_id)) == 'alarm'
+
+    # Split a data frame into the frame of its alarm endpoints and the
+    # frame of the others, either being None when it has no endpoint
+    def split_alarm_frame(self, frame):
+        if not any(self.is_alarm_endpoint(device_id, endpoint_id)
+                   for device_id, endpoint_id in iter_endpoint_ids(frame.data)):
+            return None, frame
+        alarm_data, other_data = split_endpoints(
+            frame.data, self.is_alarm_endpoint)
+        if not other_data:
+            return frame, None
+        return with_data(frame, alarm_data), with_data(frame, other_data)
+
+
+def iter_endpoint_ids(data):
+    if isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list):
+        return
+    for device in data:
+        if not isinstance(device, dict):
+            continue
+        endpoints = device.get('endpoints')
+        if endpoints is None:  # case of /areas/data
+            yield device.get('id'), device.get('id')
+        else:
+            for endpoint in endpoints:
+                yield device.get('id'), endpoint.get('id')
+
+
+# Split the devices of a data payload into (matching, others) lists,
+# devices with both kinds of endpoints are split too
+def split_endpoints(data, predicate):
+    if isinstance(data, dict):
+        data = [data]
+    matching = []
+    others = []
+    for device in data:
+        if not isinstance(device, dict):
+            others.append(device)
+            continue
+        device_id = device.get('id')
+        endpoints = device.get('endpoints')
+        if endpoints is None:  # case of /areas/data
+            if predicate(device_id, device_id):
+                matching.append(device)
+            else:
+                others.append(device)
+            continue
+        selected = []
+        remaining = []
+        for endpoint in endpoints:
+            if predicate(device_id, endpoint.get('id')):
+                selected.append(endpoint)
+            else:
+                remaining.append(endpoint)
+        if selected:
+            matching.append(dict(device, endpoints=selected))
+        if remaining:
+            others.append(dict(device, endpoints=remaining))
+    return matching, others
+
+
+# Copy of a frame carrying part of its data
+def with_data(frame, data):
+    return TydomFrame(
+        method=frame.method, uri=frame.uri, status=frame.status,
+        headers=frame.headers, body=frame.body, data=data,
+        msg_type=frame.msg_type)
+
+
+# Only frames about a single endpoint (typically pushed by the Tydom box
+# when a device changes) are coalesced
+def get_coalesce_key(frame):
+    data = frame.data
+    if isinstance(data, list) and len(data) == 1 and isinstance(data[0], dict):
+        endpoints = data[0].get('endpoints')
+        if endpoints is not None and len(endpoints) == 1:
+            return frame.origin, data[0].get('id'), endpoints[0].get('id')
+    return None
+
+
+def merge_data_frames(queued, incoming):
+    # Newer values win, values only present in the queued frame are kept
+    queued_endpoint = queued.data[0]['endpoints'][0]
+    incoming_endpoint = incoming.data[0]['endpoints'][0]
+    values = {elem['name']: elem for elem in queued_endpoint.get('data', [])}
+    for elem in incoming_endpoint.get('data', []):
+        values[elem['name']] = elem
+    incoming_endpoint['data'] = list(values.values())
+    return incoming
@@ -0,0 +1,83 @@
+import json
+import logging
+import os
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# Hexadecimal digits of a Tydom MAC address (001A25XXXXXX)
+MAC_PATTERN = re.compile(rb'001A25[0-9A-Fa-f]{6}')
+
+
+class FrameRecorder:
+    """Records the raw frames received from the Tydom to a JSON lines file.
+
+    Each line holds the time elapsed since the start of the recording and
+    the frame. The MAC address is masked with a value of the same length,
+    so that Content-Length headers and chunk sizes stay valid (passwords and
+    the alarm pin are only sent to the Tydom, never received). The recording
+    stops once max_bytes are written.
+    """
+
+    def __init__(self, file_path, max_bytes=50 * 1024 * 1024):
+        self.file_path = file_path
+        self.max_bytes = max_bytes
+        self.written = 0
+        self.frames = 0
+        self.started_at = None
+        self.file = None
+
+    def open(self):
+        directory = os.path.dirname(self.file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.file_path, 'a', encoding='utf-8')
+        self.started_at = time.monotonic()
+        logger.info('Recording Tydom frames to %s', self.file_path)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            logger.info('%d Tydom frames recorded to %s',
+                        self.frames, self.file_path)
+
+    @staticmethod
+    def mask(frame):
+        return MAC_PATTERN.sub(
+            lambda match: match.group(0)[:6] + b'000000', frame)
+
+    def record(self, frame):
+        if self.file is None:
+            if self.started_at is not None:
+                return  # Closed or full
+            self.open()
+        if isinstance(frame, str):
+            frame = frame.encode('utf-8')
+        line = json.dumps({
+            't': round(time.monotonic() - self.started_at, 6),
+            # latin-1 maps every byte to one character, so the frame is
+            # stored as is and stays readable
+            'frame': self.mask(bytes(frame)).decode('latin-1'),
+        }) + '\n'
+        self.file.write(line)
+        self.written += len(line)
+        self.frames += 1
+        if self.written >= self.max_bytes:
+            logger.warning('Tydom recording is full (%s), stopped',
+                           self.file_path)
+            self.close()
+
+
+# Frames of a recording, as (time, bytes)
+def load_recording(file_path):
+    frames = []
+    with open(file_path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            frames.append((entry['t'], entry['frame'].encode('latin-1')))
+    return frames
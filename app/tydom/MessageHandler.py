@@ -1,219 +1,190 @@
-import json
 import logging
-from http.client import HTTPResponse
-from http.server import BaseHTTPRequestHandler
-from io import BytesIO
+import time
 
+from logs.HotPathLogging import Payload, get_device_logger
+from metrics.Metrics import metrics
+from sensors import DeviceTypes
 from sensors.Alarm import Alarm
+from sensors.Cover import Cover
 from sensors.Sensor import Sensor
+from .DeviceRegistry import DeviceRegistry
+from .FrameParser import (FrameParser, MSG_ACK, MSG_CDATA, MSG_CMETADATA,
+                          MSG_CONFIG, MSG_DATA, MSG_HTML, MSG_INFO,
+                          MSG_METADATA, MSG_MOMENTS, MSG_PONG, MSG_REFRESH,
+                          MSG_SCENARII)
+from .StateSnapshot import STALE_ATTRIBUTE
 
 logger = logging.getLogger(__name__)
-
-# Dicts
-deviceAlarmKeywords = [
-    'alarmMode',
-    'alarmState',
-    'alarmSOS',
-    'part1State',
-    'part2State',
-    'part3State',
-    'part4State',
-    'zone1State',
-    'zone2State',
-    'zone3State',
-    'zone4State',
-    'zone5State',
-    'zone6State',
-    'zone7State',
-    'zone8State',
-    'gsmLevel',
-    'inactiveProduct',
-    'zone1State',
-    'liveCheckRunning',
-    'networkDefect',
-    'unitAutoProtect',
-    'unitBatteryDefect',
-    'unackedEvent',
-    'alarmTechnical',
-    'systAutoProtect',
-    'systBatteryDefect',
-    'systSupervisionDefect',
-    'systOpenIssue',
-    'systTechnicalDefect',
-    'videoLinkDefect',
-    'outTemperature',
-    'kernelUpToDate',
-    'irv1State',
-    'irv2State',
-    'irv3State',
-    'irv4State',
-    'simDefect',
-    'remoteSurveyDefect',
-    'systSectorDefect',
-]
-deviceDoorKeywords = ['autoProtect', 'intrusionDetect', 'battDefect']
-deviceWindowKeywords = ['autoProtect', 'intrusionDetect', 'battDefect','motionDetect']
-
-# Device dict for parsing
-device_name = dict()
-device_endpoint = dict()
-device_type = dict()
-device_object = {}
+device_logger = get_device_logger(logger)
+
+frames_received = metrics.counter(
+    'tydom2mqtt_frames_received_total',
+    'Frames received from the Tydom, by message type', ['msg_type'])
+frame_parse_seconds = metrics.histogram(
+    'tydom2mqtt_frame_parse_seconds', 'Time spent parsing a Tydom frame')
+frame_handle_seconds = metrics.histogram(
+    'tydom2mqtt_frame_handle_seconds',
+    'Time spent handling a parsed Tydom frame, MQTT publishes included',
+    ['msg_type'])
+endpoint_last_seen = metrics.gauge(
+    'tydom2mqtt_endpoint_last_seen_timestamp_seconds',
+    'Last time data was received for an endpoint', ['endpoint', 'name'])
+
+# Frames carrying nothing to publish
+ignored_msg_types = frozenset([
+    MSG_ACK,
+    MSG_INFO,
+    MSG_METADATA,
+    MSG_MOMENTS,
+    MSG_PONG,
+    MSG_REFRESH,
+    MSG_SCENARII,
+])
 
 
 class MessageHandler:
 
-    def __init__(self, incoming_bytes, tydom_client, mqtt_client):
-        self.incoming_bytes = incoming_bytes
+    def __init__(self, tydom_client, mqtt_client, registry=None,
+                 state_snapshot=None):
         self.tydom_client = tydom_client
         self.cmd_prefix = tydom_client.cmd_prefix
         self.mqtt_client = mqtt_client
-
-    async def incoming_triage(self):
-        bytes_str = self.incoming_bytes
-        incoming = None
-        first = str(bytes_str[:40])
+        self.registry = registry if registry is not None else DeviceRegistry()
+        self.frame_parser = FrameParser(cmd_prefix=self.cmd_prefix)
+        # Last known endpoint attributes, restored at boot
+        self.state_snapshot = state_snapshot
+        # Warm start: poll the urls of the registry snapshot right away
+        for url in self.registry.poll_urls:
+            self.tydom_client.add_poll_device_url(url)
+
+    # Parse a websocket frame, completing the request it answers if any
+    def parse_frame(self, incoming_bytes):
+        start = time.perf_counter()
         try:
-            if "Uri-Origin: /refresh/all" in first in first:
-                pass
-            elif ("PUT /devices/data" in first) or ("/devices/cdata" in first) or ("PUT /areas/data" in first):
-                logger.debug(
-                    'PUT /devices/data or /areas/data message detected !')
-                try:
-                    try:
-                        incoming = self.parse_put_response(bytes_str)
-                    except BaseException:
-                        # Tywatt response starts at 7
-                        incoming = self.parse_put_response(bytes_str, 7)
-                    await self.parse_response(incoming)
-                except BaseException:
-                    logger.error(
-                        'Error when parsing devices/data tydom message (%s)',
-                        bytes_str)
-                    logger.exception(e)
-            elif ("scn" in first):
-                try:
-                    incoming = self.parse_put_response(bytes_str)
-                    await self.parse_response(incoming)
-                    logger.debug('Scenarii message processed')
-                except BaseException:
-                    logger.error(
-                        'Error when parsing Scenarii tydom message (%s)', bytes_str)
-                    logger.exception(e)
-            elif ("POST" in first):
-                try:
-                    incoming = self.parse_put_response(bytes_str)
-                    await self.parse_response(incoming)
-                    logger.debug('POST message processed')
-                except BaseException:
-                    logger.error(
-                        'Error when parsing POST tydom message (%s)', bytes_str)
-                    logger.exception(e)
-            elif ("HTTP/1.1" in first):
-                response = self.response_from_bytes(
-                    bytes_str[len(self.cmd_prefix):])
-                incoming = response.decode("utf-8")
-                try:
-                    await self.parse_response(incoming)
-                except BaseException:
-                    logger.error(
-                        'Error when parsing HTTP/1.1 tydom message (%s)', bytes_str)
-                    logger.exception(e)
-            else:
-                logger.warning(
-                    'Unknown tydom message type received (%s)', bytes_str)
-
+            frame = self.frame_parser.parse(incoming_bytes)
+        except Exception:
+            frames_received.inc('invalid')
+            raise
+        frame_parse_seconds.observe(time.perf_counter() - start)
+        frames_received.inc(frame.msg_type)
+        self.tydom_client.resolve_request(frame)
+        return frame
+
+    async def incoming_triage(self, incoming_bytes):
+        try:
+            frame = self.parse_frame(incoming_bytes)
         except Exception as e:
             logger.error(
                 'Technical error when parsing tydom message (error=%s), (message=%s)',
                 e,
-                bytes_str)
-            logger.debug('Incoming payload (%s)', incoming)
-            logger.exception(e)
-
-    # Basic response parsing. Typically GET responses + instanciate covers and
-    # alarm class for updating data
-    async def parse_response(self, incoming):
-        data = incoming
-        msg_type = None
-        first = str(data[:40])
-
-        if data != '':
-            if "id_catalog" in data:
-                msg_type = 'msg_config'
-            elif "cmetadata" in data:
-                msg_type = 'msg_cmetadata'
-            elif "cdata" in data:
-                msg_type = 'msg_cdata'
-            elif "id" in first:
-                msg_type = 'msg_data'
-            elif "doctype" in first:
-                msg_type = 'msg_html'
-            elif "productName" in first:
-                msg_type = 'msg_info'
-
-            if msg_type is None:
-                logger.warning('Unknown message type received (%s)', data)
-            else:
-                logger.debug('Message received detected as (%s)', msg_type)
-                try:
-                    if msg_type == 'msg_config':
-                        parsed = json.loads(data)
-                        await self.parse_config_data(parsed=parsed)
+                Payload(incoming_bytes))
+            return
+        await self.parse_response(frame)
+
+    # Dispatch a parsed frame to its handler. Typically GET responses +
+    # instanciate covers and alarm class for updating data
+    async def parse_response(self, frame):
+        start = time.perf_counter()
+        try:
+            await self.dispatch(frame)
+        finally:
+            frame_handle_seconds.observe(
+                time.perf_counter() - start, frame.msg_type)
+
+    async def dispatch(self, frame):
+        msg_type = frame.msg_type
+        logger.debug('Message received detected as (%s)', msg_type)
+        try:
+            if msg_type == MSG_CONFIG:
+                await self.parse_config_data(
+                    parsed=frame.data,
+                    fingerprint=DeviceRegistry.fingerprint(frame.body))
 
-                    elif msg_type == 'msg_cmetadata':
-                        parsed = json.loads(data)
-                        await self.parse_cmeta_data(parsed=parsed)
+            elif msg_type == MSG_CMETADATA:
+                await self.parse_cmeta_data(
+                    parsed=frame.data,
+                    fingerprint=DeviceRegistry.fingerprint(frame.body))
 
-                    elif msg_type == 'msg_data':
-                        parsed = json.loads(data)
-                        await self.parse_devices_data(parsed=parsed)
+            elif msg_type == MSG_DATA:
+                if frame.data is not None:
+                    await self.parse_devices_data(parsed=frame.data)
 
-                    elif msg_type == 'msg_cdata':
-                        parsed = json.loads(data)
-                        await self.parse_devices_cdata(parsed=parsed)
+            elif msg_type == MSG_CDATA:
+                if frame.data is not None:
+                    await self.parse_devices_cdata(parsed=frame.data)
 
-                    elif msg_type == 'msg_html':
-                        logger.debug("HTML Response ?")
-                        logger.debug(data)
+            elif msg_type == MSG_HTML:
+                device_logger.dump('HTML response (%s)', frame.body)
 
-                    elif msg_type == 'msg_info':
-                        pass
-                except Exception as e:
-                    logger.error('Error on parsing tydom response (%s)', e)
-                    logger.error('Incoming data (%s)', data)
-                    logger.exception(e)
-            logger.debug('Incoming data parsed with success')
+            elif msg_type in ignored_msg_types:
+                pass
 
-    @staticmethod
-    async def parse_config_data(parsed):
+            else:
+                logger.warning(
+                    'Unknown tydom message type received (%s)',
+                    Payload(frame.body))
+                return
+        except Exception as e:
+            logger.error('Error on parsing tydom response (%s)', e)
+            logger.error('Incoming data (%s)', Payload(frame.body))
+            logger.exception(e)
+            return
+        logger.debug('Incoming data parsed with success')
+
+    async def parse_config_data(self, parsed, fingerprint=None):
+        if fingerprint is not None and \
+                fingerprint == self.registry.config_fingerprint:
+            logger.debug('Configuration unchanged (same fingerprint)')
+            return
+        names = {}
+        types = {}
+        endpoints = {}
         for i in parsed["endpoints"]:
             device_unique_id = str(i["id_endpoint"]) + \
                 "_" + str(i["id_device"])
-
-            if  i["last_usage"] == 'window' or i["last_usage"] == 'windowFrench' or i["last_usage"] == 'windowSliding' or i["last_usage"] == 'klineWindowFrench' or i["last_usage"] == 'klineWindowSliding':
-                device_name[device_unique_id] = i["name"]
-                device_type[device_unique_id] = 'window'
-                device_endpoint[device_unique_id] = i["id_endpoint"]
-
-            elif  i["last_usage"] == 'belmDoor' or i["last_usage"] == 'klineDoor':
-                device_name[device_unique_id] = i["name"]
-                device_type[device_unique_id] = 'door'
-                device_endpoint[device_unique_id] = i["id_endpoint"]
-
-            elif i["last_usage"] == 'alarm':
-                device_name[device_unique_id] = "Tyxal Alarm"
-                device_type[device_unique_id] = 'alarm'
-                device_endpoint[device_unique_id] = i["id_endpoint"]
-
-            else:
-                device_name[device_unique_id] = i["name"]
-                device_type[device_unique_id] = 'unknown'
-                device_endpoint[device_unique_id] = i["id_endpoint"]
-
-        logger.debug('Configuration updated')
-
-    async def parse_cmeta_data(self, parsed):
+            device_kind = DeviceTypes.get_kind_from_usage(i["last_usage"])
+            names[device_unique_id] = device_kind.name if device_kind.name is not None else i["name"]
+            types[device_unique_id] = device_kind.kind
+            endpoints[device_unique_id] = i["id_endpoint"]
+
+        removed = self.registry.update_configuration(names, types, endpoints)
+        if removed is None:
+            logger.debug('Configuration unchanged')
+        else:
+            logger.debug('Configuration updated')
+            for unique_id, entities in removed.items():
+                self.forget_device(unique_id, entities)
+
+        # Entities are identified by '<device id>_<endpoint id>'
+        self.mqtt_client.prune_discovery(set(
+            str(i["id_device"]) + "_" + str(i["id_endpoint"])
+            for i in parsed["endpoints"]))
+        self.registry.config_fingerprint = fingerprint
+        self.registry.dirty = True
+        self.registry.save()
+
+    # Drop what is kept about a device removed from (or changed in) the
+    # configuration
+    def forget_device(self, unique_id, entities):
+        for entity in entities:
+            for topic in entity.get_state_topics():
+                self.mqtt_client.state_cache.forget(topic)
+            device_logger.forget(entity.id)
+        endpoint_last_seen.remove('endpoint', unique_id)
+        if self.registry.get_type(unique_id) is None:
+            endpoint_id, device_id = unique_id.split('_', 1)
+            self.tydom_client.poll_scheduler.remove_endpoint(
+                device_id, endpoint_id)
+            if self.state_snapshot is not None:
+                self.state_snapshot.forget(unique_id)
+        device_logger.forget(unique_id)
+
+    async def parse_cmeta_data(self, parsed, fingerprint=None):
+        if fingerprint is not None and \
+                fingerprint == self.registry.cmeta_fingerprint:
+            logger.debug('Metadata configuration unchanged (same fingerprint)')
+            return
+        poll_urls = []
         for i in parsed:
             for endpoint in i["endpoints"]:
                 if len(endpoint["cmetadata"]) > 0:
@@ -223,42 +194,41 @@ class MessageHandler:
                         unique_id = str(endpoint_id) + "_" + str(device_id)
 
                         if elem["name"] == "energyIndex":
-                            device_name[unique_id] = 'Tywatt'
-                            device_type[unique_id] = 'conso'
+                            self.registry.register(
+                                unique_id, 'Tywatt', 'conso', endpoint_id)
                             for params in elem["parameters"]:
                                 if params["name"] == "dest":
                                     for dest in params["enum_values"]:
                                         url = "/devices/" + str(i["id"]) + "/endpoints/" + str(
                                             endpoint["id"]) + "/cdata?name=" + elem["name"] + "&dest=" + dest + "&reset=false"
-                                        self.tydom_client.add_poll_device_url(
-                                            url)
-                                        logger.debug(
-                                            "Add poll device : " + url)
+                                        poll_urls.append(url)
                         elif elem["name"] == "energyInstant":
-                            device_name[unique_id] = 'Tywatt'
-                            device_type[unique_id] = 'conso'
+                            self.registry.register(
+                                unique_id, 'Tywatt', 'conso', endpoint_id)
                             for params in elem["parameters"]:
                                 if params["name"] == "unit":
                                     for unit in params["enum_values"]:
                                         url = "/devices/" + str(i["id"]) + "/endpoints/" + str(
                                             endpoint["id"]) + "/cdata?name=" + elem["name"] + "&unit=" + unit + "&reset=false"
-                                        self.tydom_client.add_poll_device_url(
-                                            url)
-                                        logger.debug(
-                                            "Add poll device : " + url)
+                                        poll_urls.append(url)
                         elif elem["name"] == "energyDistrib":
-                            device_name[unique_id] = 'Tywatt'
-                            device_type[unique_id] = 'conso'
+                            self.registry.register(
+                                unique_id, 'Tywatt', 'conso', endpoint_id)
                             for params in elem["parameters"]:
                                 if params["name"] == "src":
                                     for src in params["enum_values"]:
                                         url = "/devices/" + str(i["id"]) + "/endpoints/" + str(
                                             endpoint["id"]) + "/cdata?name=" + elem["name"] + "&period=YEAR&periodOffset=0&src=" + src
-                                        self.tydom_client.add_poll_device_url(
-                                            url)
-                                        logger.debug(
-                                            "Add poll device : " + url)
-
+                                        poll_urls.append(url)
+
+        # Urls of the previous metadata are not polled anymore
+        self.tydom_client.poll_scheduler.clear()
+        for url in poll_urls:
+            self.tydom_client.add_poll_device_url(url)
+        self.registry.set_poll_urls(poll_urls)
+        self.registry.cmeta_fingerprint = fingerprint
+        self.registry.dirty = True
+        self.registry.save()
         logger.debug('Metadata configuration updated')
 
     async def parse_devices_data(self, parsed):
@@ -273,85 +243,114 @@ class MessageHandler:
             await self.parse_endpoint_data(parsed, parsed["id"])
         else:
             logger.error('Unknown data type')
-            logger.debug(parsed)
-
-    async def parse_endpoint_data(self, endpoint, device_id):
+            device_logger.dump('Unknown data (%s)', parsed)
+
+    # Publish the states of the snapshot, before the Tydom answers. They are
+    # flagged stale until replaced by the live data. Events (detections) and
+    # the alarm are not restored
+    async def restore_states(self):
+        if self.state_snapshot is None:
+            return
+        restored = 0
+        for unique_id, (device_id, endpoint_id, attributes) in \
+                self.state_snapshot.get_restorable():
+            device_kind = DeviceTypes.get_kind(self.get_type_from_id(unique_id))
+            if not device_kind.restorable:
+                continue
+            data = [{'name': name, 'validity': 'upToDate', 'value': value}
+                    for name, value in attributes.items()
+                    if name not in device_kind.event_keywords]
+            if len(data) == 0:
+                continue
+            self.state_snapshot.mark_stale(unique_id)
+            endpoint = {'id': endpoint_id, 'error': 0, 'data': data}
+            await self.parse_endpoint_data(endpoint, device_id, restored=True)
+            restored += 1
+        if restored:
+            logger.info('%d endpoint states restored from snapshot, stale '
+                        'until the Tydom confirms them', restored)
+
+    async def parse_endpoint_data(self, endpoint, device_id, restored=False):
         if endpoint["error"] == 0 and len(endpoint["data"]) > 0:
             try:
-                attr_alarm = {}                
+                attr_alarm = {}
+                attr_cover = {}
                 attr_sensor = {}
                 endpoint_attr = {}
                 endpoint_id = endpoint["id"]
                 unique_id = str(endpoint_id) + "_" + str(device_id)
                 name_of_id = self.get_name_from_id(unique_id)
                 type_of_id = self.get_type_from_id(unique_id)
+                device_kind = DeviceTypes.get_kind(type_of_id)
+                endpoint_last_seen.set(time.time(), unique_id, name_of_id)
 
-                logger.info(
+                device_logger.debug(
+                    unique_id,
                     'Device update (id=%s, endpoint=%s, name=%s, type=%s)',
                     device_id,
                     endpoint_id,
                     name_of_id,
                     type_of_id)
 
+                keywords = device_kind.keywords
                 for elem in endpoint["data"]:
-                    element_name = elem["name"]
-                    element_value = elem["value"]
-                    element_validity = elem["validity"]
+                    if elem["name"] in keywords and elem["validity"] == 'upToDate':
+                        endpoint_attr[elem["name"]] = elem["value"]
+
+                if len(endpoint_attr) > 0:
+                    if self.state_snapshot is not None and device_kind.restorable:
+                        if not restored:
+                            self.state_snapshot.record(
+                                unique_id, device_id, endpoint_id, endpoint_attr)
+                        endpoint_attr[STALE_ATTRIBUTE] = restored
                     print_id = name_of_id if len(
                         name_of_id) != 0 else device_id
+                    if device_kind.component == 'alarm_control_panel':
+                        attr = attr_alarm
+                    elif device_kind.component == 'cover':
+                        attr = attr_cover
+                    else:
+                        attr = attr_sensor
+                    attr['device_id'] = device_id
+                    attr['endpoint_id'] = endpoint_id
+                    attr['id'] = str(device_id) + '_' + str(endpoint_id)
+                    attr['name'] = print_id
+                    attr['device_type'] = device_kind.device_type
+                    attr['attributes'] = endpoint_attr
 
-                    match type_of_id:
-                        case 'door':
-                            if element_name in deviceDoorKeywords and element_validity == 'upToDate':
-                                attr_sensor['device_id'] = device_id
-                                attr_sensor['endpoint_id'] = endpoint_id
-                                attr_sensor['id'] = str(device_id) + '_' + str(endpoint_id)
-                                attr_sensor['door_name'] = print_id
-                                attr_sensor['name'] = print_id
-                                attr_sensor['device_type'] = 'door'
-                                attr_sensor['changed'] = element_name
-                                endpoint_attr[element_name] = element_value
-                                attr_sensor['attributes'] = endpoint_attr      
-                 
-                        case 'window':
-                            if element_name in deviceWindowKeywords and element_validity == 'upToDate':
-                                attr_sensor['device_id'] = device_id
-                                attr_sensor['endpoint_id'] = endpoint_id
-                                attr_sensor['id'] = str(device_id) + '_' + str(endpoint_id)
-                                attr_sensor['door_name'] = print_id
-                                attr_sensor['name'] = print_id
-                                attr_sensor['device_type'] = 'window'
-                                #attr_sensor['changed'] = element_name
-                                endpoint_attr[element_name] = element_value
-                                attr_sensor['attributes'] = endpoint_attr      
-                    
-                        case 'alarm':
-                            if element_name in deviceAlarmKeywords and element_validity == 'upToDate':
-                                attr_alarm['device_id'] = device_id
-                                attr_alarm['endpoint_id'] = endpoint_id
-                                attr_alarm['id'] = str(
-                                    device_id) + '_' + str(endpoint_id)
-                                attr_alarm['alarm_name'] = "Tyxal Alarm"
-                                attr_alarm['name'] = "Tyxal Alarm"
-                                attr_alarm['device_type'] = 'alarm_control_panel'
-                                endpoint_attr[element_name] = element_value
-                                attr_alarm['attributes'] = endpoint_attr            
-            
-                        
             except Exception as e:
                 logger.error('msg_data error in parsing !')
                 logger.error(e)
                 logger.exception(e)
 
+            registry = self.registry
+            device_unique_id = str(endpoint["id"]) + "_" + str(device_id)
             if 'device_type' in attr_sensor:
                 for elem in attr_sensor['attributes'].keys():
+                    if elem == STALE_ATTRIBUTE:
+                        continue
                     unique_id = attr_sensor['id'] + '_' + elem
-                    if unique_id in device_object:
-                        await device_object[unique_id].update(attr_sensor)
+                    sensor = registry.get_entity(unique_id)
+                    if sensor is not None:
+                        await sensor.update(attr_sensor)
                     else:
-                        device_object[unique_id] = Sensor(elem,tydom_attributes_payload=attr_sensor,mqtt=self.mqtt_client)
-                        await device_object[unique_id].setup()
-                        await device_object[unique_id].update(None)
+                        sensor = registry.add_entity(
+                            device_unique_id, unique_id,
+                            Sensor(elem, tydom_attributes_payload=attr_sensor, mqtt=self.mqtt_client))
+                        await sensor.setup()
+                        await sensor.update(None)
+            elif 'device_type' in attr_cover:
+                unique_id = attr_cover['id'] + '_cover'
+                cover = registry.get_entity(unique_id)
+                if cover is not None:
+                    await cover.update(attr_cover)
+                else:
+                    cover = registry.add_entity(
+                        device_unique_id, unique_id,
+                        Cover(tydom_attributes_payload=attr_cover,
+                              mqtt=self.mqtt_client))
+                    await cover.setup()
+                    await cover.update()
             # Get last known state (for alarm) # NEW METHOD
             elif 'device_type' in attr_alarm and attr_alarm['device_type'] == 'alarm_control_panel':
                 state = None
@@ -384,20 +383,23 @@ class MessageHandler:
                     # alarm shall be update Whatever its state because sensor
                     # can be updated without any state
                     unique_id = attr_alarm['id'] + '_alarm'
-                    if unique_id in device_object:
+                    alarm = registry.get_entity(unique_id)
+                    if alarm is not None:
                         if not (state is None):
-                          await device_object[unique_id].update(state, tydom_attributes_payload=attr_alarm)
-                          await device_object[unique_id].update_sensors()
+                          await alarm.update(state, tydom_attributes_payload=attr_alarm)
+                          await alarm.update_sensors()
                         else:
-                          await device_object[unique_id].update_sensors()
+                          await alarm.update_sensors()
                     else:
-                        device_object[unique_id] = Alarm(                           
-                            alarm_pin=self.tydom_client.alarm_pin,
-                            tydom_attributes_payload=attr_alarm,
-                            mqtt=self.mqtt_client)
-                        await device_object[unique_id].setup()
-                        await device_object[unique_id].update(state)
-                        await device_object[unique_id].update_sensors()
+                        alarm = registry.add_entity(
+                            device_unique_id, unique_id,
+                            Alarm(
+                                alarm_pin=self.tydom_client.alarm_pin,
+                                tydom_attributes_payload=attr_alarm,
+                                mqtt=self.mqtt_client))
+                        await alarm.setup()
+                        await alarm.update(state)
+                        await alarm.update_sensors()
                     
 
                 except Exception as e:
@@ -417,7 +419,8 @@ class MessageHandler:
                         unique_id = str(endpoint_id) + "_" + str(device_id)
                         name_of_id = self.get_name_from_id(unique_id)
                         type_of_id = self.get_type_from_id(unique_id)
-                        logger.info(
+                        device_logger.info(
+                            unique_id,
                             'Device configured (id=%s, endpoint=%s, name=%s, type=%s)',
                             device_id,
                             endpoint_id,
@@ -427,70 +430,19 @@ class MessageHandler:
                     except Exception as e:
                         logger.error('Error when parsing msg_cdata (%s)', e)
 
-    # PUT response DIRTY parsing
-    def parse_put_response(self, bytes_str, start=6):
-        # TODO : Find a cooler way to parse nicely the PUT HTTP response
-        resp = bytes_str[len(self.cmd_prefix):].decode("utf-8")
-        fields = resp.split("\r\n")
-        fields = fields[start:]  # ignore the PUT / HTTP/1.1
-        end_parsing = False
-        i = 0
-        output = str()
-        while not end_parsing:
-            field = fields[i]
-            if len(field) == 0 or field == '0':
-                end_parsing = True
-            else:
-                output += field
-                i = i + 2
-        parsed = json.loads(output)
-        return json.dumps(parsed)
-
     # FUNCTIONS
 
-    @staticmethod
-    def response_from_bytes(data):
-        sock = BytesIOSocket(data)
-        response = HTTPResponse(sock)
-        response.begin()
-        return response.read()
-
-    @staticmethod
-    def put_response_from_bytes(data):
-        request = HTTPRequest(data)
-        return request
-
     def get_type_from_id(self, id):
-        device_type_detected = ""
-        if id in device_type.keys():
-            device_type_detected = device_type[id]
-        else:
-            logger.warning('Unknown device type (%s)', id)
+        device_type_detected = self.registry.get_type(id)
+        if device_type_detected is None:
+            device_logger.log(logging.WARNING, id, 'Unknown device type (%s)', id)
+            return ""
         return device_type_detected
 
     # Get pretty name for a device id
     def get_name_from_id(self, id):
-        name = ""
-        if id in device_name.keys():
-            name = device_name[id]
-        else:
-            logger.warning('Unknown device name (%s)', id)
+        name = self.registry.get_name(id)
+        if name is None:
+            device_logger.log(logging.WARNING, id, 'Unknown device name (%s)', id)
+            return ""
         return name
-
-
-class BytesIOSocket:
-    def __init__(self, content):
-        self.handle = BytesIO(content)
-
-    def makefile(self, mode):
-        return self.handle
-
-class HTTPRequest(BaseHTTPRequestHandler):
-    def __init__(self, request_text):
-        self.raw_requestline = request_text
-        self.error_code = self.error_message = None
-        self.parse_request()
-
-    def send_error(self, code, message):
-        self.error_code = code
-        self.error_message = message
@@ -0,0 +1,24 @@
+"""Grouping of the device orders given at once (put_devices_data_batch).
+
+The Tydom takes one PUT per endpoint, with any number of name/value
+entries in its body: orders known together (scenes, group actions sent on
+the MQTT orders topic) are grouped per endpoint. Orders received one by one from MQTT go through the
+CommandCoalescer instead, which only keeps the latest one per endpoint.
+"""
+
+
+def group_orders(orders):
+    """Group (device_id, endpoint_id, name, value) orders per endpoint.
+
+    Endpoints keep the order of their first order, and the latest value
+    wins when a name is given several times for the same endpoint.
+    """
+    groups = {}
+    for device_id, endpoint_id, name, value in orders:
+        key = (str(device_id), str(endpoint_id))
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {}
+        group.pop(name, None)
+        group[name] = value
+    return groups
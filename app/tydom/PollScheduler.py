@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import random
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from .CommandScheduler import LANE_POLL
+
+logger = logging.getLogger(__name__)
+
+# Poll interval (seconds) per cdata name of the devices which need
+# polling (like Tywatt)
+poll_intervals = {
+    'energyInstant': 10,
+    'energyIndex': 300,
+    'energyDistrib': 3600,
+}
+DEFAULT_POLL_INTERVAL = 60
+
+
+class PollScheduler:
+    """Poll device urls, each one at its own interval (with jitter).
+
+    Urls are de-duplicated and at most max_in_flight polls wait for their
+    response at the same time, so the Tydom box never gets a burst.
+    """
+
+    def __init__(self, tydom_client, max_in_flight=2, jitter=0.1,
+                 intervals=None):
+        self.tydom_client = tydom_client
+        self.jitter = jitter
+        self.intervals = intervals if intervals is not None else poll_intervals
+        self.max_in_flight = max_in_flight
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        # url -> next poll time (monotonic)
+        self.next_polls = {}
+        # url -> task of the poll waiting for its response
+        self.in_flight = {}
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.polls = 0
+        self.failures = 0
+
+    @property
+    def urls(self):
+        return list(self.next_polls)
+
+    def get_interval(self, url):
+        names = parse_qs(urlsplit(url).query).get('name')
+        if names:
+            return self.intervals.get(names[0], DEFAULT_POLL_INTERVAL)
+        return DEFAULT_POLL_INTERVAL
+
+    def add(self, url):
+        if url in self.next_polls:
+            return False
+        # Spread the first polls of newly discovered urls
+        self.next_polls[url] = time.monotonic() + random.uniform(0, 1)
+        self.wakeup.set()
+        return True
+
+    # Forget every url (replaced by a new devices metadata)
+    def clear(self):
+        self.next_polls.clear()
+
+    # Stop polling the urls of an endpoint removed from the configuration
+    def remove_endpoint(self, device_id, endpoint_id):
+        prefix = '/devices/{}/endpoints/{}/'.format(device_id, endpoint_id)
+        for url in [url for url in self.next_polls if url.startswith(prefix)]:
+            del self.next_polls[url]
+
+    # Poll every url as soon as possible
+    def poll_all(self):
+        now = time.monotonic()
+        for url in self.next_polls:
+            self.next_polls[url] = now
+        self.wakeup.set()
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        tasks = list(self.in_flight.values())
+        if self.task is not None:
+            tasks.append(self.task)
+            self.task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            now = time.monotonic()
+            next_poll = None
+            for url, poll_time in self.next_polls.items():
+                if url in self.in_flight:
+                    continue
+                if poll_time <= now:
+                    self.in_flight[url] = asyncio.create_task(self.poll(url))
+                elif next_poll is None or poll_time < next_poll:
+                    next_poll = poll_time
+            # Woken up by a timer rather than wait_for, which can swallow
+            # the cancellation of stop() when the event is set meanwhile
+            timer = None
+            if next_poll is not None:
+                timer = asyncio.get_running_loop().call_later(
+                    next_poll - now, self.wakeup.set)
+            try:
+                await self.wakeup.wait()
+            finally:
+                if timer is not None:
+                    timer.cancel()
+
+    async def poll(self, url):
+        try:
+            async with self.semaphore:
+                self.polls += 1
+                await self.tydom_client.request('GET', url, lane=LANE_POLL)
+        except Exception as e:
+            self.failures += 1
+            logger.debug('Poll of %s failed (%s)', url, e)
+        finally:
+            self.in_flight.pop(url, None)
+            if url in self.next_polls:
+                interval = self.get_interval(url)
+                self.next_polls[url] = time.monotonic() + interval * (
+                    1 + random.uniform(-self.jitter, self.jitter))
+            self.wakeup.set()
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+import random
+import time
+
+from metrics.Metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+reconnects_total = metrics.counter(
+    'tydom2mqtt_tydom_reconnects_total', 'Reconnections to the Tydom')
+connection_failures = metrics.gauge(
+    'tydom2mqtt_tydom_connection_failures',
+    'Consecutive failed connections to the Tydom')
+
+
+class ReconnectSupervisor:
+    """Delay between two connection attempts to the Tydom.
+
+    The delay grows exponentially (with jitter) with the number of
+    consecutive failures. After failure_threshold failures the circuit
+    opens: attempts are only made every open_delay seconds until one
+    succeeds. A connection lost before stable_time seconds counts as a
+    failure, so that a flapping gateway is not hammered.
+    """
+
+    def __init__(self, base_delay=1, max_delay=60, failure_threshold=10,
+                 open_delay=300, stable_time=60):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.open_delay = open_delay
+        self.stable_time = stable_time
+        self.failures = 0
+        self.reconnects = 0
+        self.connected_at = None
+        metrics.add_collector(self.collect_metrics)
+
+    def collect_metrics(self):
+        reconnects_total.set_total(self.reconnects)
+        connection_failures.set(self.failures)
+
+    @property
+    def circuit_open(self):
+        return self.failures >= self.failure_threshold
+
+    def connected(self):
+        self.connected_at = time.monotonic()
+
+    def disconnected(self):
+        if self.connected_at is not None and \
+                time.monotonic() - self.connected_at >= self.stable_time:
+            self.failures = 0
+        self.failures += 1
+        self.connected_at = None
+
+    def next_delay(self):
+        if self.circuit_open:
+            return self.open_delay
+        delay = min(self.max_delay, self.base_delay * 2 ** (self.failures - 1))
+        return random.uniform(delay / 2, delay)
+
+    async def wait(self):
+        delay = self.next_delay()
+        if self.circuit_open:
+            logger.error(
+                'Tydom unreachable after %d attempts, next attempt in %ds',
+                self.failures, delay)
+        else:
+            logger.info('Reconnecting to tydom in %.1fs (attempt %d)',
+                        delay, self.failures)
+        await asyncio.sleep(delay)
+        self.reconnects += 1
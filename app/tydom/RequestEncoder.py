@@ -0,0 +1,97 @@
+import json
+from json.encoder import encode_basestring
+
+# Constant parts of the requests sent to the Tydom
+HTTP_VERSION = ' HTTP/1.1\r\nContent-Length: '
+HEADERS = '\r\nContent-Type: application/json; charset=UTF-8\r\nTransac-Id: '
+HEADERS_END = '\r\n\r\n'
+# The Tydom apps end bodies with an empty line, outside Content-Length
+BODY_END = '\r\n\r\n'
+
+# Encoder reused across requests (json.dumps with options builds one per call)
+encode_json = json.JSONEncoder(
+    ensure_ascii=False, separators=(',', ':')).encode
+
+
+class RequestEncoder:
+    """Builds the bytes of the HTTP requests sent over the websocket.
+
+    A request is formatted in one string and encoded once. Bodies are JSON
+    encoded (strings and bytes are sent as is) and Content-Length is their
+    size in bytes.
+
+    Orders are the hot path: the url and the request line of each endpoint
+    and the name part of each entry are built once and cached, only the
+    values are encoded per order.
+    """
+
+    def __init__(self, cmd_prefix='', max_cached_urls=512, max_cached_names=256):
+        self.cmd_prefix = cmd_prefix
+        self.max_cached_urls = max_cached_urls
+        self.max_cached_names = max_cached_names
+        self.endpoint_data_urls = {}
+        self.put_request_lines = {}
+        self.name_parts = {}
+
+    # Url of the data of an endpoint, the request line of the orders sent
+    # to it is cached along
+    def get_endpoint_data_url(self, device_id, endpoint_id):
+        key = (device_id, endpoint_id)
+        url = self.endpoint_data_urls.get(key)
+        if url is None:
+            if len(self.endpoint_data_urls) >= self.max_cached_urls:
+                self.endpoint_data_urls.clear()
+                self.put_request_lines.clear()
+            url = self.endpoint_data_urls[key] = (
+                f"/devices/{device_id}/endpoints/{endpoint_id}/data")
+            self.put_request_lines[url] = f'{self.cmd_prefix}PUT {url}{HTTP_VERSION}'
+        return url
+
+    def get_name_part(self, name):
+        if len(self.name_parts) >= self.max_cached_names:
+            self.name_parts.clear()
+        name_part = self.name_parts[name] = (
+            '{"name":' + encode_json(name) + ',"value":')
+        return name_part
+
+    @staticmethod
+    def encode_value(value):
+        if type(value) is str:
+            return encode_basestring(value)
+        if type(value) is int:
+            return str(value)
+        return encode_json(value)
+
+    # Body of a single order: [{"name": ..., "value": ...}]
+    def encode_entry(self, name, value):
+        name_part = self.name_parts.get(name)
+        if name_part is None:
+            name_part = self.get_name_part(name)
+        return f'[{name_part}{self.encode_value(value)}}}]'
+
+    # Body of device / area orders: [{"name": ..., "value": ...}, ...]
+    def encode_entries(self, entries):
+        name_parts = self.name_parts
+        encode_value = self.encode_value
+        body = []
+        for name, value in entries.items():
+            name_part = name_parts.get(name)
+            if name_part is None:
+                name_part = self.get_name_part(name)
+            body.append(f'{name_part}{encode_value(value)}}}')
+        return '[' + ','.join(body) + ']'
+
+    def encode(self, method, url, transac_id, body=None):
+        request_line = (
+            self.put_request_lines.get(url) if method == 'PUT' else None)
+        if request_line is None:
+            request_line = f'{self.cmd_prefix}{method} {url}{HTTP_VERSION}'
+        if body is None:
+            return f'{request_line}0{HEADERS}{transac_id}{HEADERS_END}'.encode('utf-8')
+        if type(body) is not str:
+            body = (body.decode('utf-8') if isinstance(body, bytes)
+                    else encode_json(body))
+        # Content-Length counts bytes, the bodies are mostly ASCII
+        length = len(body) if body.isascii() else len(body.encode('utf-8'))
+        return (f'{request_line}{length}{HEADERS}{transac_id}{HEADERS_END}'
+                f'{body}{BODY_END}').encode('utf-8')
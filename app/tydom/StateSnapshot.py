@@ -0,0 +1,106 @@
+import asyncio
+import json
+import logging
+import os
+
+from metrics.Metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+stale_endpoints = metrics.gauge(
+    'tydom2mqtt_stale_endpoints',
+    'Endpoints whose state was restored from the snapshot and not yet '
+    'confirmed by the Tydom')
+
+# Attribute of the published states, true while the values come from the
+# snapshot
+STALE_ATTRIBUTE = 'stale'
+
+
+class StateSnapshot:
+    """Last known attributes of every endpoint, saved to a JSON file.
+
+    On boot the states are restored (and published) before the Tydom
+    answers; restored endpoints are stale (published with stale: true)
+    until live data is received for them, the StateCache then only lets the
+    differences through.
+    """
+
+    def __init__(self, file_path=None):
+        self.file_path = file_path
+        # unique id ('<endpoint id>_<device id>') -> [device id, endpoint id,
+        # {attribute: value}]
+        self.states = {}
+        # Restored endpoints not confirmed by live data yet
+        self.stale = set()
+        # Endpoints which received live data
+        self.live = set()
+        self.dirty = False
+        metrics.add_collector(self.collect_metrics)
+        self.load()
+
+    def collect_metrics(self):
+        stale_endpoints.set(len(self.stale))
+
+    def record(self, unique_id, device_id, endpoint_id, attributes):
+        self.live.add(unique_id)
+        self.stale.discard(unique_id)
+        state = self.states.get(unique_id)
+        if state is None:
+            self.states[unique_id] = [device_id, endpoint_id, dict(attributes)]
+            self.dirty = True
+            return
+        stored = state[2]
+        for name, value in attributes.items():
+            if name not in stored or stored[name] != value:
+                stored.update(attributes)
+                self.dirty = True
+                return
+
+    def forget(self, unique_id):
+        if self.states.pop(unique_id, None) is not None:
+            self.dirty = True
+        self.stale.discard(unique_id)
+
+    # States to restore: the endpoints without live data yet
+    def get_restorable(self):
+        return [(unique_id, state) for unique_id, state in self.states.items()
+                if unique_id not in self.live]
+
+    # Restored endpoint, stale until live data is recorded for it
+    def mark_stale(self, unique_id):
+        if unique_id not in self.live:
+            self.stale.add(unique_id)
+
+    def load(self):
+        if self.file_path is None:
+            return
+        try:
+            with open(self.file_path) as f:
+                self.states = json.load(f)
+            logger.info('%d endpoint states loaded from %s',
+                        len(self.states), self.file_path)
+        except FileNotFoundError:
+            logger.debug('No state snapshot file (%s)', self.file_path)
+        except Exception as e:
+            logger.warning(
+                'Unable to load state snapshot file %s (%s)', self.file_path, e)
+
+    def save(self):
+        if self.file_path is None or not self.dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+            tmp_file_path = self.file_path + '.tmp'
+            with open(tmp_file_path, 'w') as f:
+                json.dump(self.states, f, separators=(',', ':'))
+            os.replace(tmp_file_path, self.file_path)
+            self.dirty = False
+        except OSError as e:
+            logger.warning(
+                'Unable to save state snapshot file %s (%s)', self.file_path, e)
+
+    async def save_periodically(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            self.save()
@@ -0,0 +1,67 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TriggerCoalescer:
+    """Run an action on demand (full update, refresh...) without flooding
+    the Tydom.
+
+    At most one run is in flight and two runs start at least min_interval
+    seconds apart. Triggers received meanwhile are merged into a single
+    pending run; trigger() waits for the run which covers the trigger,
+    trigger_nowait() does not.
+    """
+
+    def __init__(self, name, action, min_interval=10):
+        self.name = name
+        # Coroutine function without argument
+        self.action = action
+        self.min_interval = min_interval
+        self.pending = None
+        self.task = None
+        self.last_run = None
+        self.requested = 0
+        self.absorbed = 0
+        self.runs = 0
+
+    async def trigger(self):
+        pending = self.trigger_nowait()
+        # A cancelled caller does not cancel the run shared with others
+        return await asyncio.shield(pending)
+
+    # Request a run without waiting for it (periodic timers...), return the
+    # future of the run
+    def trigger_nowait(self):
+        self.requested += 1
+        if self.pending is not None:
+            self.absorbed += 1
+            logger.debug('%s already pending, trigger merged', self.name)
+        else:
+            self.pending = asyncio.get_running_loop().create_future()
+            if self.task is None or self.task.done():
+                self.task = asyncio.create_task(self.run())
+        return self.pending
+
+    async def run(self):
+        while self.pending is not None:
+            if self.last_run is not None:
+                delay = self.last_run + self.min_interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            future, self.pending = self.pending, None
+            self.last_run = time.monotonic()
+            self.runs += 1
+            try:
+                result = await self.action()
+            except Exception as e:
+                logger.warning('%s failed (%s)', self.name, e)
+                if not future.done():
+                    future.set_exception(e)
+                # Retrieved here when every caller was cancelled
+                future.exception()
+                continue
+            if not future.done():
+                future.set_result(result)
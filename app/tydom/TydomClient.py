@@ -1,19 +1,56 @@
+import asyncio
 import base64
-import http.client
 import json
 import logging
 import os
+import re
+import socket
 import ssl
-import sys
+import time
 
-import websockets
-import requests
 from requests.auth import HTTPDigestAuth
-from urllib3 import encode_multipart_formdata
+from metrics.Metrics import metrics
+from .OrderGrouping import group_orders
+from .CommandCoalescer import CommandCoalescer
+from .CommandScheduler import (
+    LANE_ALARM, LANE_POLL, LANE_USER, CommandScheduler)
+from .CredentialStore import CredentialError, CredentialStore
+from .DeviceRegistry import DeviceRegistry
+from .PollScheduler import PollScheduler
+from .RequestEncoder import RequestEncoder
+from .TriggerCoalescer import TriggerCoalescer
 from .const import *
 
+try:
+    # websockets >= 13
+    from websockets.asyncio.client import connect as websocket_connect
+    WEBSOCKET_HEADERS_ARGUMENT = 'additional_headers'
+except ImportError:
+    from websockets import connect as websocket_connect
+    WEBSOCKET_HEADERS_ARGUMENT = 'extra_headers'
+
 logger = logging.getLogger(__name__)
 
+request_seconds = metrics.gauge(
+    'tydom2mqtt_tydom_request_seconds',
+    'Last response time of the Tydom, by request type', ['request'])
+pending_requests = metrics.gauge(
+    'tydom2mqtt_tydom_pending_requests', 'Requests waiting for a response')
+ping_seconds = metrics.gauge(
+    'tydom2mqtt_tydom_ping_seconds', 'Last ping round trip time')
+connect_seconds = metrics.gauge(
+    'tydom2mqtt_tydom_connect_seconds',
+    'Duration of each phase of the last connection', ['phase'])
+commands_total = metrics.counter(
+    'tydom2mqtt_tydom_coalesced_commands_total',
+    'Device commands submitted or sent after coalescing', ['result'])
+triggers_total = metrics.counter(
+    'tydom2mqtt_tydom_triggers_total',
+    'Update / refresh triggers requested, absorbed into a pending one, '
+    'or run', ['trigger', 'result'])
+polls_total = metrics.counter(
+    'tydom2mqtt_tydom_polls_total', 'Device polls, by result', ['result'])
+
 
 class TydomClient:
     def __init__(
@@ -22,25 +59,63 @@ class TydomClient:
             password,
             alarm_pin=None,
             host=MEDIATION_URL,
-            thermostat_custom_presets=None):
+            thermostat_custom_presets=None,
+            refresh_interval=42,
+            ping_interval=10,
+            port=443,
+            request_rate=10,
+            trigger_interval=10,
+            registry=None):
         logger.debug("Initializing TydomClient Class")
 
         self.password = password
         self.mac = mac
         self.host = host
+        self.port = port
         self.alarm_pin = alarm_pin
         self.connection = None
+        # Device registry shared with the MessageHandler
+        self.registry = registry
         self.remote_mode = True
         self.ssl_context = None
         self.cmd_prefix = "\x02"
         self.reply_timeout = 4
-        self.ping_timeout = None
-        self.refresh_timeout = 42
+        self.connect_timeout = 10
+        # Duration (seconds) of each phase of the last connection
+        self.connect_metrics = {}
+        # Seconds between two pings / two refreshes (0 to disable)
+        self.ping_interval = ping_interval
+        self.refresh_interval = refresh_interval
         self.sleep_time = 2
+        # Connection is considered dead after this number of unanswered pings
+        self.max_missed_pongs = 2
+        self.missed_pongs = 0
+        self.ping_latency = None
+        self.keep_alive_task = None
+        # setup() completed once in this process, later connections resync
+        self.setup_done = False
+        metrics.add_collector(self.collect_metrics)
         self.incoming = None
         # Some devices (like Tywatt) need polling
-        self.poll_device_urls = []
-        self.current_poll_index = 0
+        self.poll_scheduler = PollScheduler(self)
+        # Only the latest order per endpoint is sent (cover sliders...)
+        self.command_coalescer = CommandCoalescer()
+        # Every request goes through the priority lanes of the scheduler
+        self.command_scheduler = CommandScheduler(
+            self.send_bytes, rate=request_rate)
+        # Full updates and refreshes asked by MQTT (and the periodic
+        # refresh) are merged, at most one per trigger_interval seconds
+        self.triggers = [
+            TriggerCoalescer('update', self.get_data, trigger_interval),
+            TriggerCoalescer('devices data', self.get_devices_data, trigger_interval),
+            TriggerCoalescer('refresh', self.post_refresh, trigger_interval),
+        ]
+        self.update_trigger, self.devices_data_trigger, self.refresh_trigger = self.triggers
+        # Requests waiting for their response, by Transac-Id
+        self.transac_id = 0
+        self.pending_requests = {}
+        # Last response time (seconds) per request type
+        self.request_latency = {}
 
         if thermostat_custom_presets is None:
             self.thermostat_custom_presets = None
@@ -55,7 +130,6 @@ class TydomClient:
             self.remote_mode = True
             self.ssl_context = ssl._create_unverified_context()
             self.cmd_prefix = "\x02"
-            self.ping_timeout = 40
 
         else:
             logger.info("Configure local mode (%s)", self.host)
@@ -63,106 +137,96 @@ class TydomClient:
             self.ssl_context = ssl._create_unverified_context()
             self.ssl_context.options |= 0x4
             self.cmd_prefix = ""
-            self.ping_timeout = None
+
+        self.request_encoder = RequestEncoder(self.cmd_prefix)
+
+    def collect_metrics(self):
+        for request_type, latency in self.request_latency.items():
+            request_seconds.set(latency, request_type)
+        pending_requests.set(len(self.pending_requests))
+        if self.ping_latency is not None:
+            ping_seconds.set(self.ping_latency)
+        for phase, duration in self.connect_metrics.items():
+            connect_seconds.set(duration, phase)
+        commands_total.set_total(self.command_coalescer.submitted, 'submitted')
+        commands_total.set_total(self.command_coalescer.sent, 'sent')
+        for trigger in self.triggers:
+            triggers_total.set_total(trigger.requested, trigger.name, 'requested')
+            triggers_total.set_total(trigger.absorbed, trigger.name, 'absorbed')
+            triggers_total.set_total(trigger.runs, trigger.name, 'run')
+        polls_total.set_total(self.poll_scheduler.polls, 'sent')
+        polls_total.set_total(self.poll_scheduler.failures, 'failed')
 
     @staticmethod
-    def getTydomCredentials(login: str, password: str, macaddress: str):
-        """get tydom credentials from Delta Dore"""
+    def getTydomCredentials(credential_store: CredentialStore):
+        """get tydom credentials from Delta Dore (cached by the store)"""
         try:
-            response = requests.get(DELTADORE_AUTH_URL)
-
-            json_response = response.json()
-            response.close()
-            signin_url = json_response["token_endpoint"]
-
-            body, ct_header = encode_multipart_formdata(
-                {
-                    "username": f"{login}",
-                    "password": f"{password}",
-                    "grant_type": DELTADORE_AUTH_GRANT_TYPE,
-                    "client_id": DELTADORE_AUTH_CLIENTID,
-                    "scope": DELTADORE_AUTH_SCOPE,
-                }
-            )
-
-            response = requests.post(
-                url=signin_url,
-                headers={"Content-Type": ct_header},
-                data=body,
-            )
-
-            json_response = response.json()
-            response.close()
-            access_token = json_response["access_token"]
-
-            response = requests.get(
-                DELTADORE_API_SITES + macaddress,
-                headers={
-                    "Authorization": f"Bearer {access_token}"})
-
-            json_response = response.json()
-            response.close()
-
-            password = None
-            if (
-                "sites" in json_response
-                and len(json_response["sites"]) > 0
-                and "gateway" in json_response["sites"][0]
-            ):
-                password = json_response["sites"][0]["gateway"]["password"]
-            logger.debug("Your Tydom password : %s",
-                         json_response["sites"][0]["gateway"]["password"])
-            return password
-
-        except Exception as exception:
+            return credential_store.get_password()
+        except CredentialError as e:
+            logger.error(
+                'Unable to retrieve Tydom password from Delta Dore (%s)', e)
             return None
 
     async def connect(self):
         logger.info('Connecting to tydom')
+        phase_durations = {}
+        loop = asyncio.get_running_loop()
         http_headers = {
             "Connection": "Upgrade",
             "Upgrade": "websocket",
-            "Host": self.host + ":443",
+            "Host": "{}:{}".format(self.host, self.port),
             "Accept": "*/*",
-            "Sec-WebSocket-Key": self.generate_random_key(),
+            "Sec-WebSocket-Key": self.generate_random_key().decode("ascii"),
             "Sec-WebSocket-Version": "13",
         }
-        conn = http.client.HTTPSConnection(
-            self.host, 443, context=self.ssl_context)
 
-        # Get first handshake
-        conn.request(
-            "GET",
-            "/mediation/client?mac={}&appli=1".format(self.mac),
-            None,
-            http_headers,
-        )
-        res = conn.getresponse()
-        conn.close()
+        # Resolve host
+        start = time.monotonic()
+        addr_infos = await loop.getaddrinfo(
+            self.host, self.port, type=socket.SOCK_STREAM)
+        phase_durations['dns'] = time.monotonic() - start
+
+        # Open TLS connection
+        start = time.monotonic()
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                addr_infos[0][4][0], self.port, ssl=self.ssl_context,
+                server_hostname=self.host),
+            self.connect_timeout)
+        phase_durations['tls'] = time.monotonic() - start
 
-        logger.debug("Response headers")
-        logger.debug(res.headers)
+        # Get first handshake
+        start = time.monotonic()
+        try:
+            request = "GET /mediation/client?mac={}&appli=1 HTTP/1.1\r\n".format(self.mac)
+            for name, value in http_headers.items():
+                request += "{}: {}\r\n".format(name, value)
+            writer.write((request + "\r\n").encode("ascii"))
+            await writer.drain()
+            status, headers = await asyncio.wait_for(
+                self.read_http_headers(reader), self.connect_timeout)
+        finally:
+            writer.close()
+        phase_durations['nonce'] = time.monotonic() - start
 
         logger.debug("Response code")
-        logger.debug(res.getcode())
+        logger.debug(status)
 
-        # Read response
-        logger.debug("response")
-        logger.debug(res.read())
-        res.read()
+        logger.debug("Response headers")
+        logger.debug(headers)
 
         # Get authentication
+        start = time.monotonic()
         websocket_headers = {}
-        try:
-            # Local installations are unauthenticated but we don't *know* that for certain
-            # so we'll EAFP, try to use the header and fallback if we're
-            # unable.
-            nonce = res.headers["WWW-Authenticate"].split(",", 3)
+        # Local installations are unauthenticated but we don't *know* that for certain
+        # so we'll try to use the header and fallback if we're unable.
+        www_authenticate = headers.get("www-authenticate")
+        if www_authenticate is not None:
+            nonce = www_authenticate.split(",", 3)
             # Build websocket headers
             websocket_headers = {
                 "Authorization": self.build_digest_headers(nonce)}
-        except AttributeError:
-            pass
+        phase_durations['digest'] = time.monotonic() - start
 
         logger.debug("Upgrading http connection to websocket....")
 
@@ -180,25 +244,108 @@ class TydomClient:
             websockets.client.connect returns a WebSocketClientProtocol, which is used to send and receive messages
         """
         try:
-            self.connection = await websockets.connect(
-                f"wss://{self.host}:443/mediation/client?mac={self.mac}&appli=1",
-                extra_headers=websocket_headers,
+            start = time.monotonic()
+            self.connection = await websocket_connect(
+                f"wss://{self.host}:{self.port}/mediation/client?mac={self.mac}&appli=1",
                 ssl=websocket_ssl_context,
                 ping_timeout=None,
+                **{WEBSOCKET_HEADERS_ARGUMENT: websocket_headers},
             )
-            logger.info('Connected to tydom')
+            phase_durations['upgrade'] = time.monotonic() - start
+            self.connect_metrics = phase_durations
+            logger.info(
+                'Connected to tydom (dns=%.3fs, tls=%.3fs, nonce=%.3fs, digest=%.3fs, upgrade=%.3fs)',
+                phase_durations['dns'], phase_durations['tls'],
+                phase_durations['nonce'], phase_durations['digest'],
+                phase_durations['upgrade'])
+            self.start_keep_alive()
             return self.connection
         except Exception as e:
             logger.error(
                 "Exception when trying to connect with websocket (%s)", e)
-            sys.exit(1)
+            raise
+
+    # Read the status and headers (lower case names) of an HTTP response
+    @staticmethod
+    async def read_http_headers(reader):
+        head = await reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        status = int(lines[0].split(" ", 2)[1])
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        return status, headers
 
     async def disconnect(self):
+        await self.stop_keep_alive()
+        self.command_scheduler.clear(ConnectionError('Connection closed'))
+        self.cancel_pending_requests()
         if self.connection is not None:
             logger.info('Disconnecting')
             await self.connection.close()
+            self.connection = None
             logger.info('Disconnected')
 
+    def start_keep_alive(self):
+        if self.keep_alive_task is None or self.keep_alive_task.done():
+            self.missed_pongs = 0
+            self.keep_alive_task = asyncio.create_task(self.keep_alive())
+
+    async def stop_keep_alive(self):
+        if self.keep_alive_task is not None and \
+                self.keep_alive_task is not asyncio.current_task():
+            self.keep_alive_task.cancel()
+            await asyncio.gather(self.keep_alive_task, return_exceptions=True)
+        self.keep_alive_task = None
+
+    # Ping and refresh the Tydom periodically while connected
+    async def keep_alive(self):
+        now = time.monotonic()
+        next_ping = now + self.ping_interval if self.ping_interval else None
+        next_refresh = now + self.refresh_interval if self.refresh_interval else None
+        deadlines = [d for d in (next_ping, next_refresh) if d is not None]
+        while deadlines:
+            await asyncio.sleep(max(0, min(deadlines) - time.monotonic()))
+            now = time.monotonic()
+            if next_ping is not None and now >= next_ping:
+                if not await self.check_alive():
+                    return
+                next_ping = time.monotonic() + self.ping_interval
+            if next_refresh is not None and now >= next_refresh:
+                # Not awaited: a delayed refresh must not delay the pings
+                self.refresh_trigger.trigger_nowait()
+                next_refresh = time.monotonic() + self.refresh_interval
+            deadlines = [d for d in (next_ping, next_refresh) if d is not None]
+
+    # Send a ping and wait for the pong, closing the connection when the
+    # Tydom stopped answering so that the reconnection starts right away
+    async def check_alive(self):
+        start = time.monotonic()
+        try:
+            await self.request('GET', '/ping')
+            self.ping_latency = time.monotonic() - start
+            self.missed_pongs = 0
+            logger.debug('Pong received in %.3fs', self.ping_latency)
+        except asyncio.TimeoutError:
+            self.missed_pongs += 1
+            logger.warning('No pong received from tydom (%d/%d)',
+                           self.missed_pongs, self.max_missed_pongs)
+        except Exception as e:
+            self.missed_pongs += 1
+            logger.warning('Unable to ping tydom (%s)', e)
+
+        if self.missed_pongs >= self.max_missed_pongs and self.connection is not None:
+            logger.error('Tydom connection is dead, closing it')
+            transport = getattr(self.connection, 'transport', None)
+            if transport is not None:
+                transport.abort()
+            else:
+                asyncio.create_task(self.connection.close())
+            return False
+        return True
+
     # Generate 16 bytes random key for Sec-WebSocket-Keyand convert it to
     # base64
     @staticmethod
@@ -217,8 +364,8 @@ class TydomClient:
         digest_auth._thread_local.nonce_count = 1
         return digest_auth.build_digest_header(
             "GET",
-            "https://{host}:443/mediation/client?mac={mac}&appli=1".format(
-                host=self.host, mac=self.mac
+            "https://{host}:{port}/mediation/client?mac={mac}&appli=1".format(
+                host=self.host, port=self.port, mac=self.mac
             ),
         )
 
@@ -226,64 +373,126 @@ class TydomClient:
         pass
 
     def add_poll_device_url(self, url):
-        self.poll_device_urls.append(url)
+        if self.poll_scheduler.add(url):
+            logger.debug("Add poll device : %s", url)
+
+    def next_transac_id(self):
+        self.transac_id += 1
+        return str(self.transac_id)
+
+    # Request type used for latency measures: the uri without ids and query
+    @staticmethod
+    def get_request_type(method, url):
+        return method + " " + re.sub(r"/\d+", "/{id}", url.split("?", 1)[0])
+
+    # Send a request and wait for its response (matched on Transac-Id)
+    async def request(self, method, url, body=None, timeout=None, lane=LANE_USER):
+        if self.connection is None:
+            raise ConnectionError('No connection has been established yet')
+        transac_id = self.next_transac_id()
+        future = asyncio.get_running_loop().create_future()
+        self.pending_requests[transac_id] = (
+            future, self.get_request_type(method, url), time.monotonic())
+        try:
+            await self.send_message(
+                method, url, body=body, transac_id=transac_id, lane=lane)
+            # Response time is measured from the actual send
+            if transac_id in self.pending_requests:
+                self.pending_requests[transac_id] = (
+                    future, self.get_request_type(method, url), time.monotonic())
+            return await asyncio.wait_for(
+                future, timeout if timeout is not None else self.reply_timeout)
+        finally:
+            self.pending_requests.pop(transac_id, None)
+
+    # Complete the pending request answered by a frame, if any
+    def resolve_request(self, frame):
+        transac_id = frame.transac_id
+        if transac_id is None or not frame.is_response:
+            return False
+        pending = self.pending_requests.pop(transac_id, None)
+        if pending is None:
+            return False
+        future, request_type, sent_at = pending
+        self.request_latency[request_type] = time.monotonic() - sent_at
+        if not future.done():
+            future.set_result(frame)
+        return True
+
+    def cancel_pending_requests(self):
+        for future, request_type, sent_at in self.pending_requests.values():
+            if not future.done():
+                future.set_exception(ConnectionError('Connection closed'))
+        self.pending_requests.clear()
 
     # Send Generic  message
-    async def send_message(self, method, msg):
-        str = (
-            self.cmd_prefix +
-            method +
-            " " +
-            msg +
-            " HTTP/1.1\r\nContent-Length: 0\r\nContent-Type: application/json; charset=UTF-8\r\nTransac-Id: 0\r\n\r\n")
-        a_bytes = bytes(str, "ascii")
+    async def send_message(self, method, msg, body=None, transac_id=None, lane=LANE_USER):
+        if transac_id is None:
+            transac_id = self.next_transac_id()
+        a_bytes = self.request_encoder.encode(method, msg, transac_id, body)
         logger.debug(
             "Sending message to tydom (%s %s)",
             method,
             msg if "pwd" not in msg else "***")
 
         if self.connection is not None:
-            await self.connection.send(a_bytes)
+            await self.command_scheduler.submit(a_bytes, lane)
         else:
             logger.warning(
                 'Cannot send message to Tydom because no connection has been established yet')
 
+    async def send_bytes(self, data):
+        if self.connection is None:
+            raise ConnectionError('Connection closed')
+        await self.connection.send(data)
+
     # Give order (name + value) to endpoint
     async def put_devices_data(self, device_id, endpoint_id, name, value):
         # For shutter, value is the percentage of closing
-        body = '[{"name":"' + name + '","value":"' + value + '"}]'
-        # endpoint_id is the endpoint = the device (shutter in this case) to
-        # open.
-        str_request = (
-            self.cmd_prefix +
-            f"PUT /devices/{device_id}/endpoints/{endpoint_id}/data HTTP/1.1\r\nContent-Length: " +
-            str(
-                len(body)) +
-            "\r\nContent-Type: application/json; charset=UTF-8\r\nTransac-Id: 0\r\n\r\n" +
-            body +
-            "\r\n\r\n")
-        a_bytes = bytes(str_request, "ascii")
+        logger.debug("Sending message to tydom (%s %s=%s)",
+                     "PUT devices data", name, value)
+        body = self.request_encoder.encode_entry(name, value)
+        return await self.put_endpoint_body(device_id, endpoint_id, body)
+
+    # Give several orders ({name: value}) to an endpoint in one request,
+    # return the status of the Tydom acknowledgement
+    async def put_endpoint_data(self, device_id, endpoint_id, entries):
         logger.debug("Sending message to tydom (%s %s)",
-                     "PUT devices data", body)
-        await self.connection.send(a_bytes)
-        return 0
+                     "PUT devices data", entries)
+        body = self.request_encoder.encode_entries(entries)
+        return await self.put_endpoint_body(device_id, endpoint_id, body)
+
+    async def put_endpoint_body(self, device_id, endpoint_id, body):
+        url = self.request_encoder.get_endpoint_data_url(device_id, endpoint_id)
+        response = await self.request("PUT", url, body=body)
+        return response.status
+
+    # Give many orders (device_id, endpoint_id, name, value) known at once
+    # (scenes, group actions) with the fewest requests: one per endpoint,
+    # sent concurrently. Return the status of each endpoint, or the
+    # exception of its request (the others are still sent)
+    async def put_devices_data_batch(self, orders):
+        groups = group_orders(orders)
+        statuses = await asyncio.gather(*[
+            self.put_endpoint_data(device_id, endpoint_id, entries)
+            for (device_id, endpoint_id), entries in groups.items()],
+            return_exceptions=True)
+        return dict(zip(groups, statuses))
+
+    # Give order (name + value) to endpoint, orders sent for the same
+    # endpoint within the coalescing window are merged into the latest one.
+    # Used for the orders received one by one from MQTT (cover sliders)
+    async def put_devices_data_coalesced(self, device_id, endpoint_id, name, value):
+        async def send(order):
+            return await self.put_devices_data(device_id, endpoint_id, order[0], order[1])
+        return await self.command_coalescer.submit(
+            (str(device_id), str(endpoint_id)), (name, value), send)
 
     async def put_areas_data(self, area_id, data):
-        formatted_data = []
-        for key, value in data.items():
-            formatted_data.append({"name": key, "value": value})
-        body = json.dumps(formatted_data)
-        str_request = (
-            self.cmd_prefix +
-            f"PUT /areas/{area_id}/data HTTP/1.1\r\nContent-Length: " +
-            str(len(body)) +
-            "\r\nContent-Type: application/json; charset=UTF-8\r\nTransac-Id: 0\r\n\r\n" +
-            body +
-            "\r\n\r\n")
-        a_bytes = bytes(str_request, "ascii")
         logger.debug("Sending message to tydom (%s %s)",
-                     "PUT areas data", body)
-        await self.connection.send(a_bytes)
+                     "PUT areas data", data)
+        body = self.request_encoder.encode_entries(data)
+        await self.send_message("PUT", f"/areas/{area_id}/data", body=body)
         return 0
 
     async def put_alarm_cdata(self, device_id, alarm_id=None, value=None, zone_cmd='zoneCmd', zone_id=None):
@@ -313,48 +522,33 @@ class TydomClient:
         try:
             if value in histo_values:
                 cmd = "histo"
-                body = ('{"value":"' + str(value) +
-                        '","pwd":"' + str(self.alarm_pin) + '"}')
-            elif value is "ACK":
+                body = {"value": str(value), "pwd": str(self.alarm_pin)}
+            elif value == "ACK":
                 cmd = "ackEventCmd"
-                body = ('{"pwd":"' + str(self.alarm_pin) + '"}')
+                body = {"pwd": str(self.alarm_pin)}
             elif zone_id is None:
                 cmd = "alarmCmd"
-                body = ('{"value":"' + str(value) +
-                        '","pwd":"' + str(self.alarm_pin) + '"}')
+                body = {"value": str(value), "pwd": str(self.alarm_pin)}
             else:
                 cmd = zone_cmd
+                body = {"value": str(value), "pwd": str(self.alarm_pin)}
                 if 'part' in zone_cmd:
-                    target = '"part":"' + str(zone_id) + '"'
+                    body["part"] = str(zone_id)
                 else:
-                    target = '"zones":"[' + str(zone_id) + ']"'    
-                body = (
-                    '{"value":"' + str(value) + 
-                    '","pwd":"' + str(self.alarm_pin) + 
-                    '",' + target + '}'
-                )
-
-            str_request = (
-                self.cmd_prefix +
-                "PUT /devices/{device}/endpoints/{alarm}/cdata?name={cmd} HTTP/1.1\r\nContent-Length: ".format(
-                    device=str(device_id),
-                    alarm=str(alarm_id),
-                    cmd=str(cmd)) +
-                str(
-                    len(body)) +
-                "\r\nContent-Type: application/json; charset=UTF-8\r\nTransac-Id: 0\r\n\r\n" +
-                body +
-                "\r\n\r\n")
-
-            a_bytes = bytes(str_request, "ascii")
-            logger.debug('Sending message to tydom (%s %s)','PUT cdata',body),
+                    body["zones"] = "[" + str(zone_id) + "]"
+
+            # The body carries the alarm pin, it is never logged
+            logger.debug('Sending message to tydom (%s %s)', 'PUT cdata', cmd)
 
             try:
-                await self.connection.send(a_bytes)
+                await self.send_message(
+                    "PUT",
+                    "/devices/{device}/endpoints/{alarm}/cdata?name={cmd}".format(
+                        device=device_id, alarm=alarm_id, cmd=cmd),
+                    body=body, lane=LANE_ALARM)
                 return 0
             except BaseException:
-                logger.error("put_alarm_cdata ERROR !", exc_info=True)
-                logger.error(a_bytes)
+                logger.error("put_alarm_cdata ERROR ! (cmd=%s)", cmd, exc_info=True)
         except BaseException:
             logger.error("put_alarm_cdata ERROR !", exc_info=True)
 
@@ -362,27 +556,19 @@ class TydomClient:
     async def get_info(self):
         msg_type = "/info"
         req = "GET"
-        await self.send_message(method=req, msg=msg_type)
+        await self.send_message(method=req, msg=msg_type, lane=LANE_POLL)
 
     # Refresh (all)
     async def post_refresh(self):
         msg_type = "/refresh/all"
         req = "POST"
-        await self.send_message(method=req, msg=msg_type)
-        # Get poll device data
-        nb_poll_devices = len(self.poll_device_urls)
-        if self.current_poll_index < nb_poll_devices - 1:
-            self.current_poll_index = self.current_poll_index + 1
-        else:
-            self.current_poll_index = 0
-        if nb_poll_devices > 0:
-            await self.get_poll_device_data(self.poll_device_urls[self.current_poll_index])
+        await self.send_message(method=req, msg=msg_type, lane=LANE_POLL)
 
     # Get the moments (programs)
     async def get_moments(self):
         msg_type = "/moments/file"
         req = "GET"
-        await self.send_message(method=req, msg=msg_type)
+        await self.send_message(method=req, msg=msg_type, lane=LANE_POLL)
 
     # Get the scenarios
     async def get_scenarii(self):
@@ -401,64 +587,112 @@ class TydomClient:
     async def get_devices_meta(self):
         msg_type = "/devices/meta"
         req = "GET"
-        await self.send_message(method=req, msg=msg_type)
+        await self.send_message(method=req, msg=msg_type, lane=LANE_POLL)
 
     # Get all devices data
     async def get_devices_data(self):
         msg_type = "/devices/data"
         req = "GET"
-        await self.send_message(method=req, msg=msg_type)
-        # Get poll devices data
-        for url in self.poll_device_urls:
-            await self.get_poll_device_data(url)
+        await self.send_message(method=req, msg=msg_type, lane=LANE_POLL)
+        # Get poll devices data (sent by the poll scheduler)
+        self.poll_scheduler.poll_all()
 
     # List the device to get the endpoint id
     async def get_configs_file(self):
         msg_type = "/configs/file"
         req = "GET"
-        await self.send_message(method=req, msg=msg_type)
+        await self.send_message(method=req, msg=msg_type, lane=LANE_POLL)
 
     # Get metadata configuration to list poll devices (like Tywatt)
     async def get_devices_cmeta(self):
         msg_type = "/devices/cmeta"
         req = "GET"
-        await self.send_message(method=req, msg=msg_type)
+        await self.send_message(method=req, msg=msg_type, lane=LANE_POLL)
 
     # Get all areas data
     async def get_areas_data(self):
         msg_type = "/areas/data"
         req = "GET"
-        await self.send_message(method=req, msg=msg_type)
+        await self.send_message(method=req, msg=msg_type, lane=LANE_POLL)
 
-    async def get_data(self):
-        await self.get_configs_file()
-        await self.get_devices_cmeta()
+    # The configuration is known (registry snapshot, previous connection)
+    @property
+    def configuration_known(self):
+        return self.registry is not None and self.registry.configuration is not None
+
+    async def get_states(self):
         await self.get_devices_data()
         await self.get_areas_data()
 
+    async def get_data(self):
+        warm = self.configuration_known
+        if warm:
+            # States are published right away, before the configuration check
+            await self.get_states()
+        if await self.sync_configuration() or not warm:
+            await self.get_states()
+
+    # Ask for the configuration, and for the devices metadata when the
+    # configuration changed since they were last asked. Return False when
+    # the metadata was not requested (configuration unchanged)
+    async def sync_configuration(self):
+        fingerprint = None
+        try:
+            response = await self.request(
+                "GET", "/configs/file", timeout=self.connect_timeout,
+                lane=LANE_POLL)
+            fingerprint = DeviceRegistry.fingerprint(response.body)
+        except asyncio.TimeoutError:
+            logger.warning('No answer to /configs/file from tydom')
+        if self.registry is not None and fingerprint is not None and \
+                fingerprint == self.registry.cmeta_config_fingerprint:
+            logger.info('Configuration unchanged, devices metadata not requested')
+            return False
+        try:
+            await self.request(
+                "GET", "/devices/cmeta", timeout=self.connect_timeout,
+                lane=LANE_POLL)
+        except asyncio.TimeoutError:
+            logger.warning('No answer to /devices/cmeta from tydom')
+            return True
+        if self.registry is not None and fingerprint is not None:
+            self.registry.cmeta_config_fingerprint = fingerprint
+            self.registry.dirty = True
+            self.registry.save()
+        return True
+
     # Give order to endpoint
     async def get_device_data(self, id):
         # 10 here is the endpoint = the device (shutter in this case) to open.
         device_id = str(id)
-        str_request = (self.cmd_prefix + f"GET /devices/{device_id}/endpoints/{device_id}/data HTTP/1.1\r\nContent-Length: 0\r\nContent-Type: application/json; charset=UTF-8\r\nTransac-Id: 0\r\n\r\n")
-        a_bytes = bytes(str_request, "ascii")
-        await self.connection.send(a_bytes)
+        await self.send_message(
+            method="GET", msg=f"/devices/{device_id}/endpoints/{device_id}/data")
 
     async def get_area_data(self, id):
         device_id = str(id)
-        str_request = (
-            self.cmd_prefix +
-            f"GET /areas/{device_id}/data HTTP/1.1\r\nContent-Length: 0\r\nContent-Type: application/json; charset=UTF-8\r\nTransac-Id: 0\r\n\r\n")
-        a_bytes = bytes(str_request, "ascii")
-        await self.connection.send(a_bytes)
+        await self.send_message(method="GET", msg=f"/areas/{device_id}/data")
 
     async def get_poll_device_data(self, url):
         msg_type = url
         req = "GET"
-        await self.send_message(method=req, msg=msg_type)
+        await self.send_message(method=req, msg=msg_type, lane=LANE_POLL)
+
+    # After a reconnection: the configuration is already known, only ask
+    # for the current devices state
+    async def resync(self):
+        logger.info("Resync tydom client")
+        await self.get_states()
+        self.poll_scheduler.start()
 
     async def setup(self):
         logger.info("Setup tydom client")
+        self.poll_scheduler.start()
+        warm = self.configuration_known
+        if warm:
+            # Warm start: states are published before anything else
+            await self.get_states()
         await self.get_info()
         await self.post_refresh()
-        await self.get_data()
+        if await self.sync_configuration() or not warm:
+            await self.get_states()
+        self.setup_done = True